@@ -0,0 +1,188 @@
+import fcntl
+import itertools
+import json
+import os
+import tempfile
+import time
+
+from memory_usage import process_alive
+from uploads import UploadRejected
+
+# Total estimated cost of the requests processed at once across all workers; 0 disables admission control
+ADMISSION_CAPACITY = int(os.environ.get("ADMISSION_CAPACITY", 2000))
+# Uploaded bytes that cost as much as one page
+ADMISSION_BYTES_PER_UNIT = int(os.environ.get("ADMISSION_BYTES_PER_UNIT", 1024 * 1024))
+# Retry-After (seconds) sent with 503 responses
+ADMISSION_RETRY_AFTER = int(os.environ.get("ADMISSION_RETRY_AFTER", 5))
+# Directory of the admission state file shared by the workers of one host
+ADMISSION_DIR = os.environ.get("ADMISSION_DIR") or tempfile.gettempdir()
+
+# Server-side page / wall-clock limits of one extract-text or get-checkboxes request; 0 = unlimited.
+# Both are opt-in: a budget changes the response shape (a Truncated marker), so it is off by default
+REQUEST_PAGE_BUDGET = int(os.environ.get("REQUEST_PAGE_BUDGET", 0))
+REQUEST_TIME_BUDGET = float(os.environ.get("REQUEST_TIME_BUDGET", 0))
+
+
+class Overloaded(UploadRejected):
+    """The admission controller has no room for a request right now"""
+
+    def __init__(self, retry_after=ADMISSION_RETRY_AFTER):
+        super().__init__("Server is at capacity, retry later", status=503,
+                         headers={"Retry-After": str(retry_after)})
+
+
+def estimate_cost(size_bytes, page_count):
+    """Relative cost of a request: its pages plus its bytes in ADMISSION_BYTES_PER_UNIT units"""
+    return max(1, page_count) + size_bytes / ADMISSION_BYTES_PER_UNIT
+
+
+class Ticket:
+    """An admitted request's share of the capacity; release() (or leaving the with block) returns it"""
+
+    def __init__(self, controller, key, cost):
+        self.controller = controller
+        self.key = key
+        self.cost = cost
+
+    def release(self):
+        if self.key is not None:
+            self.controller._release(self.key)
+            self.key = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class AdmissionController:
+    """Weighted semaphore shared by every worker of a host through a locked state file
+
+    Each admitted request records its pid and estimated cost. Entries of
+    processes that died are dropped on the next update, so a killed worker
+    can't leak capacity. A request costlier than the whole capacity is only
+    admitted when nothing else is running.
+    """
+
+    def __init__(self, capacity=ADMISSION_CAPACITY, directory=ADMISSION_DIR, retry_after=ADMISSION_RETRY_AFTER):
+        self.capacity = capacity
+        self.retry_after = retry_after
+        self.path = os.path.join(directory, "pymupdf-admission.json")
+        self._ids = itertools.count()
+
+    @property
+    def enabled(self):
+        return self.capacity > 0
+
+    def _update(self, fn):
+        with open(self.path, "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                data = f.read()
+                try:
+                    entries = json.loads(data) if data else {}
+                except ValueError:
+                    entries = {}
+                entries = {key: entry for key, entry in entries.items() if process_alive(entry["pid"])}
+                result = fn(entries)
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(entries))
+                return result
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def admit(self, cost):
+        """Reserve cost units or raise Overloaded (a 503 with Retry-After)"""
+        if not self.enabled:
+            return Ticket(self, None, cost)
+        key = f"{os.getpid()}-{next(self._ids)}"
+
+        def reserve(entries):
+            load = sum(entry["cost"] for entry in entries.values())
+            if entries and load + cost > self.capacity:
+                return False
+            entries[key] = {"pid": os.getpid(), "cost": cost, "since": time.time()}
+            return True
+
+        if not self._update(reserve):
+            raise Overloaded(self.retry_after)
+        return Ticket(self, key, cost)
+
+    def _release(self, key):
+        self._update(lambda entries: entries.pop(key, None))
+
+    def load(self):
+        """(cost in flight, requests in flight)"""
+        if not self.enabled:
+            return 0, 0
+        return self._update(lambda entries: (sum(entry["cost"] for entry in entries.values()), len(entries)))
+
+
+class RequestBudget:
+    """Page and wall-clock limits of one request, enforced between pages
+
+    The clock starts when the budget is created. At least one page is always
+    processed; once a limit is hit the page loop stops and truncated describes
+    where it stopped.
+    """
+
+    def __init__(self, max_pages=REQUEST_PAGE_BUDGET, seconds=REQUEST_TIME_BUDGET):
+        self.max_pages = max_pages
+        self.seconds = seconds
+        self.started = time.monotonic()
+        self.truncated = None
+
+    @classmethod
+    def from_form(cls, form):
+        """Server budget, lowered by max_pages= / time_budget= (raises ValueError on bad input)"""
+        max_pages, seconds = REQUEST_PAGE_BUDGET, REQUEST_TIME_BUDGET
+        if form.get("max_pages"):
+            requested = form.get("max_pages", type=int)
+            if requested is None or requested < 1:
+                raise ValueError("max_pages must be a positive integer")
+            max_pages = min(max_pages, requested) if max_pages else requested
+        if form.get("time_budget"):
+            requested = form.get("time_budget", type=float)
+            if requested is None or requested <= 0:
+                raise ValueError("time_budget must be a positive number of seconds")
+            seconds = min(seconds, requested) if seconds else requested
+        return cls(max_pages, seconds)
+
+    def limit(self, pages, page_numbers):
+        """Yield (page_num, result) from pages (in page_numbers order) until a limit is hit"""
+        done = 0
+        pages = iter(pages)
+        try:
+            for item in pages:
+                yield item
+                done += 1
+                if done == len(page_numbers):
+                    return
+                reason = None
+                if self.max_pages and done >= self.max_pages:
+                    reason = "page_budget"
+                elif self.seconds and time.monotonic() - self.started >= self.seconds:
+                    reason = "time_budget"
+                if reason:
+                    self.truncated = {
+                        "type": "Truncated",
+                        "reason": reason,
+                        "pages_done": done,
+                        "pages_total": len(page_numbers),
+                        "next_page": page_numbers[done] + 1,
+                    }
+                    return
+        finally:
+            # Stops a sharded iter_pages, cancelling the shards that haven't started
+            close = getattr(pages, "close", None)
+            if close is not None:
+                close()
+
+    def select(self, page_numbers):
+        """The pages worth starting: the page budget cuts the list before any work is scheduled"""
+        if self.max_pages and len(page_numbers) > self.max_pages:
+            return page_numbers[:self.max_pages]
+        return page_numbers
@@ -0,0 +1,60 @@
+import fitz  # PyMuPDF
+
+from checkbox_detection import page_checkboxes
+from instrumentation import stage
+from text_extraction import classify_page, page_text
+
+# Operations /api/analyze can run on one upload
+ANALYZE_OPERATIONS = ("page_count", "text", "checkboxes", "extract_pages")
+
+
+def analyze_page(page, filename, text_features=None, checkbox_options=None):
+    """Text entries and checkboxes of one page from a single text extraction
+
+    text_features / checkbox_options of None skip that operation. Returns
+    (text page, checkbox list), each None when skipped.
+    """
+    want_text = text_features is not None
+    want_checkboxes = checkbox_options is not None
+    structured = (
+        want_text and not text_features.isdisjoint(("lines", "spans", "tables"))
+        or want_checkboxes and "visual" in checkbox_options["features"]
+    )
+    plain_text, text_dict = page_text(page, plain=want_text and "debug" in text_features,
+                                      structured=structured)
+
+    text = None
+    if want_text:
+        with stage("classify"):
+            content = classify_page(text_dict, page.number, filename, plain_text, text_features)
+        text = {
+            "page_number": page.number + 1,
+            "content": content
+        }
+    checkboxes = None
+    if want_checkboxes:
+        checkboxes = page_checkboxes(
+            page, checkbox_options["detection_params"], checkbox_options["detection_method"],
+            checkbox_options["raster_mode"], checkbox_options["features"], text_dict=text_dict
+        )
+    return text, checkboxes
+
+
+def page_runs(page_numbers):
+    """Group sorted 0-based page numbers into (first, last) runs of consecutive pages"""
+    runs = []
+    for page_num in page_numbers:
+        if runs and runs[-1][1] == page_num - 1:
+            runs[-1][1] = page_num
+        else:
+            runs.append([page_num, page_num])
+    return [tuple(run) for run in runs]
+
+
+def copy_pages(doc, page_numbers):
+    """New document with the given pages, copying each consecutive run in one insert_pdf call"""
+    new_pdf = fitz.open()
+    with stage("copy"):
+        for first, last in page_runs(page_numbers):
+            new_pdf.insert_pdf(doc, from_page=first, to_page=last)
+    return new_pdf
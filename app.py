@@ -1,19 +1,53 @@
-from flask import Flask, request, jsonify, render_template_string, send_file
+from flask import Flask, Response, g, request, jsonify, render_template_string, send_file, stream_with_context, url_for
 import fitz  # PyMuPDF
 import io
 import json
 from PIL import Image
 import base64
-from flask_httpauth import HTTPBasicAuth
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask.json.provider import DefaultJSONProvider
+from flask_httpauth import HTTPBasicAuth, HTTPTokenAuth, MultiAuth
+from werkzeug.security import generate_password_hash
 import os
 import zipfile
-import hashlib
+import time
 import traceback  # Add this import for error reporting
-import re  # Add this import for regular expressions
+from admission import AdmissionController, RequestBudget, estimate_cost
+from analysis import ANALYZE_OPERATIONS, analyze_page, copy_pages
+from checkbox_detection import DETECTOR_VERSION, checkbox_options_from_form, page_checkboxes
+from credentials import CredentialVerifier, TokenIssuer
+from output_formats import columnar_document, columnar_page, compress_response, dumps
+from instrumentation import PROFILE_REQUESTS, MetricsRegistry, RequestProfiler, render_prometheus, stage, start_request
+from jobs import DONE, FAILED, FINISHED_STATES, QUEUED, JobRunner, JobStore, job_params_from_form, job_status
+from page_executor import iter_pages
+from redaction import apply_redactions, locations_by_page, page_pattern_rects, parse_patterns, redaction_save_options
+from rendering import RENDER_FORMATS, RenderCache, render_etag, render_options_from_form, write_render_zip
+from result_cache import RESULT_CACHE_VERSION, ResultCache
+from selection import (
+    CHECKBOX_FEATURES, TEXT_FEATURES, page_ranges_from_form, parse_features, parse_page_ranges, resolve_pages
+)
+from text_extraction import CLASSIFIER_VERSION, extract_page_content
+from memory_usage import peak_rss_kb, reset_peak_rss
+from splitting import save_options_from_form, split_ranges, write_split_zip
+from uploads import MAX_UPLOAD_BYTES, UPLOAD_SPOOL_DIR, PdfUpload, SpoolingRequest, UploadRejected
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """Flask's JSON provider, timing jsonify as the serialize stage"""
+
+    def dumps(self, obj, **kwargs):
+        with stage("serialize"):
+            return super().dumps(obj, **kwargs)
 
 app = Flask(__name__)
-auth = HTTPBasicAuth()
+app.json = TimedJSONProvider(app)
+# Large uploads are spooled to disk and opened by filename instead of being read into memory
+app.request_class = SpoolingRequest
+if MAX_UPLOAD_BYTES:
+    # Werkzeug answers 413 before parsing the body
+    app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES
+basic_auth = HTTPBasicAuth()
+token_auth = HTTPTokenAuth(scheme="Bearer")
+# Routes accept either Basic credentials or a bearer token from /api/token
+auth = MultiAuth(basic_auth, token_auth)
 # Fetching credentials from environment variables
 API_USERNAME = os.environ.get("API_USERNAME")
 API_PASSWORD = os.environ.get("API_PASSWORD")
@@ -24,9 +58,134 @@ users = {
     API_USERNAME: generate_password_hash(API_PASSWORD)
 }
 
-@auth.verify_password
+# Remembers successful checks for AUTH_CACHE_TTL seconds instead of re-running the slow hash
+credential_verifier = CredentialVerifier(users)
+token_issuer = TokenIssuer()
+
+@basic_auth.verify_password
 def verify_password(username, password):
-    return username in users and check_password_hash(users.get(username), password)
+    return credential_verifier.verify(username, password)
+
+@token_auth.verify_token
+def verify_token(token):
+    username = token_issuer.verify(token)
+    return username if username in users else None
+
+# Per-worker counters and histograms; /metrics merges the files of all workers
+metrics = MetricsRegistry()
+
+# Weighted semaphore over all workers of the host; saturated requests get 503 + Retry-After
+admission = AdmissionController()
+
+# Long-running documents go through the job API; state is shared by all workers through JOB_DIR
+job_store = JobStore()
+job_runner = JobRunner(job_store)
+
+# Results keyed on the uploaded bytes; classifier/detector changes invalidate old entries
+result_cache = ResultCache(version="-".join((RESULT_CACHE_VERSION, CLASSIFIER_VERSION, DETECTOR_VERSION)))
+
+# Encoded page images of /api/render, shared by single renders and batch zips
+render_cache = RenderCache()
+
+def cache_key_for(upload, endpoint, params):
+    return result_cache.key(upload.digest(), endpoint, params) if result_cache.enabled else None
+
+def cached_response(cache_key):
+    """Response replayed from the result cache, or None"""
+    cached = result_cache.get(cache_key) if cache_key else None
+    if cached is None:
+        return None
+    body, mimetype = cached
+    return Response(body, mimetype=mimetype, headers={"X-Cache": "HIT"})
+
+def cache_response(cache_key, response):
+    """Store a successful response in the result cache"""
+    if cache_key:
+        result_cache.put(cache_key, response.get_data(), response.mimetype)
+        response.headers["X-Cache"] = "MISS"
+    return response
+
+def open_admitted(upload, page_ranges=None):
+    """Open the upload and reserve its estimated cost with the admission controller
+
+    Raises Overloaded (a 503 with Retry-After) when the host is saturated.
+    Returns (doc, ticket); release the ticket when the work is done.
+    """
+    doc = upload.open()
+    try:
+        page_count = len(resolve_pages(page_ranges, doc.page_count))
+        ticket = admission.admit(estimate_cost(upload.size, page_count))
+    except BaseException:
+        doc.close()
+        raise
+    return doc, ticket
+
+def receive_upload():
+    """Parse (and spool) the request body so its time shows up as its own stage; call only after auth"""
+    with stage("upload"):
+        return request.files
+
+def release_document(doc, ticket, upload=None):
+    """Close a document, return its admission ticket and drop a retained upload; safe to call more than once"""
+    if not doc.is_closed:
+        doc.close()
+    ticket.release()
+    if upload is not None:
+        upload.release()
+
+def budgeted_response(cache_key, budget, response):
+    """Cache a complete response; mark (and don't cache) one cut short by its budget
+
+    The page budget is part of the cache key, so a full response cached for one
+    request is never replayed to a request whose budget would have cut it short.
+    A time budget is not: a cached complete response costs no page work.
+    """
+    if budget.truncated:
+        response.headers["X-Truncated"] = budget.truncated["reason"]
+        return response
+    return cache_response(cache_key, response)
+
+@app.before_request
+def start_instrumentation():
+    g.timings = start_request()
+    g.profiler = None
+    if PROFILE_REQUESTS and (request.headers.get("X-Profile") == "1" or request.args.get("profile") == "1"):
+        g.profiler = RequestProfiler()
+
+@app.after_request
+def report_timings(response):
+    # Registered first so it runs last and sees every other stage
+    timings = g.get("timings")
+    if timings is None:
+        return response
+    seconds = time.perf_counter() - timings.started
+    response.headers["Server-Timing"] = timings.server_timing(seconds)
+    if g.profiler is not None:
+        response.headers["X-Profile-File"] = g.profiler.dump(request.endpoint or "unmatched")
+    endpoint, bytes_in = request.endpoint or "unmatched", request.content_length
+    if response.is_streamed and not response.direct_passthrough:
+        # Generated bodies (ndjson) do their work while being sent: record them once the stream is closed
+        response.call_on_close(lambda: metrics.record_request(
+            endpoint, response.status_code, timings, time.perf_counter() - timings.started, bytes_in, None))
+        return response
+    metrics.record_request(endpoint, response.status_code, timings, seconds, bytes_in, response.content_length)
+    return response
+
+@app.before_request
+def start_peak_rss():
+    reset_peak_rss()
+
+@app.after_request
+def report_peak_rss(response):
+    # Peak RSS of this worker while handling the request
+    response.headers["X-Peak-RSS-KB"] = str(peak_rss_kb())
+    return response
+
+@app.after_request
+def compress_json(response):
+    # gzip/br for buffered JSON bodies when the client asks for it
+    with stage("compress"):
+        return compress_response(response, request.headers.get("Accept-Encoding"))
 
 # HTML template for the web interface
 HTML_TEMPLATE = '''
@@ -61,16 +220,19 @@ HTML_TEMPLATE = '''
 @app.route('/', methods=['GET', 'POST'])
 def upload_file():
     if request.method == 'POST':
-        if 'pdf_file' not in request.files:
+        if 'pdf_file' not in receive_upload():
             return "No file part", 400
         file = request.files['pdf_file']
         if file.filename == '':
             return "No selected file", 400
         try:
-            pdf = fitz.open(stream=file.read(), filetype="pdf")
+            pdf = PdfUpload(file).open()
             num_pages = pdf.page_count
+            pdf.close()
             result = f"The uploaded PDF has {num_pages} pages."
             return render_template_string(HTML_TEMPLATE, result=result)
+        except UploadRejected as e:
+            return str(e), e.status, e.headers
         except Exception as e:
             return f"An error occurred while processing the PDF: {str(e)}", 500
     return render_template_string(HTML_TEMPLATE)
@@ -78,7 +240,7 @@ def upload_file():
 @app.route('/api/extract_pages', methods=['POST'])
 @auth.login_required
 def extract_pages():
-    if 'pdf_file' not in request.files:
+    if 'pdf_file' not in receive_upload():
         return jsonify({"error": "No file part"}), 400
     file = request.files['pdf_file']
     if file.filename == '':
@@ -92,288 +254,267 @@ def extract_pages():
     if page_start > page_end:
         return jsonify({"error": "page_start cannot be greater than page_end"}), 400
     try:
+        save_options = save_options_from_form(request.form)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        upload = PdfUpload(file)
+        cache_key = cache_key_for(upload, "extract_pages", {"page_start": page_start, "page_end": page_end,
+                                                            "save": save_options})
+        cached = result_cache.get(cache_key) if cache_key else None
+        if cached is not None:
+            response = send_file(io.BytesIO(cached[0]), as_attachment=True, download_name="extracted_pages.pdf", mimetype='application/pdf')
+            response.headers["X-Cache"] = "HIT"
+            return response
         # Open the original PDF
-        pdf = fitz.open(stream=file.read(), filetype="pdf")
-        total_pages = pdf.page_count
-        # Adjust page_end if it exceeds total_pages
-        if page_end > total_pages:
-            page_end = total_pages
-        # Create a new PDF to hold the extracted pages
-        new_pdf = fitz.open()
-        for page_num in range(page_start, page_end + 1):
-            new_pdf.insert_pdf(pdf, from_page=page_num - 1, to_page=page_num - 1)  # Zero-based indexing
-        # Prepare the PDF to be returned
-        pdf_stream = io.BytesIO()
-        new_pdf.save(pdf_stream)  # Save to an in-memory stream
-        new_pdf.close()
+        pdf, ticket = open_admitted(upload, [(page_start, page_end)])
+        with ticket:
+            try:
+                total_pages = pdf.page_count
+                # Adjust page_end if it exceeds total_pages
+                if page_end > total_pages:
+                    page_end = total_pages
+                # Copy the whole range in one insert_pdf call (zero-based indexing)
+                new_pdf = copy_pages(pdf, range(page_start - 1, page_end))
+                try:
+                    # Prepare the PDF to be returned
+                    pdf_stream = io.BytesIO()
+                    with stage("save"):
+                        new_pdf.save(pdf_stream, **save_options)  # Save to an in-memory stream
+                finally:
+                    new_pdf.close()
+            finally:
+                pdf.close()
+        if cache_key:
+            result_cache.put(cache_key, pdf_stream.getvalue(), 'application/pdf')
         pdf_stream.seek(0)  # Reset stream position to the beginning
-        return send_file(pdf_stream, as_attachment=True, download_name="extracted_pages.pdf", mimetype='application/pdf')
+        response = send_file(pdf_stream, as_attachment=True, download_name="extracted_pages.pdf", mimetype='application/pdf')
+        if cache_key:
+            response.headers["X-Cache"] = "MISS"
+        return response
+    except UploadRejected as e:
+        return jsonify({"error": str(e)}), e.status, e.headers
     except Exception as e:
         return jsonify({"error": f"An error occurred: {str(e)}"}), 500
 
-if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=6000, debug=True)
+@app.route('/api/split', methods=['POST'])
+@auth.login_required
+def split():
+    """Split one upload into a PDF per page range, returned as a zip"""
+    if 'pdf_file' not in receive_upload():
+        return jsonify({"error": "No file part"}), 400
+    file = request.files['pdf_file']
+    if file.filename == '':
+        return jsonify({"error": "No selected file"}), 400
+    if not request.form.get('ranges'):
+        return jsonify({"error": "ranges must list the page ranges to split out, e.g. 1-3,4-10,11-"}), 400
+    try:
+        save_options = save_options_from_form(request.form)
+        parse_page_ranges(request.form['ranges'])
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        pdf, ticket = open_admitted(PdfUpload(file))
+        with ticket:
+            try:
+                pairs = split_ranges(request.form['ranges'], pdf.page_count)
+                archive = write_split_zip(pdf, pairs, save_options, spool_dir=UPLOAD_SPOOL_DIR)
+            finally:
+                pdf.close()
+        # send_file streams the temp file in chunks and closes (deletes) it afterwards
+        response = send_file(archive, as_attachment=True, download_name="split.zip", mimetype='application/zip')
+        response.headers["X-Split-Parts"] = str(len(pairs))
+        return response
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except UploadRejected as e:
+        return jsonify({"error": str(e)}), e.status, e.headers
+    except Exception as e:
+        return jsonify({"error": f"An error occurred: {str(e)}"}), 500
+
+@app.route('/api/render', methods=['POST'])
+@auth.login_required
+def render():
+    """Render one page (page=) as an image, or the pages of pages= as a zip of images"""
+    if 'pdf_file' not in receive_upload():
+        return jsonify({"error": "No file part"}), 400
+    file = request.files['pdf_file']
+    if file.filename == '':
+        return jsonify({"error": "No selected file"}), 400
+    try:
+        options = render_options_from_form(request.form)
+        page_ranges = parse_page_ranges(request.form['pages']) if request.form.get('pages') else None
+        page = request.form.get('page') or "1"
+        if not page.isdigit() or int(page) < 1:
+            raise ValueError("page must be a positive integer")
+        page = int(page)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        upload = PdfUpload(file)
+        if page_ranges is None:
+            return render_single_page(upload, page - 1, options)
+        etag = render_etag(upload.digest(), [list(r) for r in page_ranges], options)
+        if request.if_none_match.contains(etag):
+            return Response(status=304, headers={"ETag": f'"{etag}"'})
+        pdf, ticket = open_admitted(upload, page_ranges)
+        with ticket:
+            try:
+                page_numbers = resolve_pages(page_ranges, pdf.page_count)
+                if not page_numbers:
+                    raise ValueError(f"No pages selected; the document has {pdf.page_count} pages")
+                archive, hits = write_render_zip(pdf, upload.digest(), page_numbers, options, render_cache,
+                                                 spool_dir=UPLOAD_SPOOL_DIR)
+            finally:
+                pdf.close()
+        # send_file streams the temp file in chunks and closes (deletes) it afterwards
+        response = send_file(archive, as_attachment=True, download_name="pages.zip", mimetype='application/zip')
+        response.set_etag(etag)
+        response.headers["X-Rendered-Pages"] = str(len(page_numbers))
+        response.headers["X-Cache-Hits"] = str(hits)
+        return response
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except UploadRejected as e:
+        return jsonify({"error": str(e)}), e.status, e.headers
+    except Exception as e:
+        return jsonify({"error": f"An error occurred: {str(e)}"}), 500
+
+def render_single_page(upload, page_num, options):
+    """Image response of one page; conditional and cached requests never open the document"""
+    etag = render_etag(upload.digest(), [page_num], options)
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers={"ETag": f'"{etag}"'})
+    data = render_cache.get(upload.digest(), page_num, options)
+    cache_status = "HIT"
+    if data is None:
+        pdf, ticket = open_admitted(upload, [(page_num + 1, page_num + 1)])
+        with ticket:
+            try:
+                if page_num >= pdf.page_count:
+                    raise ValueError(f"page {page_num + 1} does not exist; the document has {pdf.page_count} pages")
+                data, _ = render_cache.render(pdf, upload.digest(), page_num, options)
+            finally:
+                pdf.close()
+        cache_status = "MISS"
+    response = Response(data, mimetype=RENDER_FORMATS[options["format"]][0])
+    response.set_etag(etag)
+    response.headers["X-Cache"] = cache_status
+    return response
 
 @app.route('/api/extract-text', methods=['POST'])
 @auth.login_required
 def extract_text():
     """Extract structured text from PDF with page ordering"""
-    if 'pdf_file' not in request.files:
+    if 'pdf_file' not in receive_upload():
         return jsonify({"error": "No file part"}), 400
     
     file = request.files['pdf_file']
     if file.filename == '':
         return jsonify({"error": "No selected file"}), 400
     
+    output_format = request.form.get('format', 'json')
+    if output_format not in ('json', 'ndjson', 'columnar'):
+        return jsonify({"error": "format must be one of json, ndjson, columnar"}), 400
+    try:
+        page_ranges = page_ranges_from_form(request.form)
+        features = parse_features(request.form.get('features'), TEXT_FEATURES)
+        budget = RequestBudget.from_form(request.form)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
     try:
         # Read file content
-        pdf_data = file.read()
-        doc = fitz.open(stream=pdf_data, filetype="pdf")
-        
-        # Initialize ordered result dictionary
-        ordered_result = {}
-        
-        # Process each page
-        for page_num in range(len(doc)):
-            page = doc[page_num]
-            page_key = f"page_{page_num + 1}"
-            ordered_result[page_key] = {
-                "page_number": page_num + 1,
-                "content": {}
-            }
-            
-            # Extract text as plain text for debugging
-            plain_text = page.get_text("text")
-            debug_id = hashlib.md5(f"debug_page_{page_num}".encode()).hexdigest()
-            ordered_result[page_key]["content"][debug_id] = {
-                "type": "Debug",
-                "text": plain_text,
-                "metadata": {
-                    "filetype": "application/pdf",
-                    "page_number": page_num + 1,
-                    "filename": file.filename
-                }
-            }
-            
-            # Get text with structure information
-            text_dict = page.get_text("dict")
-            
-            # Track labels to identify field types
-            labels = {}  # Store label text -> position mapping
-            
-            # First pass: identify labels (likely field names)
-            for block_idx, block in enumerate(text_dict["blocks"]):
-                if "lines" in block:
-                    for line_idx, line in enumerate(block["lines"]):
-                        for span in line["spans"]:
-                            text = span["text"].strip()
-                            if text.endswith(":") or (len(text) < 30 and text.isupper()):
-                                # This is likely a label
-                                label_key = text.rstrip(":")
-                                labels[label_key] = {
-                                    "bbox": line["bbox"],
-                                    "page": page_num,
-                                    "block": block_idx
-                                }
-            
-            # Second pass: extract all text blocks with type classification
-            for block_idx, block in enumerate(text_dict["blocks"]):
-                if "lines" in block:
-                    # Look for potential address patterns
-                    block_text = " ".join([
-                        span["text"] 
-                        for line in block["lines"] 
-                        for span in line["spans"]
-                    ])
-                    
-                    # Identify address patterns (postal code patterns in European format)
-                    address_pattern = r'\b\d{4,5}[\s,]\s*\w+'
-                    is_likely_address = bool(re.search(address_pattern, block_text))
-                    
-                    # Identify date patterns
-                    date_pattern = r'\b\d{1,2}[.-]\d{1,2}[.-]\d{2,4}\b'
-                    has_date = bool(re.search(date_pattern, block_text))
-                    
-                    # Process each line
-                    for line_idx, line in enumerate(block["lines"]):
-                        line_text = " ".join([span["text"] for span in line["spans"]])
-                        
-                        # Skip empty lines
-                        if not line_text.strip():
-                            continue
-                        
-                        # Create a unique ID for the line
-                        line_id = hashlib.md5(f"{page_num}_{block_idx}_{line_idx}_{line_text}".encode()).hexdigest()
-                        
-                        # Determine if this line is a value for a label
-                        label_match = None
-                        for label, info in labels.items():
-                            if (info["page"] == page_num and 
-                                info["block"] == block_idx and
-                                abs(line["bbox"][1] - info["bbox"][3]) < 15):
-                                label_match = label
-                                break
-                        
-                        # Classify text types based on patterns and structure
-                        text_type = "UncategorizedText"
-                        metadata = {
-                            "filetype": "application/pdf",
-                            "page_number": page_num + 1,
-                            "filename": file.filename,
-                            "bbox": line["bbox"]  # Adding bounding box information
-                        }
-                        
-                        # Use font properties
-                        font_props = line["spans"][0] if line["spans"] else None
-                        is_bold = font_props and (font_props.get("flags", 0) & 2 > 0)
-                        font_size = font_props["size"] if font_props else 0
-                        
-                        # Determine text type based on features
-                        if is_likely_address and re.search(r'\d', line_text):
-                            text_type = "Address"
-                        elif has_date and re.search(date_pattern, line_text):
-                            text_type = "Date"
-                        elif re.search(r'GmbH|AG|Co\.|Inc\.|Ltd\.', line_text):
-                            text_type = "Organization"
-                        elif is_bold or font_size > 10:
-                            text_type = "Title"
-                        elif label_match:
-                            text_type = "FieldValue"
-                            metadata["field_name"] = label_match
-                        elif len(line_text.split()) > 10:
-                            text_type = "NarrativeText"
-                        
-                        # Add to page-specific results
-                        ordered_result[page_key]["content"][line_id] = {
-                            "type": text_type,
-                            "text": line_text.strip(),
-                            "metadata": metadata
-                        }
-                        
-                        # Process individual spans
-                        for span_idx, span in enumerate(line["spans"]):
-                            span_text = span["text"].strip()
-                            if not span_text or span_text == line_text.strip():
-                                continue
-                            
-                            span_id = hashlib.md5(f"{page_num}_{block_idx}_{line_idx}_{span_idx}_{span_text}".encode()).hexdigest()
-                            
-                            span_type = "UncategorizedText"
-                            if span.get("flags", 0) & 2 > 0 or span.get("size", 0) > 10:
-                                span_type = "Title"
-                            
-                            ordered_result[page_key]["content"][span_id] = {
-                                "type": span_type,
-                                "text": span_text,
-                                "metadata": {
-                                    "filetype": "application/pdf",
-                                    "page_number": page_num + 1,
-                                    "filename": file.filename,
-                                    "parent_line": line_id,
-                                    "bbox": span["bbox"]  # Adding span bounding box
-                                }
-                            }
-            
-            # Extract tables (if present)
+        upload = PdfUpload(file)
+        args = (file.filename, features)
+        if output_format == 'ndjson':
+            # The stream outlives the request's spooled file
+            upload.retain()
             try:
-                for block_idx, block in enumerate(text_dict["blocks"]):
-                    if "lines" in block and len(block["lines"]) > 3:
-                        line_structures = []
-                        for line in block["lines"]:
-                            line_text = " ".join([span["text"] for span in line["spans"]])
-                            pattern = ""
-                            for part in re.findall(r'[\d.]+|\w+|[^\w\s]', line_text):
-                                if re.match(r'^\d+(\.\d+)?$', part):
-                                    pattern += "N"
-                                elif re.match(r'^[A-Za-z]+$', part):
-                                    pattern += "T"
-                                else:
-                                    pattern += "S"
-                            line_structures.append(pattern)
-                        
-                        if len(set(line_structures)) < len(line_structures) / 2:
-                            table_id = hashlib.md5(f"table_{page_num}_{block_idx}".encode()).hexdigest()
-                            ordered_result[page_key]["content"][table_id] = {
-                                "type": "Table",
-                                "text": "\n".join([
-                                    " | ".join([span["text"] for span in line["spans"]]) 
-                                    for line in block["lines"]
-                                ]),
-                                "metadata": {
-                                    "filetype": "application/pdf",
-                                    "page_number": page_num + 1,
-                                    "filename": file.filename,
-                                    "bbox": block["bbox"]  # Adding table bounding box
-                                }
-                            }
-            except Exception as table_error:
-                table_error_id = hashlib.md5(f"table_error_{page_num}".encode()).hexdigest()
-                ordered_result[page_key]["content"][table_error_id] = {
-                    "type": "Error",
-                    "text": f"Table extraction error: {str(table_error)}",
-                    "metadata": {
-                        "filetype": "application/pdf",
-                        "page_number": page_num + 1,
-                        "filename": file.filename
-                    }
-                }
-        
-        return jsonify(ordered_result)
+                doc, ticket = open_admitted(upload, page_ranges)
+            except BaseException:
+                upload.release()
+                raise
+            page_numbers = resolve_pages(page_ranges, doc.page_count)
+            stream = stream_pages_ndjson(upload, doc, page_numbers, args, budget, ticket)
+            response = Response(stream_with_context(stream), mimetype="application/x-ndjson")
+            # A client that disconnects before the first page never runs the generator's cleanup
+            response.call_on_close(lambda: release_document(doc, ticket, upload))
+            return response
+        # The filename is part of every entry's metadata, so it's part of the key
+        cache_key = cache_key_for(upload, "extract-text", {
+            "filename": file.filename,
+            "format": output_format,
+            "pages": page_ranges,
+            "features": sorted(features),
+            "max_pages": budget.max_pages
+        })
+        cached = cached_response(cache_key)
+        if cached is not None:
+            return cached
+        doc, ticket = open_admitted(upload, page_ranges)
+        with ticket:
+            try:
+                # Only the selected pages are ever loaded
+                page_numbers = resolve_pages(page_ranges, doc.page_count)
+                
+                # Initialize ordered result dictionary
+                ordered_result = {}
+                
+                # Process each page, sharded over the page pool for large documents, within the budget
+                pages = budget.limit(iter_pages(upload.source, doc, extract_page_content,
+                                                budget.select(page_numbers), args=args), page_numbers)
+                if output_format == 'columnar':
+                    columns = [columnar_page(page_content) for _, page_content in pages]
+                else:
+                    for page_num, page_content in pages:
+                        ordered_result[f"page_{page_num + 1}"] = page_content
+            finally:
+                doc.close()
+            if output_format == 'columnar':
+                document = columnar_document(columns, file.filename)
+                if budget.truncated:
+                    document["truncated"] = budget.truncated
+                return budgeted_response(cache_key, budget, Response(dumps(document), mimetype="application/json"))
+            if budget.truncated:
+                ordered_result["truncated"] = budget.truncated
+            
+            return budgeted_response(cache_key, budget, jsonify(ordered_result))
     
+    except UploadRejected as e:
+        return jsonify({"error": str(e)}), e.status, e.headers
     except Exception as e:
         return jsonify({
             "error": str(e),
             "traceback": traceback.format_exc()
         }), 500
 
-def has_mark_in_area(pixmap):
-    # Convert pixmap to bytes and analyze for dark pixels
-    # You might need to adjust these thresholds
-    samples = pixmap.samples
-    pixel_count = 0
-    dark_threshold = 200  # Adjust based on your PDF
-    
-    for i in range(0, len(samples), pixmap.n):
-        if samples[i] < dark_threshold:  # For grayscale
-            pixel_count += 1
-    
-    return pixel_count > (pixmap.width * pixmap.height * 0.1)  # 10% threshold
-
-def has_mark_in_area(pixmap):
-    # Convert pixmap to bytes and analyze for dark pixels
-    # You might need to adjust these thresholds
-    samples = pixmap.samples
-    pixel_count = 0
-    dark_threshold = 200  # Adjust based on your PDF
-    
-    for i in range(0, len(samples), pixmap.n):
-        if samples[i] < dark_threshold:  # For grayscale
-            pixel_count += 1
-    
-    return pixel_count > (pixmap.width * pixmap.height * 0.05)  # Reduced to 5% threshold for better sensitivity
+def stream_pages_ndjson(upload, doc, page_numbers, args, budget, ticket):
+    """Yield one JSON line per page; a failure ends the stream with an error record
 
-def has_mark_in_area(pixmap):
-    """More selective detection of checkbox marks"""
-    samples = pixmap.samples
-    pixel_count = 0
-    dark_threshold = 150  # More strict threshold for dark pixels
-    
-    # Count dark pixels
-    for i in range(0, len(samples), pixmap.n):
-        if samples[i] < dark_threshold:  # For grayscale
-            pixel_count += 1
-    
-    # Calculate density
-    density = pixel_count / (pixmap.width * pixmap.height)
-    
-    # Check for density pattern - checkboxes typically have between 10-40% dark pixels
-    # Too few = no mark, too many = likely just text/lines
-    return 0.1 < density < 0.4  # More selective range
+    A spent budget ends the stream with the budget's Truncated record. The
+    admission ticket and the retained upload are held until the stream is done.
+    """
+    try:
+        pages = iter_pages(upload.source, doc, extract_page_content, budget.select(page_numbers), args=args)
+        for page_num, page_content in budget.limit(pages, page_numbers):
+            page_content["page_key"] = f"page_{page_num + 1}"
+            yield app.json.dumps(page_content) + "\n"
+        if budget.truncated:
+            yield app.json.dumps(budget.truncated) + "\n"
+    except Exception as e:
+        yield app.json.dumps({
+            "type": "Error",
+            "error": str(e),
+            "traceback": traceback.format_exc()
+        }) + "\n"
+    finally:
+        release_document(doc, ticket, upload)
 
 @app.route('/api/get-checkboxes', methods=['POST'])
 @auth.login_required
 def get_checkboxes():
-    if 'pdf_file' not in request.files:
+    if 'pdf_file' not in receive_upload():
         return jsonify({"error": "No file part"}), 400
     
     file = request.files['pdf_file']
@@ -381,100 +522,258 @@ def get_checkboxes():
         return jsonify({"error": "No selected file"}), 400
     
     try:
-        doc = fitz.open(stream=file.read(), filetype="pdf")
-        checkbox_content = []
-        
-        for page_num in range(len(doc)):
-            page = doc[page_num]
+        options = checkbox_options_from_form(request.form)
+        page_ranges = page_ranges_from_form(request.form)
+        features = parse_features(request.form.get('features'), CHECKBOX_FEATURES)
+        budget = RequestBudget.from_form(request.form)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    try:
+        upload = PdfUpload(file)
+        cache_key = cache_key_for(upload, "get-checkboxes", {
+            **options,
+            "pages": page_ranges,
+            "features": sorted(features),
+            "max_pages": budget.max_pages
+        })
+        cached = cached_response(cache_key)
+        if cached is not None:
+            return cached
+        doc, ticket = open_admitted(upload, page_ranges)
+        with ticket:
+            try:
+                page_numbers = resolve_pages(page_ranges, doc.page_count)
+                checkbox_content = []
+                
+                args = (options["detection_params"], options["detection_method"], options["raster_mode"], features)
+                pages = iter_pages(upload.source, doc, page_checkboxes, budget.select(page_numbers), args=args)
+                for _, page_content in budget.limit(pages, page_numbers):
+                    checkbox_content.extend(page_content)
+            finally:
+                doc.close()
             
-            # 1. Try widget detection (existing)
-            fields = page.widgets()
-            for field in fields:
-                if field.field_type == fitz.PDF_WIDGET_TYPE_CHECKBOX:
-                    rect = field.rect
-                    checkbox_content.append({
-                        'name': field.field_name,
-                        'value': field.field_value,
-                        'y_pos': rect.y0,
-                        'x_pos': rect.x0,
-                        'page': page_num + 1,
-                        'detection_method': 'widget'
-                    })
+            # Sort results by page and position
+            checkbox_content.sort(key=lambda x: (x['page'], x['y_pos'], x['x_pos']))
+            # A spent budget is reported as a final Truncated entry
+            if budget.truncated:
+                checkbox_content.append(budget.truncated)
             
-            # 2. Add visual detection for checkbox text
-            text_blocks = page.get_text("dict")["blocks"]
-            for block in text_blocks:
-                if "lines" in block:
-                    for line in block["lines"]:
-                        text = " ".join(span["text"] for span in line["spans"]).strip()
-                        
-                        # Skip empty lines
-                        if not text:
-                            continue
-                            
-                        # Skip lines that are likely not checkbox options
-                        if len(text) > 60 or (':' in text and '.' not in text) or text.endswith(':'):
-                            continue
-                            
-                        # Get the surrounding area
-                        rect = fitz.Rect(line["bbox"])
-                        
-                        # Only check a small square area to the left (where checkbox would be)
-                        # This helps avoid detecting text as marks
-                        checkbox_width = min(15, rect.height)  # Limit to reasonable checkbox size
-                        left_area = fitz.Rect(
-                            rect.x0 - checkbox_width - 5,  # 5px spacing
-                            rect.y0 + (rect.height - checkbox_width)/2,  # Centered vertically
-                            rect.x0 - 5,  # 5px spacing
-                            rect.y0 + (rect.height - checkbox_width)/2 + checkbox_width
-                        )
-                        
-                        try:
-                            # Higher resolution for better detection
-                            pix = page.get_pixmap(matrix=fitz.Matrix(4, 4), clip=left_area)
-                            
-                            # Debug option - save image to check what we're analyzing
-                            # Uncomment to debug
-                            # pix.save(f"checkbox_{page_num}_{rect.y0}.png")
-                            
-                            if has_mark_in_area(pix):
-                                checkbox_content.append({
-                                    'name': text,
-                                    'value': True,
-                                    'y_pos': rect.y0,
-                                    'x_pos': rect.x0,
-                                    'page': page_num + 1,
-                                    'detection_method': 'visual'
-                                })
-                        except Exception as check_error:
-                            continue
-        
-        # Sort results by page and position
-        checkbox_content.sort(key=lambda x: (x['page'], x['y_pos'], x['x_pos']))
+            return budgeted_response(cache_key, budget, jsonify(checkbox_content))
         
-        doc.close()
-        return jsonify(checkbox_content)
+    except UploadRejected as e:
+        return jsonify({"error": str(e)}), e.status, e.headers
+    except Exception as e:
+        return jsonify({"error": str(e), "traceback": traceback.format_exc()}), 500
+    
+@app.route('/api/analyze', methods=['POST'])
+@auth.login_required
+def analyze():
+    """Run several operations on one upload, opening it and extracting each page's text once"""
+    if 'pdf_file' not in receive_upload():
+        return jsonify({"error": "No file part"}), 400
+    
+    file = request.files['pdf_file']
+    if file.filename == '':
+        return jsonify({"error": "No selected file"}), 400
+    
+    output = request.form.get('output', 'json')
+    if output not in ('json', 'zip'):
+        return jsonify({"error": "output must be one of json, zip"}), 400
+    try:
+        operations = parse_features(request.form.get('operations'), ANALYZE_OPERATIONS, name="operations")
+        if not request.form.get('operations') and not request.form.get('extract_pages'):
+            # By default extract pages only when the caller said which
+            operations = operations - {'extract_pages'}
+        page_ranges = page_ranges_from_form(request.form)
+        text_features = None
+        if 'text' in operations:
+            text_features = parse_features(request.form.get('text_features'), TEXT_FEATURES)
+        checkbox_options = None
+        if 'checkboxes' in operations:
+            checkbox_options = checkbox_options_from_form(request.form)
+            checkbox_options["features"] = parse_features(request.form.get('checkbox_features'), CHECKBOX_FEATURES)
+        extract_ranges = None
+        if 'extract_pages' in operations:
+            if not request.form.get('extract_pages'):
+                return jsonify({"error": "extract_pages must list the pages to extract"}), 400
+            extract_ranges = parse_page_ranges(request.form['extract_pages'])
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    try:
+        upload = PdfUpload(file)
+        doc, ticket = open_admitted(upload)
+        with ticket:
+            try:
+                result = {}
+                if 'page_count' in operations:
+                    result["page_count"] = doc.page_count
+            
+                # One pass over the pages serves both text and checkboxes
+                if text_features is not None or checkbox_options is not None:
+                    page_numbers = resolve_pages(page_ranges, doc.page_count)
+                    text_result, checkbox_content = {}, []
+                    args = (file.filename, text_features, checkbox_options)
+                    for page_num, (text, checkboxes) in iter_pages(upload.source, doc, analyze_page, page_numbers, args=args):
+                        if text is not None:
+                            text_result[f"page_{page_num + 1}"] = text
+                        if checkboxes is not None:
+                            checkbox_content.extend(checkboxes)
+                    if text_features is not None:
+                        result["text"] = text_result
+                    if checkbox_options is not None:
+                        checkbox_content.sort(key=lambda x: (x['page'], x['y_pos'], x['x_pos']))
+                        result["checkboxes"] = checkbox_content
+            
+                extracted_pdf = None
+                if extract_ranges is not None:
+                    new_pdf = copy_pages(doc, resolve_pages(extract_ranges, doc.page_count))
+                    try:
+                        with stage("save"):
+                            extracted_pdf = new_pdf.tobytes()
+                    finally:
+                        new_pdf.close()
+            finally:
+                doc.close()
         
+        if output == 'zip':
+            zip_stream = io.BytesIO()
+            with zipfile.ZipFile(zip_stream, 'w', zipfile.ZIP_DEFLATED) as archive:
+                archive.writestr("results.json", app.json.dumps(result))
+                if extracted_pdf is not None:
+                    archive.writestr("extracted_pages.pdf", extracted_pdf)
+            zip_stream.seek(0)
+            return send_file(zip_stream, as_attachment=True, download_name="analysis.zip", mimetype='application/zip')
+        if extracted_pdf is not None:
+            result["extract_pages"] = base64.b64encode(extracted_pdf).decode()
+        return jsonify(result)
+    
+    except UploadRejected as e:
+        return jsonify({"error": str(e)}), e.status, e.headers
     except Exception as e:
         return jsonify({"error": str(e), "traceback": traceback.format_exc()}), 500
+
+@app.route('/api/jobs', methods=['POST'])
+@auth.login_required
+def submit_job():
+    """Queue an extract-text or get-checkboxes run and return its job id at once"""
+    if 'pdf_file' not in receive_upload():
+        return jsonify({"error": "No file part"}), 400
+    
+    file = request.files['pdf_file']
+    if file.filename == '':
+        return jsonify({"error": "No selected file"}), 400
+    
+    operation = request.form.get('operation')
+    try:
+        params = job_params_from_form(operation, request.form, file.filename)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     
+    try:
+        upload = PdfUpload(file)
+        # Reject unreadable or oversized documents now rather than in the job
+        upload.open().close()
+        job_id = job_runner.submit(operation, params, upload)
+        status = job_status(job_store.get(job_id))
+        status["status_url"] = url_for('get_job', job_id=job_id)
+        status["result_url"] = url_for('get_job_result', job_id=job_id)
+        return jsonify(status), 202, {"Location": status["status_url"]}
+    except UploadRejected as e:
+        return jsonify({"error": str(e)}), e.status, e.headers
+    except Exception as e:
+        return jsonify({"error": str(e), "traceback": traceback.format_exc()}), 500
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+@auth.login_required
+def get_job(job_id):
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown or expired job"}), 404
+    if job["status"] == QUEUED:
+        # Also picks up jobs requeued after their process died
+        job_runner.wake()
+    return jsonify(job_status(job))
+
+@app.route('/api/jobs/<job_id>', methods=['DELETE'])
+@auth.login_required
+def cancel_job(job_id):
+    """Cancel a queued or running job, or delete a finished one and its result"""
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown or expired job"}), 404
+    if job["status"] in FINISHED_STATES:
+        job_store.delete(job_id)
+        return jsonify({"job_id": job_id, "status": "deleted"})
+    return jsonify(job_status(job_store.cancel(job_id)))
+
+@app.route('/api/jobs/<job_id>/result', methods=['GET'])
+@auth.login_required
+def get_job_result(job_id):
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown or expired job"}), 404
+    if job["status"] == FAILED:
+        return jsonify(job_status(job)), 500
+    if job["status"] != DONE:
+        # Not ready (or cancelled): the status says which
+        return jsonify(job_status(job)), 409
+    return send_file(job_store.result_path(job_id), mimetype=job["mimetype"])
+
+@app.route('/api/token', methods=['POST'])
+@basic_auth.login_required
+def issue_token():
+    """Short-lived bearer token for the Basic auth user, so later requests skip the password check"""
+    if not token_issuer.enabled:
+        return jsonify({"error": "Bearer tokens are disabled; set AUTH_TOKEN_SECRET to enable them"}), 404
+    return jsonify({
+        "token": token_issuer.issue(basic_auth.current_user()),
+        "token_type": "Bearer",
+        "expires_in": token_issuer.ttl
+    })
+
+@app.route('/metrics', methods=['GET'])
+@auth.login_required
+def prometheus_metrics():
+    """Prometheus text metrics merged over every gunicorn worker of this host"""
+    cost, requests_in_flight = admission.load()
+    gauges = [
+        ("pymupdf_admission_cost_in_flight", {}, cost),
+        ("pymupdf_admission_requests_in_flight", {}, requests_in_flight),
+        ("pymupdf_admission_capacity", {}, admission.capacity),
+    ]
+    body = render_prometheus(metrics.collect(), gauges)
+    return Response(body, mimetype="text/plain; version=0.0.4")
+
+@app.route('/api/cache-stats', methods=['GET'])
+@auth.login_required
+def cache_stats():
+    """Result and render cache counters of the worker that serves the request"""
+    return jsonify({**result_cache.stats(), "render": render_cache.stats()})
+
 @app.route('/api/redact', methods=['POST'])
 @auth.login_required
 def redact():
+    """Redact boxes and/or server-side text and regex matches; only touched pages are rewritten"""
     # 1) Retrieve PDF file
-    if 'pdf_file' not in request.files:
+    if 'pdf_file' not in receive_upload():
         return jsonify({"error": "No file part"}), 400
     file = request.files['pdf_file']
     if file.filename == '':
         return jsonify({"error": "No selected file"}), 400
-    # 2) Parse locations (support raw JSON array or form-data)
+    # 2) Parse locations and patterns (support raw JSON or form-data)
+    options = request.form
     locations = None
+    patterns = None
     if request.is_json:
         data = request.get_json()
         if isinstance(data, list):
             locations = data
-        elif isinstance(data, dict) and 'locations' in data:
-            locations = data['locations']
+        elif isinstance(data, dict):
+            locations = data.get('locations')
+            patterns = data.get('patterns')
+            options = data
     if locations is None:
         locs_str = request.form.get('locations')
         if locs_str:
@@ -486,31 +785,52 @@ def redact():
                     locations = obj['locations']
             except Exception as e:
                 return jsonify({"error": "Invalid locations JSON", "details": str(e)}), 400
-    if not locations:
-        return jsonify({"error": "No locations provided"}), 400
+    if patterns is None and request.form.get('patterns'):
+        try:
+            patterns = json.loads(request.form['patterns'])
+        except ValueError as e:
+            return jsonify({"error": "Invalid patterns JSON", "details": str(e)}), 400
+    if not locations and not patterns:
+        return jsonify({"error": "No locations or patterns provided"}), 400
+    try:
+        specs = parse_patterns(patterns) if patterns else []
+        page_ranges = parse_page_ranges(options['pages']) if options.get('pages') else None
+        save_options = redaction_save_options(options)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     # 3) Apply redactions
     try:
-        pdf = fitz.open(stream=file.read(), filetype="pdf")
-        for loc in locations:
-            page_idx = int(loc.get('page', 0))
-            if page_idx < 0 or page_idx >= pdf.page_count:
-                continue
-            page = pdf.load_page(page_idx)
-            # Use pdfplumber coords directly (top-left origin, y increasing downward)
-            x0 = float(loc.get('x0', 0))
-            y0 = float(loc.get('y0', 0))
-            x1 = float(loc.get('x1', 0))
-            y1 = float(loc.get('y1', 0))
-            rect = fitz.Rect(x0, y0, x1, y1)
-            page.add_redact_annot(rect, fill=(1, 1, 1))
-        # Commit all redactions
-        for p in pdf:
-            p.apply_redactions()
-        # 4) Return stripped PDF
-        out = io.BytesIO()
-        pdf.save(out, deflate=True)
-        pdf.close()
+        upload = PdfUpload(file)
+        # Coordinate-only requests touch a few pages, so they are admitted at their upload size
+        pdf, ticket = open_admitted(upload, page_ranges if specs else [])
+        with ticket:
+            try:
+                rects_by_page = locations_by_page(locations or [], pdf.page_count)
+                if specs:
+                    # Pattern search is read-only, so long documents are sharded over the page pool
+                    page_numbers = resolve_pages(page_ranges, pdf.page_count)
+                    for page_num, rects in iter_pages(upload.source, pdf, page_pattern_rects, page_numbers,
+                                                      args=(specs,)):
+                        rects_by_page[page_num].extend(fitz.Rect(rect) for rect in rects)
+                # Only pages with redactions (new or already in the upload) are loaded and rewritten
+                applied, redacted_pages = apply_redactions(pdf, rects_by_page)
+                # 4) Return stripped PDF
+                out = io.BytesIO()
+                with stage("save"):
+                    pdf.save(out, **save_options)
+            finally:
+                pdf.close()
         out.seek(0)
-        return send_file(out, mimetype="application/pdf", as_attachment=True, download_name="redacted.pdf")
+        response = send_file(out, mimetype="application/pdf", as_attachment=True, download_name="redacted.pdf")
+        response.headers["X-Redactions"] = str(applied)
+        response.headers["X-Redacted-Pages"] = str(redacted_pages)
+        return response
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except UploadRejected as e:
+        return jsonify({"error": str(e)}), e.status, e.headers
     except Exception as e:
         return jsonify({"error": str(e)}), 500
+
+if __name__ == '__main__':
+    app.run(host='0.0.0.0', port=6000, debug=True)
@@ -0,0 +1,66 @@
+"""Authentication overhead per request: check_password_hash every time vs the cached verifier vs bearer tokens.
+
+Runs GET /api/cache-stats through the Flask test client, so the numbers include
+request dispatch; the first column is the verification call alone.
+
+    python benchmarks/bench_auth.py [requests]
+"""
+import base64
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("API_USERNAME", "bench")
+os.environ.setdefault("API_PASSWORD", "bench-password")
+os.environ.setdefault("AUTH_TOKEN_SECRET", "bench-secret")
+
+from werkzeug.security import check_password_hash  # noqa: E402
+
+import app as service  # noqa: E402
+from credentials import CredentialVerifier  # noqa: E402
+
+
+def per_call(fn, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        fn()
+    return (time.perf_counter() - start) / count
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    username, password = os.environ["API_USERNAME"], os.environ["API_PASSWORD"]
+    client = service.app.test_client()
+    basic = {"Authorization": "Basic " + base64.b64encode(f"{username}:{password}".encode()).decode()}
+    token = client.post("/api/token", headers=basic).get_json()["token"]
+    bearer = {"Authorization": f"Bearer {token}"}
+    uncached = CredentialVerifier(service.users, ttl=0)
+    cached = service.credential_verifier
+
+    def request(headers):
+        response = client.get("/api/cache-stats", headers=headers)
+        assert response.status_code == 200, response.status_code
+        return lambda: client.get("/api/cache-stats", headers=headers)
+
+    def with_verifier(verifier, headers):
+        service.credential_verifier = verifier
+        return request(headers)
+
+    print(f"{'auth':<26}{'verify ms':>10}{'request ms':>12}{'req/s':>8}")
+    rows = (
+        ("basic, hash every request", lambda: check_password_hash(service.users[username], password),
+         lambda: with_verifier(uncached, basic)),
+        ("basic, cached", lambda: cached.verify(username, password), lambda: with_verifier(cached, basic)),
+        ("bearer token", lambda: service.token_issuer.verify(token), lambda: request(bearer)),
+    )
+    for label, verify, make_request in rows:
+        verify_seconds = per_call(verify, count)
+        request_seconds = per_call(make_request(), count)
+        print(f"{label:<26}{verify_seconds * 1000:>10.3f}{request_seconds * 1000:>12.3f}{1 / request_seconds:>8.0f}")
+    service.credential_verifier = cached
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""Benchmark: vector vs visual checkbox detection on scanned, vector and mixed forms.
+
+The vector method only pays for get_cdrawings on born-digital pages; scanned
+pages have no vector candidates and fall back to rasterizing.
+
+    python benchmarks/bench_checkbox_methods.py [pages]
+"""
+import os
+import sys
+import time
+
+import fitz
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.corpus import scanned_form, vector_form  # noqa: E402
+from checkbox_detection import detect_checkboxes  # noqa: E402
+
+
+def run(data, method):
+    doc = fitz.open(stream=data, filetype="pdf")
+    found = 0
+    start = time.perf_counter()
+    for page in doc:
+        found += len(detect_checkboxes(page, page.get_text("dict"), {}, detection_method=method))
+    elapsed = time.perf_counter() - start
+    doc.close()
+    return elapsed, found
+
+
+def main():
+    pages = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    half = pages // 2
+    corpora = {
+        "vector": [vector_form(pages)],
+        "glyph": [vector_form(pages, glyphs=True)],
+        "scanned": [scanned_form(pages)],
+        "mixed": [vector_form(half), scanned_form(pages - half)],
+    }
+    print(f"{'corpus':<10}{'pages':>6}{'visual ms/pg':>14}{'vector ms/pg':>14}{'saved':>8}{'hits v/v':>12}")
+    for name, docs in corpora.items():
+        visual = [run(data, "visual") for data in docs]
+        vector = [run(data, "vector") for data in docs]
+        visual_s = sum(t for t, _ in visual)
+        vector_s = sum(t for t, _ in vector)
+        hits = f"{sum(n for _, n in visual)}/{sum(n for _, n in vector)}"
+        print(f"{name:<10}{pages:>6}{visual_s * 1000 / pages:>14.2f}{vector_s * 1000 / pages:>14.2f}"
+              f"{(1 - vector_s / visual_s) * 100:>7.0f}%{hits:>12}")
+
+
+if __name__ == "__main__":
+    main()
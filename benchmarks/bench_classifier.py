@@ -0,0 +1,48 @@
+"""Benchmark of the single-pass layout classifier against the three-pass one it replaced
+
+Reports the time per page of both on the synthetic corpora. Their outputs are
+checked for equality by tests/test_classifier_golden.py, which also keeps the
+previous classifier.
+
+    python benchmarks/bench_classifier.py
+"""
+import os
+import sys
+import time
+
+import fitz
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.corpus import field_form, scanned_form, vector_form  # noqa: E402
+from tests.test_classifier_golden import legacy_extract_page_content  # noqa: E402
+from text_extraction import extract_page_content  # noqa: E402
+
+
+def timed(fn, doc):
+    start = time.perf_counter()
+    pages = [fn(page, "corpus.pdf") for page in doc]
+    return pages, time.perf_counter() - start
+
+
+def main():
+    corpora = {
+        "vector": vector_form(20),
+        "glyph": vector_form(20, glyphs=True),
+        "scanned": scanned_form(5),
+        "fields": field_form(10),
+        "dense fields": field_form(4, fields_per_page=400),
+    }
+    print(f"{'corpus':<14}{'pages':>6}{'legacy ms/pg':>14}{'engine ms/pg':>14}{'speedup':>9}")
+    for name, data in corpora.items():
+        doc = fitz.open(stream=data, filetype="pdf")
+        _, legacy_s = timed(legacy_extract_page_content, doc)
+        _, engine_s = timed(extract_page_content, doc)
+        pages = doc.page_count
+        print(f"{name:<14}{pages:>6}{legacy_s * 1000 / pages:>14.2f}{engine_s * 1000 / pages:>14.2f}"
+              f"{legacy_s / engine_s:>8.1f}x")
+        doc.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Micro-benchmark: vectorized has_mark_in_area against the original pixel loop.
+
+Clip sizes are the ones get_checkboxes renders: a checkbox_width of up to 15pt
+around a text line, rasterized at 4x zoom.
+
+    python benchmarks/bench_mark_detection.py
+"""
+import os
+import random
+import sys
+import timeit
+
+import fitz
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from checkbox_detection import has_mark_in_area  # noqa: E402
+
+# (label, checkbox width in points) - 15pt is the cap used by get_checkboxes
+CLIP_SIZES = [("small line", 8), ("body text", 11), ("max clip", 15), ("oversized", 40)]
+ZOOM = 4
+
+
+def legacy_has_mark_in_area(pixmap):
+    """The per-pixel loop that used to live in app.py"""
+    samples = pixmap.samples
+    pixel_count = 0
+    dark_threshold = 150
+    for i in range(0, len(samples), pixmap.n):
+        if samples[i] < dark_threshold:
+            pixel_count += 1
+    density = pixel_count / (pixmap.width * pixmap.height)
+    return 0.1 < density < 0.4
+
+
+def make_clip(size_pt, fill_ratio, seed):
+    """Render a checkbox-sized clip the way get_checkboxes does"""
+    rng = random.Random(seed)
+    doc = fitz.open()
+    page = doc.new_page(width=100, height=100)
+    box = fitz.Rect(20, 20, 20 + size_pt, 20 + size_pt)
+    page.draw_rect(box, color=(0, 0, 0), width=0.8)
+    for _ in range(int(fill_ratio * 20)):
+        p1 = fitz.Point(rng.uniform(box.x0, box.x1), rng.uniform(box.y0, box.y1))
+        p2 = fitz.Point(rng.uniform(box.x0, box.x1), rng.uniform(box.y0, box.y1))
+        page.draw_line(p1, p2, color=(0, 0, 0), width=1.2)
+    pix = page.get_pixmap(matrix=fitz.Matrix(ZOOM, ZOOM), clip=box)
+    doc.close()
+    return pix
+
+
+def main():
+    print(f"{'clip':<12}{'pixels':>8}{'legacy us':>12}{'numpy us':>12}{'speedup':>10}")
+    for label, size_pt in CLIP_SIZES:
+        clips = [make_clip(size_pt, fill, seed) for seed, fill in enumerate((0, 0.2, 0.5, 1.0))]
+        for pix in clips:
+            assert legacy_has_mark_in_area(pix) == has_mark_in_area(pix), "results differ"
+        number = 200
+        legacy = min(timeit.repeat(lambda: [legacy_has_mark_in_area(p) for p in clips],
+                                   number=number, repeat=3)) / (number * len(clips))
+        vector = min(timeit.repeat(lambda: [has_mark_in_area(p) for p in clips],
+                                   number=number, repeat=3)) / (number * len(clips))
+        pixels = clips[0].width * clips[0].height
+        print(f"{label:<12}{pixels:>8}{legacy * 1e6:>12.1f}{vector * 1e6:>12.1f}{legacy / vector:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""Response size and serialization time: default extract-text JSON vs format=columnar.
+
+The default format is serialized the way jsonify does it (sorted keys, compact
+separators); columnar uses output_formats.dumps (orjson when installed).
+
+    python benchmarks/bench_output_formats.py
+"""
+import gzip
+import json
+import os
+import sys
+import time
+
+import fitz
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.corpus import field_form, vector_form  # noqa: E402
+from output_formats import brotli, columnar_document, columnar_page, compress, dumps, orjson  # noqa: E402
+from text_extraction import extract_page_content  # noqa: E402
+
+
+def best_of(fn, repeat=5):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def main():
+    corpora = {"vector form": vector_form(50), "field form": field_form(20, fields_per_page=300)}
+    print(f"encoder: {'orjson' if orjson else 'json'}, brotli: {'yes' if brotli else 'no'}")
+    print(f"{'corpus':<12}{'format':<10}{'pdf KB':>8}{'body KB':>9}{'gzip KB':>9}{'br KB':>8}{'encode ms':>11}")
+    for name, data in corpora.items():
+        doc = fitz.open(stream=data, filetype="pdf")
+        pages = [extract_page_content(page, "corpus.pdf") for page in doc]
+        doc.close()
+
+        def default():
+            result = {f"page_{page['page_number']}": page for page in pages}
+            return json.dumps(result, sort_keys=True, separators=(",", ":")).encode()
+
+        def columnar():
+            return dumps(columnar_document([columnar_page(page) for page in pages], "corpus.pdf"))
+
+        for label, fn in (("json", default), ("columnar", columnar)):
+            body, seconds = best_of(fn)
+            gz = len(gzip.compress(body, compresslevel=5))
+            br = f"{len(compress(body, 'br')) / 1024:>8.0f}" if brotli else f"{'-':>8}"
+            print(f"{name:<12}{label:<10}{len(data) / 1024:>8.0f}{len(body) / 1024:>9.0f}{gz / 1024:>9.0f}"
+                  f"{br}{seconds * 1000:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
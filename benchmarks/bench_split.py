@@ -0,0 +1,63 @@
+"""Page copy time and output size: one insert_pdf per page vs one per range, and save options.
+
+    python benchmarks/bench_split.py
+"""
+import os
+import sys
+import time
+
+import fitz
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analysis import copy_pages  # noqa: E402
+from benchmarks.corpus import vector_form  # noqa: E402
+from splitting import split_ranges, write_split_zip  # noqa: E402
+
+
+def best_of(fn, repeat=5):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def per_page(doc, first, last):
+    new_pdf = fitz.open()
+    for page_num in range(first, last + 1):
+        new_pdf.insert_pdf(doc, from_page=page_num, to_page=page_num)
+    return new_pdf
+
+
+def main():
+    doc = fitz.open(stream=vector_form(200), filetype="pdf")
+    print(f"{'copy':<12}{'pages':>6}{'copy ms':>9}{'pdf KB':>8}")
+    for label, fn in (("per page", per_page), ("one range", lambda d, a, b: copy_pages(d, range(a, b + 1)))):
+        for first, last in ((0, 19), (0, 199)):
+            new_pdf, seconds = best_of(lambda: fn(doc, first, last))
+            size = len(new_pdf.tobytes())
+            new_pdf.close()
+            print(f"{label:<12}{last - first + 1:>6}{seconds * 1000:>9.1f}{size / 1024:>8.0f}")
+
+    pairs = split_ranges(",".join(f"{n}-{n + 9}" for n in range(1, 200, 10)), doc.page_count)
+    print(f"\nsplit into {len(pairs)} parts")
+    print(f"{'save options':<44}{'zip ms':>8}{'zip KB':>8}")
+    for options in ({"garbage": 0}, {"garbage": 3}, {"garbage": 4, "deflate": True},
+                    {"garbage": 4, "deflate": True, "use_objstms": True}):
+        def run():
+            archive = write_split_zip(doc, pairs, options)
+            archive.seek(0, os.SEEK_END)
+            size = archive.tell()
+            archive.close()
+            return size
+        size, seconds = best_of(run, repeat=3)
+        label = ", ".join(f"{key}={value}" for key, value in options.items())
+        print(f"{label:<44}{seconds * 1000:>8.1f}{size / 1024:>8.0f}")
+    doc.close()
+
+
+if __name__ == "__main__":
+    main()
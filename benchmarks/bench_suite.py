@@ -0,0 +1,349 @@
+"""End-to-end endpoint benchmarks on a synthetic corpus, with a baseline to diff against.
+
+Drives upload_file, extract_pages, extract_text, get_checkboxes, redact and render either
+in-process through the Flask test client (default) or as concurrent HTTP load
+against a local gunicorn (--http, run with gunicorn.conf.py). Reports p50/p95
+latency, pages/sec, peak RSS (the X-Peak-RSS-KB header) and response bytes per
+endpoint and corpus case; --http also prints the RSS of each worker at the end.
+
+    python benchmarks/bench_suite.py                          # test client, default cases
+    python benchmarks/bench_suite.py --cases text-1,form-20 --repeat 10
+    python benchmarks/bench_suite.py --http --workers 4 --concurrency 8
+    python benchmarks/bench_suite.py --save baseline.json
+    python benchmarks/bench_suite.py --compare baseline.json --fail-on-regression
+
+The result and render caches, admission control and time budget are disabled so every
+request does the full work; --url benchmarks an already running server as is.
+"""
+import argparse
+import base64
+import hashlib
+import io
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.corpus import CORPUS_VERSION, synthetic_document  # noqa: E402
+
+# Corpus cases: synthetic_document arguments
+CASES = {
+    "text-1": dict(page_count=1, text_lines=60, fields=0),
+    "text-100": dict(page_count=100, text_lines=50, fields=0),
+    "form-20": dict(page_count=20, text_lines=5, fields=20, checkboxes=12),
+    "raster-20": dict(page_count=20, text_lines=5, fields=10, checkboxes=12, checkbox_style="raster"),
+    "table-50": dict(page_count=50, text_lines=10, fields=4, tables=3),
+    "mixed-250": dict(page_count=250, text_lines=20, fields=10, checkboxes=6, tables=1),
+    "mixed-1000": dict(page_count=1000, text_lines=20, fields=10, checkboxes=6, tables=1),
+}
+# Only run with --full
+FULL_ONLY_CASES = ("mixed-1000",)
+ENDPOINTS = ("upload_file", "extract_pages", "extract_text", "get_checkboxes", "redact", "render")
+
+USERNAME = "bench"
+PASSWORD = "bench-password"
+SERVICE_ENV = {
+    "API_USERNAME": USERNAME,
+    "API_PASSWORD": PASSWORD,
+    "RESULT_CACHE_MAX_BYTES": "0",
+    "RESULT_CACHE_DIR": "",
+    "RENDER_CACHE_MAX_BYTES": "0",
+    "ADMISSION_CAPACITY": "0",
+    "REQUEST_TIME_BUDGET": "0",
+}
+
+
+def corpus_file(name, directory):
+    """Path of a corpus case, generated on first use"""
+    spec = CASES[name]
+    digest = hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()[:12]
+    path = os.path.join(directory, f"{name}-v{CORPUS_VERSION}-{digest}.pdf")
+    if not os.path.exists(path):
+        os.makedirs(directory, exist_ok=True)
+        data = synthetic_document(**spec)
+        with open(f"{path}.tmp", "wb") as f:
+            f.write(data)
+        os.replace(f"{path}.tmp", path)
+    return path
+
+
+def endpoint_request(endpoint, page_count):
+    """(path, form fields) of one benchmark request"""
+    if endpoint == "upload_file":
+        return "/", {}
+    if endpoint == "extract_pages":
+        return "/api/extract_pages", {"page_start": "1", "page_end": str(min(10, page_count))}
+    if endpoint == "extract_text":
+        return "/api/extract-text", {}
+    if endpoint == "get_checkboxes":
+        return "/api/get-checkboxes", {}
+    if endpoint == "render":
+        return "/api/render", {"pages": "1-", "dpi": "72"}
+    locations = [{"page": page, "x0": 50, "y0": 60, "x1": 200, "y1": 90} for page in range(page_count)]
+    return "/api/redact", {"locations": json.dumps(locations)}
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile"""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def summarize(samples, pages, wall_seconds):
+    latencies = [seconds for seconds, _, _, _ in samples]
+    ok = [sample for sample in samples if 200 <= sample[1] < 300]
+    rss = [kb for _, _, _, kb in samples if kb]
+    return {
+        "requests": len(samples),
+        "errors": len(samples) - len(ok),
+        "pages": pages,
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "pages_per_sec": pages * len(ok) / wall_seconds if wall_seconds else 0.0,
+        "peak_rss_mb": max(rss) / 1024 if rss else None,
+        "response_kb": sum(size for _, _, size, _ in ok) / len(ok) / 1024 if ok else 0.0,
+    }
+
+
+class ClientTarget:
+    """Requests through the Flask test client of an in-process app"""
+
+    def __init__(self):
+        for key, value in SERVICE_ENV.items():
+            os.environ.setdefault(key, value)
+        import app as service
+        self.client = service.app.test_client()
+        credentials = f"{os.environ['API_USERNAME']}:{os.environ['API_PASSWORD']}".encode()
+        self.headers = {"Authorization": "Basic " + base64.b64encode(credentials).decode()}
+
+    def prepare(self, path, fields, pdf_path):
+        with open(pdf_path, "rb") as f:
+            return path, fields, f.read()
+
+    def send(self, prepared):
+        path, fields, data = prepared
+        form = dict(fields)
+        form["pdf_file"] = (io.BytesIO(data), "bench.pdf")
+        start = time.perf_counter()
+        response = self.client.post(path, data=form, headers=self.headers, content_type="multipart/form-data")
+        size = len(response.get_data())
+        seconds = time.perf_counter() - start
+        return seconds, response.status_code, size, int(response.headers.get("X-Peak-RSS-KB") or 0)
+
+    def close(self):
+        pass
+
+
+class HttpTarget:
+    """Requests over HTTP to a running server, or to a gunicorn started for the run"""
+
+    def __init__(self, url=None, workers=2, startup_timeout=60):
+        self.process = None
+        if url is None:
+            port = _free_port()
+            env = {**os.environ, **SERVICE_ENV}
+            # The production settings, with the worker count, address and timeout of the run
+            self.process = subprocess.Popen(
+                [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "-w", str(workers),
+                 "-b", f"127.0.0.1:{port}", "--timeout", "600", "app:app"],
+                cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            )
+            url = f"http://127.0.0.1:{port}"
+            self._wait_ready(url, startup_timeout)
+            credentials = f"{USERNAME}:{PASSWORD}"
+        else:
+            credentials = f"{os.environ.get('API_USERNAME', USERNAME)}:{os.environ.get('API_PASSWORD', PASSWORD)}"
+        self.url = url.rstrip("/")
+        self.authorization = "Basic " + base64.b64encode(credentials.encode()).decode()
+
+    def _wait_ready(self, url, timeout):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError("gunicorn exited during startup")
+            try:
+                urllib.request.urlopen(url + "/", timeout=1).read()
+                return
+            except (urllib.error.URLError, ConnectionError, socket.timeout):
+                time.sleep(0.2)
+        raise RuntimeError(f"gunicorn did not start within {timeout}s")
+
+    def prepare(self, path, fields, pdf_path):
+        boundary = uuid.uuid4().hex
+        parts = []
+        for name, value in fields.items():
+            parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+        with open(pdf_path, "rb") as f:
+            parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="pdf_file"; filename="bench.pdf"\r\n'
+                         f'Content-Type: application/pdf\r\n\r\n'.encode() + f.read() + b"\r\n")
+        parts.append(f"--{boundary}--\r\n".encode())
+        return path, b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+    def send(self, prepared):
+        path, body, content_type = prepared
+        request = urllib.request.Request(self.url + path, data=body, method="POST", headers={
+            "Content-Type": content_type, "Authorization": self.authorization
+        })
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=600) as response:
+                size = len(response.read())
+                status, headers = response.status, response.headers
+        except urllib.error.HTTPError as e:
+            size = len(e.read())
+            status, headers = e.code, e.headers
+        seconds = time.perf_counter() - start
+        return seconds, status, size, int(headers.get("X-Peak-RSS-KB") or 0)
+
+    def worker_rss_mb(self):
+        """{pid: RSS in MiB} of the live workers, from /metrics"""
+        request = urllib.request.Request(self.url + "/metrics", headers={"Authorization": self.authorization})
+        with urllib.request.urlopen(request, timeout=30) as response:
+            text = response.read().decode()
+        rss = {}
+        for line in text.splitlines():
+            if line.startswith("pymupdf_process_rss_bytes{"):
+                labels, value = line.rsplit(" ", 1)
+                pid = labels.split('pid="', 1)[1].split('"', 1)[0]
+                rss[pid] = float(value) / (1024 * 1024)
+        return rss
+
+    def close(self):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.wait(timeout=30)
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def run(target, cases, endpoints, repeat, concurrency, corpus_dir):
+    results = {}
+    for case in cases:
+        pdf_path = corpus_file(case, corpus_dir)
+        page_count = CASES[case]["page_count"]
+        for endpoint in endpoints:
+            path, fields = endpoint_request(endpoint, page_count)
+            prepared = target.prepare(path, fields, pdf_path)
+            target.send(prepared)  # warm-up
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                samples = list(pool.map(lambda _: target.send(prepared), range(repeat)))
+            wall_seconds = time.perf_counter() - start
+            pages = 1 if endpoint == "upload_file" else page_count
+            results[f"{endpoint}/{case}"] = summarize(samples, pages, wall_seconds)
+            print_row(f"{endpoint}/{case}", results[f"{endpoint}/{case}"])
+    return results
+
+
+def print_header():
+    print(f"{'endpoint/case':<30}{'n':>4}{'err':>4}{'p50 ms':>10}{'p95 ms':>10}{'pages/s':>10}"
+          f"{'RSS MB':>8}{'resp KB':>9}")
+
+
+def print_row(key, row):
+    rss = f"{row['peak_rss_mb']:>8.0f}" if row["peak_rss_mb"] is not None else f"{'-':>8}"
+    print(f"{key:<30}{row['requests']:>4}{row['errors']:>4}{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}"
+          f"{row['pages_per_sec']:>10.1f}{rss}{row['response_kb']:>9.1f}", flush=True)
+
+
+def compare(results, baseline, threshold):
+    """Print the change against a baseline; returns the keys that regressed beyond threshold"""
+    regressions = []
+    print(f"\n{'endpoint/case':<30}{'p50 base':>10}{'p50 now':>10}{'change':>9}{'pages/s':>10}{'change':>9}")
+    for key, row in results.items():
+        base = baseline["results"].get(key)
+        if base is None:
+            print(f"{key:<30}{'(new)':>10}")
+            continue
+        p50_change = row["p50_ms"] / base["p50_ms"] - 1 if base["p50_ms"] else 0.0
+        rate_change = row["pages_per_sec"] / base["pages_per_sec"] - 1 if base["pages_per_sec"] else 0.0
+        flag = ""
+        if p50_change > threshold or row["errors"] > base["errors"]:
+            flag = "  REGRESSION"
+            regressions.append(key)
+        print(f"{key:<30}{base['p50_ms']:>10.1f}{row['p50_ms']:>10.1f}{p50_change:>+9.0%}"
+              f"{row['pages_per_sec']:>10.1f}{rate_change:>+9.0%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cases", help=f"comma list of {', '.join(CASES)}")
+    parser.add_argument("--full", action="store_true", help="include the 1000-page case")
+    parser.add_argument("--endpoints", help=f"comma list of {', '.join(ENDPOINTS)}")
+    parser.add_argument("--repeat", type=int, default=5, help="requests per endpoint and case")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--http", action="store_true", help="load a local gunicorn instead of the test client")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn workers for --http")
+    parser.add_argument("--url", help="benchmark a running server (implies --http)")
+    parser.add_argument("--corpus-dir", default=os.path.join(tempfile.gettempdir(), "pymupdf-bench-corpus"))
+    parser.add_argument("--save", help="write the results to this baseline JSON file")
+    parser.add_argument("--compare", help="diff the results against this baseline JSON file")
+    parser.add_argument("--threshold", type=float, default=0.10, help="p50 increase that counts as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args()
+
+    cases = args.cases.split(",") if args.cases else [
+        name for name in CASES if args.full or name not in FULL_ONLY_CASES
+    ]
+    endpoints = args.endpoints.split(",") if args.endpoints else list(ENDPOINTS)
+    unknown = (set(cases) - set(CASES)) | (set(endpoints) - set(ENDPOINTS))
+    if unknown:
+        parser.error(f"unknown cases/endpoints: {', '.join(sorted(unknown))}")
+
+    http = args.http or args.url is not None
+    target = HttpTarget(args.url, args.workers) if http else ClientTarget()
+    import fitz
+    meta = {
+        "mode": "http" if http else "client",
+        "workers": args.workers if http and not args.url else None,
+        "concurrency": args.concurrency,
+        "repeat": args.repeat,
+        "corpus_version": CORPUS_VERSION,
+        "pymupdf": fitz.VersionBind,
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    print(f"mode: {meta['mode']}, concurrency {args.concurrency}, {args.repeat} requests per row")
+    print_header()
+    try:
+        results = run(target, cases, endpoints, args.repeat, args.concurrency, args.corpus_dir)
+        if http:
+            rss = target.worker_rss_mb()
+            print("\nworker RSS MB: " + (", ".join(f"{pid}={mb:.0f}" for pid, mb in sorted(rss.items())) or "-"))
+    finally:
+        target.close()
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"meta": meta, "results": results}, f, indent=2, sort_keys=True)
+        print(f"\nbaseline written to {args.save}")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline["meta"].get("mode") != meta["mode"]:
+            print(f"\nwarning: baseline mode {baseline['meta'].get('mode')} differs from {meta['mode']}")
+        regressions = compare(results, baseline, args.threshold)
+        if regressions and args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""Synthetic PDF forms for the benchmarks, generated with fitz itself."""
+import fitz
+
+OPTIONS_PER_PAGE = 24
+
+_DINGBATS = fitz.Font("zadb")
+
+
+def draw_form_page(page, seed=0, glyphs=False):
+    """Lay out a checkbox form: a title, label/value pairs and a column of options"""
+    page.insert_text((72, 60), "APPLICATION FORM", fontsize=14)
+    page.insert_text((72, 90), "Name:", fontsize=9)
+    page.insert_text((72, 102), f"Applicant {seed}", fontsize=9)
+    y = 130
+    for index in range(OPTIONS_PER_PAGE):
+        checked = (index + seed) % 3 == 0
+        if glyphs:
+            # ZapfDingbats ships with MuPDF and has both a tick and an empty box
+            writer = fitz.TextWriter(page.rect)
+            writer.append((72, y), "\u2714" if checked else "\u274f", font=_DINGBATS, fontsize=9)
+            writer.write_text(page)
+            page.insert_text((88, y), f"Option {index}", fontsize=9)
+        else:
+            box = fitz.Rect(72, y - 9, 82, y + 1)
+            page.draw_rect(box, color=(0, 0, 0), width=0.8)
+            if checked:
+                page.draw_line(box.tl + (2, 2), box.br - (2, 2), width=1.2)
+                page.draw_line(box.bl + (2, -2), box.tr + (-2, 2), width=1.2)
+            page.insert_text((88, y), f"Option {index}", fontsize=9)
+        y += 24
+
+
+def vector_form(page_count, glyphs=False):
+    """Born-digital form: checkboxes are vector squares (or box glyphs)"""
+    doc = fitz.open()
+    for number in range(page_count):
+        draw_form_page(doc.new_page(), seed=number, glyphs=glyphs)
+    data = doc.tobytes(garbage=3, deflate=True)
+    doc.close()
+    return data
+
+
+def scanned_form(page_count, dpi=150):
+    """Scanned form: every page is a single raster image with an OCR-like text layer"""
+    source = fitz.open(stream=vector_form(page_count), filetype="pdf")
+    doc = fitz.open()
+    for src_page in source:
+        page = doc.new_page(width=src_page.rect.width, height=src_page.rect.height)
+        pix = src_page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY)
+        page.insert_image(page.rect, pixmap=pix)
+        # Invisible text layer, like OCR output, so get_text still finds the labels
+        for block in src_page.get_text("dict")["blocks"]:
+            for line in block.get("lines", ()):
+                for span in line["spans"]:
+                    page.insert_text(span["origin"], span["text"], fontsize=span["size"], render_mode=3)
+    source.close()
+    data = doc.tobytes(garbage=3, deflate=True)
+    doc.close()
+    return data
+
+
+def field_form(page_count, fields_per_page=120, fields_per_block=80):
+    """Form-heavy pages: columns of LABEL: value pairs, each column one text block, plus a table"""
+    columns = -(-fields_per_page // fields_per_block)
+    doc = fitz.open()
+    for number in range(page_count):
+        page = doc.new_page(width=120 * columns + 260, height=1000)
+        for column in range(columns):
+            lines = []
+            for index in range(column * fields_per_block, min(fields_per_page, (column + 1) * fields_per_block)):
+                lines.append(f"FIELD {number}-{index}:")
+                lines.append(f"value {index}")
+            rect = fitz.Rect(20 + column * 120, 20, 130 + column * 120, 980)
+            page.insert_textbox(rect, "\n".join(lines), fontsize=4)
+        left = 20 + columns * 120
+        rows = [f"Item {row}  {row * 1.5:.2f}  {row}  {row * 4.5:.2f}" for row in range(12)]
+        page.insert_textbox(fitz.Rect(left, 20, left + 230, 400), "\n".join(rows), fontsize=8)
+        page.insert_text((left, 450), "Musterfirma GmbH, Hauptstrasse 1, 10115 Berlin", fontsize=8)
+    data = doc.tobytes(garbage=3, deflate=True)
+    doc.close()
+    return data
+
+
+# Bump when synthetic_document output changes, so cached corpus files are regenerated
+CORPUS_VERSION = "1"
+
+_WORDS = ("invoice", "amount", "customer", "delivery", "contract", "period", "total", "service",
+          "payment", "account", "reference", "address", "policy", "claim", "notice", "balance")
+
+
+def _box_images():
+    """Rendered unchecked/checked boxes for raster checkboxes (like a scanned form)"""
+    images = []
+    for checked in (False, True):
+        doc = fitz.open()
+        page = doc.new_page(width=10, height=10)
+        box = fitz.Rect(0.5, 0.5, 9.5, 9.5)
+        page.draw_rect(box, color=(0, 0, 0), width=0.8)
+        if checked:
+            page.draw_line(box.tl + (2, 2), box.br - (2, 2), width=1.2)
+            page.draw_line(box.bl + (2, -2), box.tr + (-2, 2), width=1.2)
+        images.append(page.get_pixmap(dpi=300, colorspace=fitz.csGRAY).tobytes("png"))
+        doc.close()
+    return images
+
+
+def synthetic_document(page_count, text_lines=20, fields=10, checkboxes=0, checkbox_style="vector",
+                       tables=0, seed=0):
+    """Parametric test document, deterministic for a given set of arguments
+
+    Per page: text_lines lines of prose, fields LABEL: value pairs, checkboxes
+    options drawn as vector squares or inserted as images (checkbox_style
+    "vector" / "raster"), and tables ruled 5x4 tables.
+    """
+    box_images = _box_images() if checkboxes and checkbox_style == "raster" else None
+    font = fitz.Font("helv")
+    doc = fitz.open()
+    for number in range(page_count):
+        page = doc.new_page()
+        # One text writer and one shape per page: a content stream update per call is much slower
+        writer = fitz.TextWriter(page.rect)
+        shape = page.new_shape()
+        state = seed * 7919 + number
+        y = 50
+        writer.append((50, y), f"DOCUMENT {seed}-{number + 1}", font=font, fontsize=12)
+        y += 22
+        for index in range(fields):
+            writer.append((50, y), f"FIELD {index}:", font=font, fontsize=8)
+            writer.append((50, y + 10), f"value {state % 97} {index}", font=font, fontsize=8)
+            y += 24 if index % 2 else 22
+        for index in range(checkboxes):
+            checked = (index + state) % 3 == 0
+            box = fitz.Rect(50, y - 8, 59, y + 1)
+            if box_images is not None:
+                page.insert_image(box, stream=box_images[checked])
+            else:
+                shape.draw_rect(box)
+                if checked:
+                    shape.draw_line(box.tl + (2, 2), box.br - (2, 2))
+                    shape.draw_line(box.bl + (2, -2), box.tr + (-2, 2))
+                shape.finish(color=(0, 0, 0), width=0.8)
+            writer.append((66, y), f"Option {index}", font=font, fontsize=8)
+            y += 14
+        for table in range(tables):
+            top = y + 6
+            for row in range(5):
+                for column in range(4):
+                    cell = fitz.Rect(50 + column * 120, top + row * 14, 170 + column * 120, top + (row + 1) * 14)
+                    shape.draw_rect(cell)
+                    text = f"Row {row}" if column == 0 else f"{(row + 1) * (column + state) * 1.25:.2f}"
+                    writer.append((cell.x0 + 3, cell.y1 - 4), text, font=font, fontsize=7)
+            shape.finish(color=(0.4, 0.4, 0.4), width=0.3)
+            y = top + 5 * 14 + 10
+        words = [_WORDS[(state + i) % len(_WORDS)] for i in range(14)]
+        for line in range(text_lines):
+            if y > page.rect.height - 40:
+                break
+            writer.append((50, y), " ".join(words[line % 5:] + words[:line % 5]), font=font, fontsize=8)
+            y += 11
+        shape.commit()
+        writer.write_text(page)
+    data = doc.tobytes(garbage=3, deflate=True)
+    doc.close()
+    return data
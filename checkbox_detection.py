@@ -0,0 +1,414 @@
+import os
+from collections import defaultdict
+
+import fitz  # PyMuPDF
+import numpy as np
+
+from instrumentation import stage
+
+# Bump whenever a change alters detection results, so cached results are invalidated
+DETECTOR_VERSION = "1"
+
+# Defaults match the detector that shipped in app.py
+DEFAULT_DARK_THRESHOLD = 150
+DEFAULT_MIN_DENSITY = 0.1
+DEFAULT_MAX_DENSITY = 0.4
+DEFAULT_CHANNEL_MODE = "first"
+
+CHANNEL_MODES = ("first", "luma", "min", "max")
+
+# Zoom used to rasterize candidate areas - higher resolution for better detection
+DETECTION_ZOOM = 4
+# "page" renders each page once and crops candidates out of it, "clip" renders every candidate
+RASTER_MODES = ("page", "clip")
+DEFAULT_RASTER_MODE = "page"
+# Upper bound on a single page raster (pixels); larger candidate unions are rendered in bands
+MAX_RASTER_PIXELS = int(os.environ.get("CHECKBOX_MAX_RASTER_PIXELS", 16_000_000))
+
+# "visual" rasterizes the area left of each line, "vector" reads the page's drawings and
+# box glyphs and falls back to "visual" on pages without vector checkboxes
+DETECTION_METHODS = ("visual", "vector")
+DEFAULT_DETECTION_METHOD = "visual"
+# Vector paths count as checkbox squares within this size range (points) and aspect ratio
+VECTOR_BOX_MIN_SIZE = 5
+VECTOR_BOX_MAX_SIZE = 20
+VECTOR_BOX_MAX_ASPECT = 1.35
+# Largest gap between a checkbox square and the text line it belongs to
+VECTOR_BOX_MAX_GAP = 25
+CHECKED_GLYPHS = frozenset("\u2612\u2611\u2713\u2714\u2717\u2718\u25a0")  # ☒ ☑ ✓ ✔ ✗ ✘ ■
+UNCHECKED_GLYPHS = frozenset("\u2610\u25a1\u274f")  # ☐ □ ❏
+BOX_GLYPHS = CHECKED_GLYPHS | UNCHECKED_GLYPHS
+
+# ITU-R BT.601 weights, same as MuPDF's RGB -> gray conversion
+_LUMA_WEIGHTS = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+
+def pixmap_array(pixmap):
+    """Zero-copy (height, width, n) uint8 view of a pixmap's samples"""
+    buf = np.frombuffer(pixmap.samples_mv, dtype=np.uint8)
+    # Rows may be padded, so reshape on the stride and drop the padding
+    rows = buf.reshape(pixmap.height, pixmap.stride)
+    return rows[:, :pixmap.width * pixmap.n].reshape(pixmap.height, pixmap.width, pixmap.n)
+
+
+def to_gray(pixels, channel_mode=DEFAULT_CHANNEL_MODE, alpha=False):
+    """Reduce a (height, width, n) array to one intensity value per pixel"""
+    if pixels.ndim == 2:
+        return pixels
+    color = pixels[:, :, :-1] if alpha and pixels.shape[2] > 1 else pixels
+    if channel_mode == "first" or color.shape[2] == 1:
+        # Matches the original loop, which only looked at the first byte of each pixel
+        return color[:, :, 0]
+    if channel_mode == "luma" and color.shape[2] == 3:
+        return color @ _LUMA_WEIGHTS
+    if channel_mode == "max":
+        return color.max(axis=2)
+    # "min" (and luma on non-RGB input): a pixel is as dark as its darkest channel
+    return color.min(axis=2)
+
+
+def mark_density(pixels, dark_threshold=DEFAULT_DARK_THRESHOLD,
+                 channel_mode=DEFAULT_CHANNEL_MODE, alpha=False):
+    """Fraction of pixels darker than dark_threshold"""
+    gray = to_gray(pixels, channel_mode, alpha)
+    if gray.size == 0:
+        return 0.0
+    return np.count_nonzero(gray < dark_threshold) / gray.size
+
+
+def has_mark_in_array(pixels, dark_threshold=DEFAULT_DARK_THRESHOLD,
+                      min_density=DEFAULT_MIN_DENSITY, max_density=DEFAULT_MAX_DENSITY,
+                      channel_mode=DEFAULT_CHANNEL_MODE, alpha=False):
+    """Check a pixel array for a checkbox mark"""
+    density = mark_density(pixels, dark_threshold, channel_mode, alpha)
+    # Checkboxes typically have between 10-40% dark pixels
+    # Too few = no mark, too many = likely just text/lines
+    return min_density < density < max_density
+
+
+def has_mark_in_area(pixmap, dark_threshold=DEFAULT_DARK_THRESHOLD,
+                     min_density=DEFAULT_MIN_DENSITY, max_density=DEFAULT_MAX_DENSITY,
+                     channel_mode=DEFAULT_CHANNEL_MODE):
+    """More selective detection of checkbox marks"""
+    if pixmap.width == 0 or pixmap.height == 0:
+        return False
+    return has_mark_in_array(pixmap_array(pixmap), dark_threshold, min_density,
+                             max_density, channel_mode, alpha=bool(pixmap.alpha))
+
+
+def checkbox_options_from_form(form):
+    """Detection settings of a get-checkboxes style request, raising ValueError on bad input"""
+    options = {
+        "detection_params": detection_params_from_form(form),
+        "detection_method": form.get("detection_method", DEFAULT_DETECTION_METHOD),
+        "raster_mode": form.get("raster_mode", DEFAULT_RASTER_MODE),
+    }
+    if options["raster_mode"] not in RASTER_MODES:
+        raise ValueError(f"raster_mode must be one of {', '.join(RASTER_MODES)}")
+    if options["detection_method"] not in DETECTION_METHODS:
+        raise ValueError(f"detection_method must be one of {', '.join(DETECTION_METHODS)}")
+    return options
+
+
+def detection_params_from_form(form):
+    """Read per-request detection settings, raising ValueError on bad input"""
+    params = {
+        "dark_threshold": form.get("dark_threshold", DEFAULT_DARK_THRESHOLD, type=int),
+        "min_density": form.get("min_density", DEFAULT_MIN_DENSITY, type=float),
+        "max_density": form.get("max_density", DEFAULT_MAX_DENSITY, type=float),
+        "channel_mode": form.get("channel_mode", DEFAULT_CHANNEL_MODE),
+    }
+    for name in ("dark_threshold", "min_density", "max_density"):
+        if form.get(name) is not None and form.get(name, type=type(params[name])) is None:
+            raise ValueError(f"{name} must be a number")
+    if not 0 <= params["dark_threshold"] <= 255:
+        raise ValueError("dark_threshold must be between 0 and 255")
+    if not 0 <= params["min_density"] < params["max_density"] <= 1:
+        raise ValueError("density band must satisfy 0 <= min_density < max_density <= 1")
+    if params["channel_mode"] not in CHANNEL_MODES:
+        raise ValueError(f"channel_mode must be one of {', '.join(CHANNEL_MODES)}")
+    return params
+
+
+def checkbox_candidates(text_dict):
+    """Yield (text, line rect, area left of the line) for lines that may be checkbox options"""
+    for block in text_dict["blocks"]:
+        if "lines" not in block:
+            continue
+        for line in block["lines"]:
+            text = " ".join(span["text"] for span in line["spans"]).strip()
+
+            # Skip empty lines
+            if not text:
+                continue
+
+            # Skip lines that are likely not checkbox options
+            if len(text) > 60 or (':' in text and '.' not in text) or text.endswith(':'):
+                continue
+
+            # Get the surrounding area
+            rect = fitz.Rect(line["bbox"])
+
+            # Only check a small square area to the left (where checkbox would be)
+            # This helps avoid detecting text as marks
+            checkbox_width = min(15, rect.height)  # Limit to reasonable checkbox size
+            left_area = fitz.Rect(
+                rect.x0 - checkbox_width - 5,  # 5px spacing
+                rect.y0 + (rect.height - checkbox_width)/2,  # Centered vertically
+                rect.x0 - 5,  # 5px spacing
+                rect.y0 + (rect.height - checkbox_width)/2 + checkbox_width
+            )
+            yield text, rect, left_area
+
+
+def _raster_groups(candidates, clip, matrix, max_pixels):
+    """Split candidates (sorted top to bottom) into groups whose union raster fits max_pixels"""
+    group, union = [], None
+    for candidate in sorted(candidates, key=lambda c: c[2].y0):
+        area = candidate[2] & clip
+        grown = area if union is None else union | area
+        if group and (grown * matrix).irect.get_area() > max_pixels:
+            yield group, union
+            group, grown = [], area
+        group.append(candidate)
+        union = grown
+    if group:
+        yield group, union
+
+
+def _marked_in_raster(page, group, union, matrix, detection_params):
+    """Render the union of a candidate group once and test each candidate's slice of it
+
+    If the union can't be rendered, the group falls back to one clip per
+    candidate, which skips only the candidates that fail on their own.
+    """
+    try:
+        with stage("render"):
+            pix = page.get_pixmap(matrix=matrix, clip=union)
+        pixels = pixmap_array(pix)
+    except Exception:
+        yield from _marked_in_clips(page, group, matrix, detection_params)
+        return
+    try:
+        for text, rect, left_area in group:
+            # Map the candidate rect into the raster's pixel coordinates
+            area = (left_area * matrix).irect
+            x0, x1 = max(area.x0 - pix.x, 0), min(area.x1 - pix.x, pix.width)
+            y0, y1 = max(area.y0 - pix.y, 0), min(area.y1 - pix.y, pix.height)
+            if x0 >= x1 or y0 >= y1:
+                continue
+            if has_mark_in_array(pixels[y0:y1, x0:x1], alpha=bool(pix.alpha), **detection_params):
+                yield text, rect
+    finally:
+        # Drop the raster before the next group is rendered
+        del pixels
+        del pix
+
+
+def _marked_in_clips(page, candidates, matrix, detection_params):
+    """Render and test every candidate area on its own"""
+    for text, rect, left_area in candidates:
+        try:
+            with stage("render"):
+                pix = page.get_pixmap(matrix=matrix, clip=left_area)
+
+            # Debug option - save image to check what we're analyzing
+            # Uncomment to debug
+            # pix.save(f"checkbox_{page.number}_{rect.y0}.png")
+
+            if has_mark_in_area(pix, **detection_params):
+                yield text, rect
+        except Exception:
+            continue
+
+
+def visual_checkboxes(page, text_dict, detection_params, raster_mode=DEFAULT_RASTER_MODE,
+                      zoom=DETECTION_ZOOM, max_pixels=MAX_RASTER_PIXELS):
+    """Detect marked checkboxes next to the text lines of one page"""
+    matrix = fitz.Matrix(zoom, zoom)
+    candidates = list(checkbox_candidates(text_dict))
+    if raster_mode == "clip":
+        marked = _marked_in_clips(page, candidates, matrix, detection_params)
+    else:
+        clip = page.rect
+        candidates = [c for c in candidates if not (c[2] & clip).is_empty]
+        marked = (
+            hit
+            for group, union in _raster_groups(candidates, clip, matrix, max_pixels)
+            for hit in _marked_in_raster(page, group, union, matrix, detection_params)
+        )
+    return [
+        {
+            'name': text,
+            'value': True,
+            'y_pos': rect.y0,
+            'x_pos': rect.x0,
+            'page': page.number + 1,
+            'detection_method': 'visual'
+        }
+        for text, rect in marked
+    ]
+
+
+class _BoxIndex:
+    """Checkbox squares of one page, bucketed by y-band for constant time lookups"""
+
+    band = 10
+
+    def __init__(self):
+        self.bands = defaultdict(list)
+
+    def __bool__(self):
+        return bool(self.bands)
+
+    def add(self, rect, marked=False):
+        box = {"rect": rect, "marked": marked}
+        for band in range(int(rect.y0 // self.band), int(rect.y1 // self.band) + 1):
+            self.bands[band].append(box)
+        return box
+
+    def containing(self, point):
+        """Box whose square contains point"""
+        for box in self.bands.get(int(point.y // self.band), ()):
+            rect = box["rect"]
+            # Ignore the border itself so strokes on the outline don't count as marks
+            margin_x, margin_y = rect.width * 0.15, rect.height * 0.15
+            if (rect.x0 + margin_x < point.x < rect.x1 - margin_x
+                    and rect.y0 + margin_y < point.y < rect.y1 - margin_y):
+                return box
+        return None
+
+    def left_of(self, rect):
+        """Closest box left of (or starting at) a text line and vertically centered on it"""
+        best = None
+        for band in range(int(rect.y0 // self.band), int(rect.y1 // self.band) + 1):
+            for box in self.bands.get(band, ()):
+                box_rect = box["rect"]
+                center_y = (box_rect.y0 + box_rect.y1) / 2
+                if not rect.y0 <= center_y <= rect.y1:
+                    continue
+                if not rect.x0 - VECTOR_BOX_MAX_GAP <= box_rect.x1 <= rect.x0 + box_rect.width + 1:
+                    continue
+                if best is None or box_rect.x1 > best["rect"].x1:
+                    best = box
+        return best
+
+
+def _is_box_size(rect):
+    width, height = rect.width, rect.height
+    if not (VECTOR_BOX_MIN_SIZE <= width <= VECTOR_BOX_MAX_SIZE
+            and VECTOR_BOX_MIN_SIZE <= height <= VECTOR_BOX_MAX_SIZE):
+        return False
+    return max(width, height) / min(width, height) <= VECTOR_BOX_MAX_ASPECT
+
+
+def _is_dark_fill(path):
+    fill = path.get("fill")
+    return path.get("type", "") in ("f", "fs") and bool(fill) and sum(fill) / len(fill) < 0.5
+
+
+def _index_vector_boxes(page, text_dict):
+    """Index a page's checkbox squares and mark them from drawn ticks and box glyphs"""
+    index = _BoxIndex()
+    strokes = []
+    # get_cdrawings skips building Rect/Point objects, which adds up on busy pages
+    with stage("drawings"):
+        paths = page.get_cdrawings()
+    for path in paths:
+        rect = fitz.Rect(path["rect"])
+        kinds = [item[0] for item in path["items"]]
+        outline = "re" in kinds or "qu" in kinds or kinds.count("l") >= 4 or (
+            path.get("closePath") and len(kinds) >= 3)
+        if outline and _is_box_size(rect):
+            # A single path may hold both the square and the tick drawn inside it
+            ticked = any(kind in ("l", "c") for kind in kinds) and "re" in kinds
+            index.add(rect, marked=ticked or _is_dark_fill(path))
+        elif rect.width <= VECTOR_BOX_MAX_SIZE and rect.height <= VECTOR_BOX_MAX_SIZE:
+            strokes.append(rect)
+
+    # Lines that consist only of box glyphs are boxes, not checkbox labels
+    for block in text_dict["blocks"]:
+        for line in block.get("lines", ()):
+            text = "".join(span["text"] for span in line["spans"]).strip()
+            if text and all(char in BOX_GLYPHS or char.isspace() for char in text):
+                index.add(fitz.Rect(line["bbox"]), marked=any(char in CHECKED_GLYPHS for char in text))
+
+    # Ticks, crosses and fills drawn inside a square mark it
+    for rect in strokes:
+        box = index.containing((rect.tl + rect.br) / 2)
+        if box is not None:
+            box["marked"] = True
+    return index
+
+
+def vector_checkboxes(page, text_dict):
+    """Detect checkboxes from vector paths and box glyphs, or None if the page has neither"""
+    index = _index_vector_boxes(page, text_dict)
+    found = []
+    has_candidates = bool(index)
+    for text, rect, left_area in checkbox_candidates(text_dict):
+        if text[0] in BOX_GLYPHS:
+            # Glyph at the start of the label, e.g. "☒ Yes"
+            has_candidates = True
+            marked, text = text[0] in CHECKED_GLYPHS, text[1:].strip()
+            if not text:
+                continue
+        else:
+            box = index.left_of(rect) if index else None
+            if box is None:
+                continue
+            marked = box["marked"]
+        if marked:
+            found.append({
+                'name': text,
+                'value': True,
+                'y_pos': rect.y0,
+                'x_pos': rect.x0,
+                'page': page.number + 1,
+                'detection_method': 'vector'
+            })
+    return found if has_candidates else None
+
+
+def detect_checkboxes(page, text_dict, detection_params, detection_method=DEFAULT_DETECTION_METHOD,
+                      raster_mode=DEFAULT_RASTER_MODE):
+    """Marked checkboxes next to the text lines of one page"""
+    if detection_method == "vector":
+        found = vector_checkboxes(page, text_dict)
+        if found is not None:
+            return found
+    return visual_checkboxes(page, text_dict, detection_params, raster_mode=raster_mode)
+
+
+def page_checkboxes(page, detection_params, detection_method=DEFAULT_DETECTION_METHOD,
+                    raster_mode=DEFAULT_RASTER_MODE, features=("widgets", "visual"), text_dict=None):
+    """Checkbox widgets and detected checkbox marks of one page
+
+    Pass text_dict to reuse a get_text("dict") result the caller already has.
+    """
+    checkbox_content = []
+
+    # 1. Try widget detection (existing)
+    for field in (page.widgets() if "widgets" in features else ()):
+        if field.field_type == fitz.PDF_WIDGET_TYPE_CHECKBOX:
+            rect = field.rect
+            checkbox_content.append({
+                'name': field.field_name,
+                'value': field.field_value,
+                'y_pos': rect.y0,
+                'x_pos': rect.x0,
+                'page': page.number + 1,
+                'detection_method': 'widget'
+            })
+
+    # 2. Add vector or visual detection for checkbox text
+    if "visual" not in features:
+        return checkbox_content
+    if text_dict is None:
+        with stage("get_text"):
+            text_dict = page.get_text("dict")
+    checkbox_content.extend(detect_checkboxes(
+        page, text_dict, detection_params,
+        detection_method=detection_method, raster_mode=raster_mode
+    ))
+    return checkbox_content
@@ -0,0 +1,81 @@
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+
+from itsdangerous import BadSignature, SignatureExpired, URLSafeTimedSerializer
+from werkzeug.security import check_password_hash
+
+# Seconds a successful Basic auth check is remembered (per worker process); 0 checks the hash every time
+AUTH_CACHE_TTL = int(os.environ.get("AUTH_CACHE_TTL", 300))
+# Secret for signing bearer tokens; must be the same in every worker. Unset disables tokens
+AUTH_TOKEN_SECRET = os.environ.get("AUTH_TOKEN_SECRET")
+# Lifetime of a bearer token in seconds
+AUTH_TOKEN_TTL = int(os.environ.get("AUTH_TOKEN_TTL", 900))
+
+
+class CredentialVerifier:
+    """check_password_hash with a short-lived memory of successful checks
+
+    The password hashes are deliberately slow, and clients send the same
+    credentials with every request. After one successful check the verifier
+    keeps an HMAC of (username, password) under a per-process random key
+    for ttl seconds. Later requests are compared against it with
+    hmac.compare_digest. Only successes are remembered, so a wrong password
+    still pays the full hash. No password is kept in memory, and a cached
+    digest is no use outside this process.
+    """
+
+    def __init__(self, users, ttl=AUTH_CACHE_TTL):
+        self.users = users
+        self.ttl = ttl
+        self._key = secrets.token_bytes(32)
+        self._verified = {}
+        self._lock = threading.Lock()
+
+    def _digest(self, username, password):
+        message = username.encode() + b"\0" + password.encode()
+        return hmac.new(self._key, message, hashlib.sha256).digest()
+
+    def verify(self, username, password):
+        if not username or password is None or username not in self.users:
+            return False
+        if self.ttl <= 0:
+            return check_password_hash(self.users[username], password)
+        digest = self._digest(username, password)
+        entry = self._verified.get(username)
+        if entry is not None and entry[1] > time.monotonic() and hmac.compare_digest(entry[0], digest):
+            return True
+        if not check_password_hash(self.users[username], password):
+            return False
+        with self._lock:
+            # One entry per configured user, so the memory is bounded by the user table
+            self._verified[username] = (digest, time.monotonic() + self.ttl)
+        return True
+
+
+class TokenIssuer:
+    """Signed, expiring bearer tokens naming a user, shared by every worker through the secret"""
+
+    def __init__(self, secret=AUTH_TOKEN_SECRET, ttl=AUTH_TOKEN_TTL):
+        self.ttl = ttl
+        self._serializer = URLSafeTimedSerializer(secret, salt="api-token") if secret else None
+
+    @property
+    def enabled(self):
+        return self._serializer is not None
+
+    def issue(self, username):
+        return self._serializer.dumps({"u": username})
+
+    def verify(self, token):
+        """Username of a valid, unexpired token, or None"""
+        if self._serializer is None or not token:
+            return None
+        try:
+            payload = self._serializer.loads(token, max_age=self.ttl)
+        except (SignatureExpired, BadSignature):
+            return None
+        return payload.get("u") if isinstance(payload, dict) else None
@@ -0,0 +1,50 @@
+"""Production gunicorn settings, picked up by `gunicorn -c gunicorn.conf.py app:app`
+
+Every value can be overridden with its environment variable or on the command line.
+"""
+import os
+
+import page_executor
+from memory_usage import current_rss_kb, trim_mupdf_store
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:6000")
+# PDF work is CPU bound. Half as many sync workers as CPUs, so that a long document can
+# still shard its pages: unless PAGE_WORKERS is set, post_fork sizes each worker's page
+# pool to cpu_count // workers (at least 2 here), and workers * pool stays within the CPU count.
+# The cost is half the concurrency for small requests; WEB_CONCURRENCY=<cpus> gets it
+# back and turns sharding off. Admission control bounds the estimated work, not the
+# process count; each worker can also run JOB_WORKERS jobs
+workers = int(os.environ.get("WEB_CONCURRENCY") or max(1, (os.cpu_count() or 1) // 2))
+worker_class = "sync"
+# Import fitz and the app (and its config) once in the master so workers fork warm
+preload_app = True
+# Long documents should go through the job API; this only stops runaway requests
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 120))
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", 30))
+# Recycle each worker after this many requests (0 = never), jittered so they don't restart together
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 1000))
+max_requests_jitter = int(os.environ.get("GUNICORN_MAX_REQUESTS_JITTER", 100))
+# Heartbeat files in memory; a disk-backed /tmp can stall workers under container I/O limits
+worker_tmp_dir = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+# Bytes MuPDF's resource store (fonts, images, display lists) may keep per worker between requests
+MUPDF_STORE_MAXSIZE = int(os.environ.get("MUPDF_STORE_MAXSIZE", 64 * 1024 * 1024))
+# A worker whose RSS exceeds this after a request exits and is replaced (0 = never)
+WORKER_MAX_RSS_MB = int(os.environ.get("WORKER_MAX_RSS_MB", 1024))
+
+
+def post_fork(server, worker):
+    # server.cfg.workers includes a -w given on the command line
+    if not os.environ.get("PAGE_WORKERS"):
+        page_executor.PAGE_WORKERS = page_executor.default_page_workers(server.cfg.workers)
+
+
+def post_request(worker, req, environ, resp):
+    # Runs once the response has been sent
+    trim_mupdf_store(MUPDF_STORE_MAXSIZE)
+    rss_kb = current_rss_kb()
+    if WORKER_MAX_RSS_MB and rss_kb is not None and rss_kb > WORKER_MAX_RSS_MB * 1024:
+        worker.log.info("Worker %s at %d MiB RSS (limit %d MiB), recycling", worker.pid, rss_kb // 1024,
+                        WORKER_MAX_RSS_MB)
+        # The sync worker finishes its loop and the arbiter forks a fresh one
+        worker.alive = False
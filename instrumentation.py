@@ -0,0 +1,292 @@
+import contextvars
+import cProfile
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from memory_usage import current_rss_kb, mupdf_store_usage, process_alive
+
+# Directory where each worker process drops its metrics file; /metrics merges them
+METRICS_DIR = os.environ.get("METRICS_DIR") or os.path.join(tempfile.gettempdir(), "pymupdf-metrics")
+# Seconds between metric file writes of one worker (the worker serving /metrics always writes first)
+METRICS_FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_INTERVAL", 1))
+# Allow per-request cProfile dumps (X-Profile: 1 or ?profile=1); off unless set
+PROFILE_REQUESTS = os.environ.get("PROFILE_REQUESTS", "").lower() in ("1", "true", "yes")
+PROFILE_DIR = os.environ.get("PROFILE_DIR") or os.path.join(tempfile.gettempdir(), "pymupdf-profiles")
+
+# Histogram buckets by metric
+BUCKETS = {
+    "pymupdf_request_duration_seconds": (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+    "pymupdf_stage_duration_seconds": (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30),
+    "pymupdf_pages_per_second": (1, 5, 10, 25, 50, 100, 250, 500, 1000),
+    "pymupdf_request_size_bytes": (1e3, 1e4, 1e5, 1e6, 1e7, 5e7, 1e8),
+    "pymupdf_response_size_bytes": (1e3, 1e4, 1e5, 1e6, 1e7, 5e7, 1e8),
+}
+HELP = {
+    "pymupdf_requests_total": "Requests handled, by endpoint and status",
+    "pymupdf_pages_total": "Pages processed, by endpoint",
+    "pymupdf_request_duration_seconds": "Request latency, by endpoint",
+    "pymupdf_stage_duration_seconds": "Time spent per processing stage within one request",
+    "pymupdf_pages_per_second": "Page throughput of requests that processed pages",
+    "pymupdf_request_size_bytes": "Request body size",
+    "pymupdf_response_size_bytes": "Response body size (buffered and file responses)",
+    "pymupdf_mupdf_store_bytes": "MuPDF resource store usage of each live worker",
+    "pymupdf_mupdf_store_max_bytes": "MuPDF resource store limit of each live worker (0 = unlimited)",
+    "pymupdf_process_rss_bytes": "Resident memory of each live worker",
+}
+
+_timings = contextvars.ContextVar("stage_timings", default=None)
+
+
+class RequestTimings:
+    """Stage durations of one request, in the order the stages first ran"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.pages = 0
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def server_timing(self, total):
+        """Server-Timing header value, in milliseconds"""
+        parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.stages.items()]
+        parts.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(parts)
+
+
+def start_request():
+    timings = RequestTimings()
+    _timings.set(timings)
+    return timings
+
+
+@contextmanager
+def stage(name):
+    """Time a block as part of the current request; a no-op outside requests (e.g. in pool workers)"""
+    timings = _timings.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - start)
+
+
+def count_pages(count=1):
+    timings = _timings.get()
+    if timings is not None:
+        timings.pages += count
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+class MetricsRegistry:
+    """Counters and histograms of one process, written to a per-pid file for /metrics to merge
+
+    Files of workers that exited are folded into an archive file, so totals
+    stay monotonic across worker restarts while gauges only cover live workers.
+    """
+
+    def __init__(self, directory=METRICS_DIR, flush_interval=METRICS_FLUSH_INTERVAL):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.counters = defaultdict(float)
+        self.histograms = {}
+        self._lock = threading.Lock()
+        self._last_flush = 0.0
+        os.makedirs(directory, exist_ok=True)
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            self.counters[_key(name, labels)] += value
+
+    def observe(self, name, value, **labels):
+        buckets = BUCKETS[name]
+        with self._lock:
+            histogram = self.histograms.get(_key(name, labels))
+            if histogram is None:
+                histogram = self.histograms[_key(name, labels)] = [[0] * len(buckets), 0.0, 0]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram[0][i] += 1
+                    break
+            histogram[1] += value
+            histogram[2] += 1
+
+    def record_request(self, endpoint, status, timings, seconds, bytes_in, bytes_out):
+        self.inc("pymupdf_requests_total", endpoint=endpoint, status=str(status))
+        self.observe("pymupdf_request_duration_seconds", seconds, endpoint=endpoint)
+        for name, stage_seconds in timings.stages.items():
+            self.observe("pymupdf_stage_duration_seconds", stage_seconds, stage=name)
+        if timings.pages:
+            self.inc("pymupdf_pages_total", timings.pages, endpoint=endpoint)
+            self.observe("pymupdf_pages_per_second", timings.pages / max(seconds, 1e-6), endpoint=endpoint)
+        if bytes_in:
+            self.observe("pymupdf_request_size_bytes", bytes_in, endpoint=endpoint)
+        if bytes_out:
+            self.observe("pymupdf_response_size_bytes", bytes_out, endpoint=endpoint)
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def _snapshot(self):
+        with self._lock:
+            return {
+                "counters": [[name, dict(labels), value] for (name, labels), value in self.counters.items()],
+                "histograms": [[name, dict(labels), [list(h[0]), h[1], h[2]]]
+                               for (name, labels), h in self.histograms.items()],
+                "gauges": _process_gauges(),
+            }
+
+    def flush(self):
+        """Write this process's totals to its metrics file (atomically)"""
+        self._last_flush = time.monotonic()
+        path = os.path.join(self.directory, f"metrics-{os.getpid()}.json")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._snapshot(), f)
+        os.replace(tmp_path, path)
+
+    def collect(self):
+        """Merged counters and histograms of every worker that ever wrote a file here"""
+        self.flush()
+        merged = {"counters": defaultdict(float), "histograms": {}, "gauges": []}
+        with open(os.path.join(self.directory, "metrics.lock"), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            archive_path = os.path.join(self.directory, "metrics-archive.json")
+            archive = {"counters": defaultdict(float), "histograms": {}}
+            _merge(archive, _load(archive_path))
+            archived = False
+            for filename in os.listdir(self.directory):
+                if not (filename.startswith("metrics-") and filename.endswith(".json")):
+                    continue
+                pid = filename[len("metrics-"):-len(".json")]
+                if not pid.isdigit():
+                    continue
+                path = os.path.join(self.directory, filename)
+                if process_alive(int(pid)):
+                    snapshot = _load(path)
+                    _merge(merged, snapshot)
+                    for name, labels, value in snapshot.get("gauges", ()):
+                        merged["gauges"].append((name, {**labels, "pid": pid}, value))
+                else:
+                    # A worker that exited: keep its totals in the archive
+                    _merge(archive, _load(path))
+                    os.remove(path)
+                    archived = True
+            if archived:
+                tmp_path = f"{archive_path}.tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump(_dump(archive), f)
+                os.replace(tmp_path, archive_path)
+            _merge(merged, _dump(archive))
+        return merged
+
+
+def _process_gauges():
+    store_size, store_max = mupdf_store_usage()
+    rss_kb = current_rss_kb()
+    gauges = []
+    if store_size is not None:
+        gauges.append(["pymupdf_mupdf_store_bytes", {}, store_size])
+        gauges.append(["pymupdf_mupdf_store_max_bytes", {}, store_max])
+    if rss_kb is not None:
+        gauges.append(["pymupdf_process_rss_bytes", {}, rss_kb * 1024])
+    return gauges
+
+
+def _load(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"counters": [], "histograms": []}
+
+
+def _merge(into, snapshot):
+    for name, labels, value in snapshot.get("counters", ()):
+        into["counters"][_key(name, labels)] += value
+    for name, labels, (counts, total, count) in snapshot.get("histograms", ()):
+        histogram = into["histograms"].setdefault(_key(name, labels), [[0] * len(counts), 0.0, 0])
+        if len(histogram[0]) != len(counts):
+            # Buckets changed between versions: keep sum and count only
+            counts = [0] * len(histogram[0])
+        histogram[0] = [a + b for a, b in zip(histogram[0], counts)]
+        histogram[1] += total
+        histogram[2] += count
+
+
+def _dump(merged):
+    return {
+        "counters": [[name, dict(labels), value] for (name, labels), value in merged["counters"].items()],
+        "histograms": [[name, dict(labels), h] for (name, labels), h in merged["histograms"].items()],
+    }
+
+
+def _labels_text(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+def render_prometheus(merged, gauges=()):
+    """Prometheus text exposition of merged metrics, their per-worker gauges and extra (name, labels, value) gauges"""
+    lines = []
+    by_name = defaultdict(list)
+    for (name, labels), value in merged["counters"].items():
+        by_name[("counter", name)].append((labels, value))
+    for (name, labels), histogram in merged["histograms"].items():
+        by_name[("histogram", name)].append((labels, histogram))
+    for name, labels, value in list(merged.get("gauges", ())) + list(gauges):
+        by_name[("gauge", name)].append((tuple(sorted(labels.items())), value))
+    for (kind, name), samples in sorted(by_name.items(), key=lambda item: item[0][1]):
+        if name in HELP:
+            lines.append(f"# HELP {name} {HELP[name]}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in sorted(samples, key=lambda sample: sample[0]):
+            if kind != "histogram":
+                lines.append(f"{name}{_labels_text(labels)} {_number(value)}")
+                continue
+            counts, total, count = value
+            cumulative = 0
+            for bound, bucket_count in zip(BUCKETS.get(name, ()), counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{_labels_text(labels, [('le', _number(bound))])} {cumulative}")
+            lines.append(f"{name}_bucket{_labels_text(labels, [('le', '+Inf')])} {count}")
+            lines.append(f"{name}_sum{_labels_text(labels)} {_number(total)}")
+            lines.append(f"{name}_count{_labels_text(labels)} {count}")
+    return "\n".join(lines) + "\n"
+
+
+class RequestProfiler:
+    """cProfile of one request, dumped to PROFILE_DIR as a .prof file (pstats / snakeviz)"""
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+
+    def dump(self, endpoint):
+        self.profile.disable()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        filename = f"{endpoint}-{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{time.monotonic_ns() % 10**6}.prof"
+        self.profile.dump_stats(os.path.join(PROFILE_DIR, filename))
+        return filename
@@ -0,0 +1,457 @@
+import json
+import logging
+import multiprocessing
+import os
+import secrets
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from checkbox_detection import checkbox_options_from_form, page_checkboxes
+from output_formats import columnar_document, columnar_page, dumps
+from selection import CHECKBOX_FEATURES, TEXT_FEATURES, page_ranges_from_form, parse_features, resolve_pages
+from memory_usage import process_alive
+from text_extraction import extract_page_content
+from uploads import open_pdf
+
+logger = logging.getLogger(__name__)
+
+# Directory holding the job database, uploads and results; shared by all gunicorn workers
+JOB_DIR = os.environ.get("JOB_DIR") or os.path.join(tempfile.gettempdir(), "pymupdf-jobs")
+# Job processes per gunicorn worker
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+# Seconds a finished job (and its result) is kept
+JOB_RESULT_TTL = int(os.environ.get("JOB_RESULT_TTL", 3600))
+# Times a job is started before a job process that keeps dying on it marks it failed
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", 2))
+# Running jobs write their progress at most this often (seconds)
+PROGRESS_INTERVAL = 0.5
+# Expired jobs are purged every this many submissions
+PURGE_INTERVAL = 16
+
+JOB_OPERATIONS = ("extract-text", "get-checkboxes")
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    operation TEXT NOT NULL,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL,
+    pages_done INTEGER NOT NULL DEFAULT 0,
+    pages_total INTEGER,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    owner_pid INTEGER,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    mimetype TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    expires_at REAL NOT NULL
+)
+"""
+# Columns added after the first release, for databases created before them
+_ADDED_COLUMNS = (("owner_pid", "INTEGER"), ("attempts", "INTEGER NOT NULL DEFAULT 0"))
+
+
+class JobCancelled(Exception):
+    """Raised inside a job when its cancellation was requested"""
+
+
+def job_params_from_form(operation, form, filename):
+    """JSON-serializable parameters of a job, raising ValueError on bad input (like the sync endpoints)"""
+    if operation not in JOB_OPERATIONS:
+        raise ValueError(f"operation must be one of {', '.join(JOB_OPERATIONS)}")
+    page_ranges = page_ranges_from_form(form)
+    params = {"filename": filename, "pages": [list(r) for r in page_ranges] if page_ranges else None}
+    if operation == "extract-text":
+        params["format"] = form.get("format", "json")
+        if params["format"] not in ("json", "columnar"):
+            raise ValueError("format must be one of json, columnar")
+        params["features"] = sorted(parse_features(form.get("features"), TEXT_FEATURES))
+    else:
+        params["options"] = checkbox_options_from_form(form)
+        params["features"] = sorted(parse_features(form.get("features"), CHECKBOX_FEATURES))
+    return params
+
+
+class JobStore:
+    """Job state in SQLite plus one directory per job for its upload and result
+
+    Every call opens its own short-lived connection, so a store can be used from
+    any gunicorn worker or job process, before or after a fork. Queued jobs are
+    claimed from the table by job processes, which record their pid as the
+    owner; running jobs whose owner died are requeued (or failed after
+    JOB_MAX_ATTEMPTS starts).
+    """
+
+    def __init__(self, directory=JOB_DIR, ttl=JOB_RESULT_TTL):
+        self.directory = directory
+        self.ttl = ttl
+        self.path = os.path.join(directory, "jobs.sqlite3")
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(_SCHEMA)
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for name, definition in _ADDED_COLUMNS:
+                if name not in columns:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {definition}")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return _Closing(conn)
+
+    def job_dir(self, job_id):
+        return os.path.join(self.directory, job_id)
+
+    def input_path(self, job_id):
+        return os.path.join(self.job_dir(job_id), "input.pdf")
+
+    def result_path(self, job_id):
+        return os.path.join(self.job_dir(job_id), "result")
+
+    def create(self, operation, params, upload):
+        """Register a queued job for upload (a PdfUpload) and return its id"""
+        job_id = secrets.token_hex(16)
+        os.makedirs(self.job_dir(job_id))
+        upload.save(self.input_path(job_id))
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, operation, params, status, created_at, updated_at, expires_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, operation, json.dumps(params), QUEUED, now, now, now + self.ttl)
+            )
+        return job_id
+
+    def get(self, job_id):
+        """The job's row as a dict, or None if it doesn't exist or has expired"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None or row["expires_at"] < time.time():
+            return None
+        if row["status"] == RUNNING and not _owner_alive(row["owner_pid"]):
+            # Its job process died (e.g. with a recycled gunicorn worker)
+            self.recover_orphans()
+            return self.get(job_id)
+        return dict(row)
+
+    def claim(self):
+        """Mark the oldest queued job running, owned by this process, and return its id (None if none)"""
+        now = time.time()
+        with self._connect() as conn:
+            # IMMEDIATE takes the write lock up front, so two processes can't claim the same row
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT id FROM jobs WHERE status = ? AND cancel_requested = 0 ORDER BY created_at LIMIT 1",
+                    (QUEUED,)
+                ).fetchone()
+                if row is not None:
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, owner_pid = ?, attempts = attempts + 1, pages_done = 0, "
+                        "updated_at = ?, expires_at = ? WHERE id = ?",
+                        (RUNNING, os.getpid(), now, now + self.ttl, row["id"])
+                    )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return row["id"] if row is not None else None
+
+    def recover_orphans(self):
+        """Requeue running jobs whose owner process is gone; returns how many were requeued
+
+        A job that was already started JOB_MAX_ATTEMPTS times is marked failed
+        instead, so a document that kills its process can't loop forever.
+        """
+        now = time.time()
+        requeued = 0
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                running = conn.execute("SELECT id, owner_pid, attempts, cancel_requested FROM jobs WHERE status = ?",
+                                       (RUNNING,)).fetchall()
+                for row in running:
+                    if _owner_alive(row["owner_pid"]):
+                        continue
+                    if row["cancel_requested"]:
+                        status, error = CANCELLED, None
+                    elif row["attempts"] >= JOB_MAX_ATTEMPTS:
+                        status, error = FAILED, f"Job process exited before finishing ({row['attempts']} attempts)"
+                    else:
+                        status, error = QUEUED, None
+                        requeued += 1
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, error = ?, owner_pid = NULL, updated_at = ?, expires_at = ? "
+                        "WHERE id = ? AND status = ?",
+                        (status, error, now, now + self.ttl, row["id"], RUNNING)
+                    )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return requeued
+
+    def start(self, job_id, pages_total):
+        """Record the page count of a claimed job; False if its cancellation was requested"""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET pages_total = ?, updated_at = ? "
+                "WHERE id = ? AND status = ? AND owner_pid = ? AND cancel_requested = 0",
+                (pages_total, time.time(), job_id, RUNNING, os.getpid())
+            )
+        return cursor.rowcount == 1
+
+    def progress(self, job_id, pages_done):
+        """Record progress; returns True when cancellation has been requested
+
+        Progress also extends the job's expiry, so a job only expires ttl seconds
+        after it finished or after its process was last heard from.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET pages_done = ?, updated_at = ?, expires_at = ? WHERE id = ?",
+                         (pages_done, now, now + self.ttl, job_id))
+            row = conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row is None or bool(row["cancel_requested"])
+
+    def finish(self, job_id, status, body=None, mimetype=None, error=None):
+        """Store the outcome of a job; its result then lives for ttl seconds"""
+        if body is not None:
+            # Written under a temporary name so readers never see a partial result
+            tmp_path = self.result_path(job_id) + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(body)
+            os.replace(tmp_path, self.result_path(job_id))
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, mimetype = ?, error = ?, updated_at = ?, expires_at = ? "
+                "WHERE id = ? AND status NOT IN (?, ?, ?)",
+                (status, mimetype, error, now, now + self.ttl, job_id, *FINISHED_STATES)
+            )
+        # The upload isn't needed any more
+        try:
+            os.remove(self.input_path(job_id))
+        except OSError:
+            pass
+
+    def cancel(self, job_id):
+        """Request cancellation; a queued job is cancelled at once, a running one at its next page"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET cancel_requested = 1, updated_at = ? WHERE id = ?", (now, job_id))
+            conn.execute(
+                "UPDATE jobs SET status = ?, expires_at = ? WHERE id = ? AND status = ?",
+                (CANCELLED, now + self.ttl, job_id, QUEUED)
+            )
+        return self.get(job_id)
+
+    def delete(self, job_id):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        shutil.rmtree(self.job_dir(job_id), ignore_errors=True)
+
+    def purge_expired(self):
+        """Delete expired jobs with their files; returns how many were removed"""
+        with self._connect() as conn:
+            expired = [row["id"] for row in
+                       conn.execute("SELECT id FROM jobs WHERE expires_at < ?", (time.time(),))]
+        for job_id in expired:
+            self.delete(job_id)
+        return len(expired)
+
+
+def _owner_alive(pid):
+    # Rows from before owners were recorded have none
+    return pid is not None and process_alive(pid)
+
+
+class _Closing:
+    """Context manager that closes (not just commits) a sqlite3 connection"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self.conn
+
+    def __exit__(self, *exc_info):
+        self.conn.close()
+
+
+def _text_job(doc, page_numbers, params, on_page):
+    features = frozenset(params["features"])
+    pages = []
+    for page_num in page_numbers:
+        pages.append((page_num, extract_page_content(doc[page_num], params["filename"], features)))
+        on_page()
+    if params["format"] == "columnar":
+        return dumps(columnar_document([columnar_page(page) for _, page in pages], params["filename"]))
+    return dumps({f"page_{page_num + 1}": page for page_num, page in pages})
+
+
+def _checkbox_job(doc, page_numbers, params, on_page):
+    options = params["options"]
+    features = frozenset(params["features"])
+    checkbox_content = []
+    for page_num in page_numbers:
+        checkbox_content.extend(page_checkboxes(doc[page_num], options["detection_params"],
+                                                options["detection_method"], options["raster_mode"], features))
+        on_page()
+    checkbox_content.sort(key=lambda x: (x['page'], x['y_pos'], x['x_pos']))
+    return dumps(checkbox_content)
+
+
+_JOB_RUNNERS = {"extract-text": _text_job, "get-checkboxes": _checkbox_job}
+
+
+def drain_jobs(directory):
+    """Claim and run queued jobs in this job process until none are left; returns how many ran"""
+    store = JobStore(directory)
+    store.recover_orphans()
+    ran = 0
+    while True:
+        job_id = store.claim()
+        if job_id is None:
+            return ran
+        run_job(store, job_id)
+        ran += 1
+
+
+def run_job(store, job_id):
+    """Run one claimed job to completion, recording progress and the result in the store"""
+    job = store.get(job_id)
+    if job is None:
+        return
+    try:
+        params = json.loads(job["params"])
+        doc = open_pdf(store.input_path(job_id))
+        try:
+            page_ranges = [tuple(r) for r in params["pages"]] if params["pages"] else None
+            page_numbers = resolve_pages(page_ranges, doc.page_count)
+            if not store.start(job_id, len(page_numbers)):
+                store.finish(job_id, CANCELLED)
+                return
+            pages_done = 0
+            last_report = time.monotonic()
+
+            def on_page():
+                nonlocal pages_done, last_report
+                pages_done += 1
+                if time.monotonic() - last_report >= PROGRESS_INTERVAL:
+                    last_report = time.monotonic()
+                    if store.progress(job_id, pages_done):
+                        raise JobCancelled()
+
+            body = _JOB_RUNNERS[job["operation"]](doc, page_numbers, params, on_page)
+        finally:
+            doc.close()
+        store.progress(job_id, pages_done)
+        store.finish(job_id, DONE, body, "application/json")
+    except JobCancelled:
+        store.finish(job_id, CANCELLED)
+    except Exception as e:
+        logger.exception("Job %s failed", job_id)
+        store.finish(job_id, FAILED, error=str(e))
+
+
+class JobRunner:
+    """Bounded process pool of one gunicorn worker that drains the store's job queue
+
+    Jobs live in the store, not in the pool: submit() queues a row and wakes
+    the pool, whose processes claim queued jobs of any worker. A job whose
+    process died is requeued and picked up by the next wake-up, e.g. when its
+    status is polled. The pool is started on first use, so it is created after
+    gunicorn forks its workers.
+    """
+
+    def __init__(self, store, workers=JOB_WORKERS):
+        self.store = store
+        self.workers = workers
+        self._pool = None
+        self._submissions = 0
+        self._draining = 0
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                context = multiprocessing.get_context(
+                    "fork" if "fork" in multiprocessing.get_all_start_methods() else None)
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+            return self._pool
+
+    def submit(self, operation, params, upload):
+        """Queue a job and return its id"""
+        with self._lock:
+            self._submissions += 1
+            purge = self._submissions % PURGE_INTERVAL == 0
+        if purge:
+            self.store.purge_expired()
+        job_id = self.store.create(operation, params, upload)
+        self.wake()
+        return job_id
+
+    def wake(self):
+        """Have an idle pool process drain the queue; a no-op while every process is already draining"""
+        with self._lock:
+            if self._draining >= self.workers:
+                return
+            self._draining += 1
+        pool = None
+        try:
+            pool = self._get_pool()
+            future = pool.submit(drain_jobs, self.store.directory)
+        except Exception as e:
+            # e.g. a pool broken by a crashed job process: the job stays queued for the next wake-up
+            logger.warning("Could not start a job process: %s", e)
+            with self._lock:
+                self._draining -= 1
+            self._discard_pool(pool)
+            return
+        future.add_done_callback(lambda future: self._drained(pool, future))
+
+    def _discard_pool(self, pool):
+        """Forget a failed pool and shut it down, so its processes and threads don't linger"""
+        if pool is None:
+            return
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def _drained(self, pool, future):
+        with self._lock:
+            self._draining -= 1
+        # run_job records its own errors; a job process that died leaves its job running until
+        # recover_orphans requeues it, so start a fresh pool and drain again
+        error = future.exception()
+        if isinstance(error, BrokenProcessPool):
+            self._discard_pool(pool)
+            self.wake()
+        elif error is not None:
+            logger.error("Draining the job queue failed: %s", error)
+
+
+def job_status(job):
+    """Public view of a job row"""
+    return {
+        "job_id": job["id"],
+        "operation": job["operation"],
+        "status": job["status"],
+        "cancel_requested": bool(job["cancel_requested"]),
+        "progress": {"pages_done": job["pages_done"], "pages_total": job["pages_total"]},
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "expires_at": job["expires_at"],
+    }
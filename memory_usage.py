@@ -0,0 +1,92 @@
+import os
+import re
+import resource
+import sys
+
+_CLEAR_REFS = "/proc/self/clear_refs"
+_STATUS = "/proc/self/status"
+_STORE_SUMMARY = re.compile(r"max=(-?\d+), size=(\d+)")
+
+
+def _status_kb(field):
+    try:
+        with open(_STATUS) as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def reset_peak_rss():
+    """Reset the process's peak RSS mark (Linux only); False if it can't be reset"""
+    try:
+        with open(_CLEAR_REFS, "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_kb():
+    """Peak resident set size since the last reset_peak_rss (or process start), in KiB"""
+    peak = _status_kb("VmHWM")
+    if peak is not None:
+        return peak
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and KiB elsewhere
+    return max_rss // 1024 if sys.platform == "darwin" else max_rss
+
+
+def current_rss_kb():
+    """Current resident set size in KiB, or None where /proc isn't available"""
+    return _status_kb("VmRSS")
+
+
+def mupdf_store_usage():
+    """(size, max) of MuPDF's resource store in bytes, or (None, None) if it can't be read
+
+    TOOLS.store_size() is a stub in current PyMuPDF, so this parses the summary
+    line of fz_debug_store. The dump walks every store item: don't call it per page.
+    """
+    try:
+        from pymupdf import mupdf
+        buffer = mupdf.fz_new_buffer(4096)
+        output = mupdf.FzOutput(buffer)
+        mupdf.fz_debug_store(output)
+        output.fz_close_output()
+        text = mupdf.fz_buffer_extract(buffer).decode("utf-8", "replace")
+    except Exception:
+        return None, None
+    match = _STORE_SUMMARY.search(text)
+    if match is None:
+        return None, None
+    # max is -1 (FZ_STORE_UNLIMITED) when the store has no limit
+    return int(match.group(2)), max(int(match.group(1)), 0)
+
+
+def process_alive(pid):
+    """Whether a process with this pid exists"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def trim_mupdf_store(max_bytes):
+    """Evict from MuPDF's resource store until it holds at most max_bytes; returns the bytes freed
+
+    PyMuPDF can't lower the store limit of its context (TOOLS.store_maxsize is a
+    read-only stub), so the cap is enforced by shrinking the store between requests.
+    """
+    size, _ = mupdf_store_usage()
+    if not max_bytes or size is None or size <= max_bytes:
+        return 0
+    from pymupdf import mupdf
+    mupdf.fz_shrink_store(max_bytes * 100 // size)
+    remaining, _ = mupdf_store_usage()
+    return size - (remaining or 0)
@@ -0,0 +1,113 @@
+import gzip
+import json
+
+from instrumentation import stage
+from text_extraction import CONTENT_TYPES
+
+try:
+    import orjson
+except ImportError:  # optional, speeds up serialization of large responses
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # optional, enables Content-Encoding: br
+    brotli = None
+
+# Responses smaller than this aren't worth compressing
+MIN_COMPRESS_BYTES = 1024
+# Fast settings: these responses are generated per request, not stored
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 4
+
+_TYPE_CODES = {name: code for code, name in enumerate(CONTENT_TYPES)}
+
+
+def dumps(obj):
+    """Compact JSON bytes, using orjson when available"""
+    with stage("serialize"):
+        if orjson is not None:
+            return orjson.dumps(obj)
+        return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def columnar_page(page):
+    """Parallel arrays for one extract-text page ({"page_number", "content"})
+
+    Entry i of every array describes the same content entry. parent holds the
+    index of a span's line (or -1, also when features= left the lines out),
+    field_name maps the indices of FieldValue lines to their label.
+    """
+    types, texts, bboxes, parents, field_names = [], [], [], [], {}
+    positions = {}
+    for position, (entry_id, entry) in enumerate(page["content"].items()):
+        positions[entry_id] = position
+        metadata = entry["metadata"]
+        types.append(_TYPE_CODES[entry["type"]])
+        texts.append(entry["text"])
+        bboxes.append(metadata.get("bbox"))
+        parent = metadata.get("parent_line")
+        parents.append(positions.get(parent, -1))
+        if "field_name" in metadata:
+            field_names[str(position)] = metadata["field_name"]
+    return {
+        "page_number": page["page_number"],
+        "type": types,
+        "text": texts,
+        "bbox": bboxes,
+        "parent": parents,
+        "field_name": field_names,
+    }
+
+
+def columnar_document(pages, filename):
+    """Columnar extract-text body with the document metadata stated once"""
+    return {
+        "metadata": {
+            "filetype": "application/pdf",
+            "filename": filename,
+            "types": list(CONTENT_TYPES),
+        },
+        "pages": pages,
+    }
+
+
+def choose_encoding(accept_encoding):
+    """Best Content-Encoding we can produce for an Accept-Encoding header, or None"""
+    accepted = {}
+    for item in (accept_encoding or "").split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    if brotli is not None and accepted.get("br", 0) > 0:
+        return "br"
+    if accepted.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+
+def compress(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+def compress_response(response, accept_encoding):
+    """Compress a buffered JSON response in place if the client accepts it"""
+    if (response.direct_passthrough or response.is_streamed
+            or response.mimetype != "application/json"
+            or "Content-Encoding" in response.headers):
+        return response
+    body = response.get_data()
+    encoding = choose_encoding(accept_encoding) if len(body) >= MIN_COMPRESS_BYTES else None
+    response.vary.add("Accept-Encoding")
+    if encoding is None:
+        return response
+    response.set_data(compress(body, encoding))
+    response.headers["Content-Encoding"] = encoding
+    return response
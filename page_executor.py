@@ -0,0 +1,107 @@
+import logging
+import math
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from instrumentation import count_pages, stage
+from uploads import open_pdf
+
+logger = logging.getLogger(__name__)
+
+
+def default_page_workers(server_workers=1):
+    """Pool size that keeps server_workers busy sharded requests within the CPU count"""
+    return max(1, (os.cpu_count() or 1) // max(1, server_workers))
+
+
+# Size of the process pool used to shard a document's pages; 1 disables sharding. By default
+# the CPUs are split between the server's workers (gunicorn.conf.py sets it from the real count)
+PAGE_WORKERS = int(os.environ.get("PAGE_WORKERS") or default_page_workers(int(os.environ.get("WEB_CONCURRENCY", 1))))
+# Documents with fewer pages than this are processed in the request's own process
+PAGE_SHARD_MIN_PAGES = int(os.environ.get("PAGE_SHARD_MIN_PAGES", 32))
+# Shards per worker; more shards balance uneven pages better but cost more round trips
+SHARDS_PER_WORKER = 4
+
+# Document opened once per pool worker by _init_worker
+_worker_doc = None
+
+
+def _init_worker(pdf_source):
+    """Open the shared document in a pool worker (fitz documents can't be shared)"""
+    global _worker_doc
+    _worker_doc = open_pdf(pdf_source)
+
+
+def _run_shard(page_fn, page_numbers, args):
+    return [page_fn(_worker_doc[page_num], *args) for page_num in page_numbers]
+
+
+def _shards(page_numbers, workers):
+    size = max(1, math.ceil(len(page_numbers) / (workers * SHARDS_PER_WORKER)))
+    return [page_numbers[i:i + size] for i in range(0, len(page_numbers), size)]
+
+
+def _pool_context():
+    # fork is cheapest and inherits the imported modules; fall back to the platform default
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+    return multiprocessing.get_context()
+
+
+def iter_pages(pdf_source, doc, page_fn, page_numbers=None, args=(), workers=None, min_pages=None):
+    """Yield (page_num, page_fn(page, *args)) in page order, sharding pages over a process pool
+
+    pdf_source is the file path or bytes doc was opened from; every pool worker
+    opens it itself. page_fn must be a module level function and its result picklable. Small
+    documents, a pool size of 1 or a pool that can't be started run in-process
+    on the already open doc.
+    """
+    page_numbers = list(range(doc.page_count) if page_numbers is None else page_numbers)
+    workers = PAGE_WORKERS if workers is None else workers
+    min_pages = PAGE_SHARD_MIN_PAGES if min_pages is None else min_pages
+    workers = min(workers, math.ceil(len(page_numbers) / 2))
+
+    if workers <= 1 or len(page_numbers) < min_pages:
+        for page_num in page_numbers:
+            result = page_fn(doc[page_num], *args)
+            count_pages()
+            yield page_num, result
+        return
+
+    shards = _shards(page_numbers, workers)
+    done = 0
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=_pool_context(),
+                                 initializer=_init_worker, initargs=(pdf_source,)) as pool:
+            # Only keep a window of shards in flight, so finished results don't pile up
+            # faster than the consumer (e.g. a streaming response) drains them
+            window = workers * 2
+            futures = deque(pool.submit(_run_shard, page_fn, shard, args) for shard in shards[:window])
+            submitted = len(futures)
+            try:
+                while futures:
+                    # Time spent waiting on the pool; per-page stages run in the workers
+                    with stage("page_pool"):
+                        results = futures.popleft().result()
+                    if submitted < len(shards):
+                        futures.append(pool.submit(_run_shard, page_fn, shards[submitted], args))
+                        submitted += 1
+                    count_pages(len(results))
+                    for page_num, result in zip(shards[done], results):
+                        yield page_num, result
+                    done += 1
+                    del results
+            finally:
+                # Consumer stopped early or a shard failed: don't start the remaining shards
+                for future in futures:
+                    future.cancel()
+    except (BrokenProcessPool, OSError) as e:
+        logger.warning("Page pool unavailable, continuing in-process: %s", e)
+        for shard in shards[done:]:
+            for page_num in shard:
+                result = page_fn(doc[page_num], *args)
+                count_pages()
+                yield page_num, result
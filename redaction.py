@@ -0,0 +1,150 @@
+import json
+import re
+from collections import defaultdict
+
+import fitz  # PyMuPDF
+
+from instrumentation import stage
+from splitting import save_options_from_form
+
+# Fill of the redaction boxes (white, as the endpoint always used)
+REDACT_FILL = (1, 1, 1)
+
+
+def locations_by_page(locations, page_count):
+    """Redaction rects grouped by 0-based page; locations on missing pages are skipped
+
+    Locations use pdfplumber-style coordinates (top-left origin, y downwards),
+    which is also fitz's page space. Raises ValueError on malformed entries.
+    """
+    rects = defaultdict(list)
+    for loc in locations:
+        if not isinstance(loc, dict):
+            raise ValueError("Each location must be an object with page, x0, y0, x1 and y1")
+        try:
+            page_idx = int(loc.get('page', 0))
+            rect = fitz.Rect(float(loc.get('x0', 0)), float(loc.get('y0', 0)),
+                             float(loc.get('x1', 0)), float(loc.get('y1', 0)))
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid location: {json.dumps(loc)}")
+        if 0 <= page_idx < page_count:
+            rects[page_idx].append(rect)
+    return rects
+
+
+def parse_patterns(patterns):
+    """Search specs from ["literal", {"text": ...}, {"regex": ..., "ignore_case": true}]
+
+    Returns picklable ("text", str) / ("regex", pattern, flags) tuples, so they can
+    be sent to page pool workers. Raises ValueError on bad input.
+    """
+    if not isinstance(patterns, list):
+        raise ValueError("patterns must be a list")
+    specs = []
+    for pattern in patterns:
+        if isinstance(pattern, str):
+            pattern = {"text": pattern}
+        if not isinstance(pattern, dict) or not (pattern.get("text") or pattern.get("regex")):
+            raise ValueError("Each pattern must be a string, {\"text\": ...} or {\"regex\": ...}")
+        if pattern.get("text"):
+            specs.append(("text", str(pattern["text"])))
+            continue
+        flags = re.IGNORECASE if pattern.get("ignore_case") else 0
+        try:
+            re.compile(pattern["regex"], flags)
+        except re.error as e:
+            raise ValueError(f"Invalid regex {pattern['regex']!r}: {e}")
+        specs.append(("regex", pattern["regex"], flags))
+    return specs
+
+
+def _regex_rects(text_dict, pattern):
+    """Rects of regex matches within each line of a rawdict, one rect per matched line"""
+    rects = []
+    for block in text_dict["blocks"]:
+        for line in block.get("lines", ()):
+            chars = [char for span in line["spans"] for char in span["chars"]]
+            if not chars:
+                continue
+            text = "".join(char["c"] for char in chars)
+            for match in pattern.finditer(text):
+                if match.start() == match.end():
+                    continue
+                rect = fitz.Rect()
+                for char in chars[match.start():match.end()]:
+                    rect |= char["bbox"]
+                rects.append(tuple(rect))
+    return rects
+
+
+def page_pattern_rects(page, specs):
+    """Bounding boxes (x0, y0, x1, y1) of every pattern hit on one page
+
+    Literal text goes through search_for (case-insensitive, may span lines);
+    regexes are matched per line against the page's characters. One textpage
+    serves all patterns.
+    """
+    with stage("get_text"):
+        textpage = page.get_textpage(flags=fitz.TEXT_PRESERVE_WHITESPACE | fitz.TEXT_PRESERVE_LIGATURES)
+    rects = []
+    raw = None
+    with stage("search"):
+        for spec in specs:
+            if spec[0] == "text":
+                rects.extend(tuple(rect) for rect in page.search_for(spec[1], textpage=textpage))
+            else:
+                if raw is None:
+                    raw = page.get_text("rawdict", textpage=textpage)
+                rects.extend(_regex_rects(raw, re.compile(spec[1], spec[2])))
+    return rects
+
+
+def pages_with_redact_annots(doc):
+    """0-based numbers of the pages that already carry Redact annotations
+
+    Only pages with an /Annots entry are loaded to look at their annotations.
+    """
+    pages = set()
+    for page_idx in range(doc.page_count):
+        if doc.xref_get_key(doc.page_xref(page_idx), "Annots")[0] == "null":
+            continue
+        if any(True for _ in doc.load_page(page_idx).annots(types=[fitz.PDF_ANNOT_REDACT])):
+            pages.add(page_idx)
+    return pages
+
+
+def apply_redactions(doc, rects_by_page, fill=REDACT_FILL):
+    """Redact the given rects, loading and applying each touched page once
+
+    Redact annotations already in the uploaded document are applied as well,
+    as they always were. Returns (redaction boxes applied, pages redacted).
+    """
+    with stage("redact"):
+        annotated = pages_with_redact_annots(doc)
+    applied = 0
+    pages = 0
+    for page_idx in sorted(annotated | {page_idx for page_idx, rects in rects_by_page.items() if rects}):
+        page = doc.load_page(page_idx)
+        rects = rects_by_page.get(page_idx, ())
+        with stage("redact"):
+            for rect in rects:
+                page.add_redact_annot(rect, fill=fill)
+            applied += sum(1 for _ in page.annots(types=[fitz.PDF_ANNOT_REDACT]))
+            page.apply_redactions()
+        pages += 1
+    return applied, pages
+
+
+def redaction_save_options(form, default_deflate=True):
+    """Save options of a redacted document; incremental saves are refused
+
+    An incremental save appends the changes and keeps the original objects,
+    so the redacted content would remain recoverable from the file.
+    """
+    if str(form.get("incremental", "")).strip().lower() in ("1", "true", "yes", "on"):
+        raise ValueError("incremental saves keep the unredacted content in the file and are not allowed")
+    options = save_options_from_form(form)
+    if default_deflate and "deflate" not in form:
+        # The endpoint always deflated its output
+        options.update(deflate=True)
+    return options
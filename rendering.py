@@ -0,0 +1,169 @@
+import hashlib
+import json
+import os
+import tempfile
+import zipfile
+
+import fitz  # PyMuPDF
+
+from instrumentation import count_pages, stage
+from result_cache import LRUCache
+
+# Bump when rendering or encoding changes; the MuPDF version is part of every key as well
+RENDER_VERSION = "1"
+# Byte budget of the per-worker cache of encoded page images; 0 disables it
+RENDER_CACHE_MAX_BYTES = int(os.environ.get("RENDER_CACHE_MAX_BYTES", 128 * 1024 * 1024))
+# Largest accepted dpi and largest raster (width * height) of one rendered page or clip
+RENDER_MAX_DPI = int(os.environ.get("RENDER_MAX_DPI", 600))
+RENDER_MAX_PIXELS = int(os.environ.get("RENDER_MAX_PIXELS", 40 * 1000 * 1000))
+RENDER_DEFAULT_DPI = 150
+RENDER_DEFAULT_QUALITY = 85
+
+# format= -> (mimetype, file extension)
+RENDER_FORMATS = {
+    "png": ("image/png", "png"),
+    "jpeg": ("image/jpeg", "jpg"),
+    "webp": ("image/webp", "webp"),
+}
+RENDER_COLORSPACES = {"rgb": fitz.csRGB, "gray": fitz.csGRAY}
+# Encoded images don't shrink any further, so batch zips only store them
+RENDER_ZIP_COMPRESSION = zipfile.ZIP_STORED
+
+
+def parse_clip(spec):
+    """(x0, y0, x1, y1) in points from "x0,y0,x1,y1" (top-left origin, like redaction locations)"""
+    try:
+        coords = tuple(float(value) for value in spec.split(","))
+    except ValueError:
+        coords = ()
+    if len(coords) != 4:
+        raise ValueError("clip must be four numbers: x0,y0,x1,y1")
+    if coords[0] >= coords[2] or coords[1] >= coords[3]:
+        raise ValueError("clip must have x0 < x1 and y0 < y1")
+    return coords
+
+
+def render_options_from_form(form):
+    """Rendering options from dpi=, clip=, colorspace=, format= and quality= (raises ValueError)"""
+    fmt = form.get("format", "png").lower()
+    if fmt == "jpg":
+        fmt = "jpeg"
+    if fmt not in RENDER_FORMATS:
+        raise ValueError(f"format must be one of {', '.join(RENDER_FORMATS)}")
+    colorspace = form.get("colorspace", "rgb").lower()
+    if colorspace not in RENDER_COLORSPACES:
+        raise ValueError(f"colorspace must be one of {', '.join(RENDER_COLORSPACES)}")
+    try:
+        dpi = int(form.get("dpi", RENDER_DEFAULT_DPI))
+        quality = int(form.get("quality", RENDER_DEFAULT_QUALITY))
+    except (TypeError, ValueError):
+        raise ValueError("dpi and quality must be integers")
+    if not 1 <= dpi <= RENDER_MAX_DPI:
+        raise ValueError(f"dpi must be between 1 and {RENDER_MAX_DPI}")
+    if not 1 <= quality <= 100:
+        raise ValueError("quality must be between 1 and 100")
+    clip = parse_clip(form["clip"]) if form.get("clip") else None
+    return {
+        "dpi": dpi,
+        "clip": clip,
+        "colorspace": colorspace,
+        "format": fmt,
+        # PNG is lossless; don't let quality split the cache for it
+        "quality": quality if fmt != "png" else None,
+    }
+
+
+def render_page(page, options):
+    """Encoded image of a page (or of its clip) with the given rendering options"""
+    rect = page.rect if options["clip"] is None else page.rect & fitz.Rect(options["clip"])
+    if rect.is_empty:
+        raise ValueError(f"clip lies outside page {page.number + 1}")
+    zoom = options["dpi"] / 72
+    pixels = rect.width * zoom * rect.height * zoom
+    if pixels > RENDER_MAX_PIXELS:
+        raise ValueError(f"Page {page.number + 1} would render to {pixels / 1e6:.0f} million pixels, "
+                         f"the limit is {RENDER_MAX_PIXELS / 1e6:.0f} million; lower dpi or clip")
+    with stage("render"):
+        pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), clip=rect,
+                              colorspace=RENDER_COLORSPACES[options["colorspace"]], alpha=False)
+    with stage("encode"):
+        if options["format"] == "png":
+            data = pix.tobytes("png")
+        elif options["format"] == "jpeg":
+            data = pix.tobytes("jpeg", jpg_quality=options["quality"])
+        else:
+            # MuPDF has no WebP writer; Pillow encodes it
+            data = pix.pil_tobytes(format="WEBP", quality=options["quality"])
+    count_pages()
+    return data
+
+
+def render_etag(digest, page_numbers, options):
+    """Strong ETag of the image (one page) or zip (several pages) rendered from a document"""
+    payload = json.dumps([RENDER_VERSION, fitz.VersionBind, digest, list(page_numbers), options], sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()[:32]
+
+
+class RenderCache:
+    """Encoded page images keyed on (document digest, page, rect, dpi, colorspace, format, quality)
+
+    A per-worker LRU bounded by RENDER_CACHE_MAX_BYTES. Single images and batch
+    zip members share its entries.
+    """
+
+    def __init__(self, max_bytes=RENDER_CACHE_MAX_BYTES):
+        self.memory = LRUCache(max_bytes) if max_bytes > 0 else None
+
+    def _key(self, digest, page_num, options):
+        return (RENDER_VERSION, fitz.VersionBind, digest, page_num, options["clip"], options["dpi"],
+                options["colorspace"], options["format"], options["quality"])
+
+    def get(self, digest, page_num, options):
+        if self.memory is None:
+            return None
+        entry = self.memory.get(self._key(digest, page_num, options))
+        return entry[0] if entry is not None else None
+
+    def render(self, doc, digest, page_num, options):
+        """(image bytes, served from cache)"""
+        data = self.get(digest, page_num, options)
+        if data is not None:
+            return data, True
+        data = render_page(doc[page_num], options)
+        if self.memory is not None:
+            self.memory.put(self._key(digest, page_num, options), data, len(data))
+        return data, False
+
+    def stats(self):
+        if self.memory is None:
+            return {"enabled": False}
+        return {"enabled": True, "entries": len(self.memory), "bytes": self.memory.size,
+                "max_bytes": self.memory.max_bytes, "evictions": self.memory.evictions}
+
+
+def page_image_name(page_num, options):
+    """Archive member name of one rendered page, with a 1-based page number"""
+    return f"page_{page_num + 1}.{RENDER_FORMATS[options['format']][1]}"
+
+
+def write_render_zip(doc, digest, page_numbers, options, cache, spool_dir=None):
+    """Zip of one image per page, written to a temp file
+
+    Pages are rendered one at a time and each image is written out before the
+    next one is rendered, so memory doesn't grow with the page count. Returns
+    (temp file rewound to the start, cache hits); the file is deleted when closed.
+    """
+    spool = tempfile.TemporaryFile(suffix=".zip", dir=spool_dir)
+    hits = 0
+    try:
+        with zipfile.ZipFile(spool, "w", RENDER_ZIP_COMPRESSION) as archive:
+            for page_num in page_numbers:
+                data, hit = cache.render(doc, digest, page_num, options)
+                hits += hit
+                archive.writestr(page_image_name(page_num, options), data)
+                del data
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool, hits
@@ -0,0 +1,208 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Bump when the format of cached responses changes; endpoint logic versions are added on top
+RESULT_CACHE_VERSION = "1"
+# Byte budget of the in-memory tier (per worker process); 0 disables it
+RESULT_CACHE_MAX_BYTES = int(os.environ.get("RESULT_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+# Directory of the on-disk tier shared by all gunicorn workers; unset disables it
+RESULT_CACHE_DIR = os.environ.get("RESULT_CACHE_DIR")
+RESULT_CACHE_DISK_MAX_BYTES = int(os.environ.get("RESULT_CACHE_DISK_MAX_BYTES", 1024 * 1024 * 1024))
+# Trim the disk tier every this many stores
+DISK_TRIM_INTERVAL = 32
+# Written into each v<version> directory this cache creates; only marked directories are ever trimmed
+DISK_MARKER = ".pymupdf-result-cache"
+
+
+class LRUCache:
+    """Thread-safe LRU mapping bounded by the total size of its byte values"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, value, size):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            self._entries[key] = (value, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.size -= evicted_size
+                self.evictions += 1
+
+
+class ResultCache:
+    """Serialized endpoint responses keyed on the uploaded bytes, endpoint and parameters
+
+    Two tiers: a per-process LRU bounded by max_bytes and an optional directory
+    shared by every worker. Entries carry the cache version in their key, so
+    bumping a version makes every older entry unreachable; the disk trim ages
+    the files of older versions out first, as they are never read again.
+    """
+
+    def __init__(self, max_bytes=RESULT_CACHE_MAX_BYTES, directory=RESULT_CACHE_DIR,
+                 disk_max_bytes=RESULT_CACHE_DISK_MAX_BYTES, version=RESULT_CACHE_VERSION):
+        self.version = version
+        self.memory = LRUCache(max_bytes) if max_bytes > 0 else None
+        self.root = directory or None
+        self.directory = os.path.join(directory, f"v{version}") if directory else None
+        self.disk_max_bytes = disk_max_bytes
+        self.counters = {"hits": 0, "memory_hits": 0, "disk_hits": 0, "misses": 0,
+                         "stores": 0, "disk_evictions": 0}
+        self._lock = threading.Lock()
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            open(os.path.join(self.directory, DISK_MARKER), "a").close()
+
+    @property
+    def enabled(self):
+        return self.memory is not None or self.directory is not None
+
+    def key(self, digest, endpoint, params=None):
+        """Cache key for an endpoint called on a document with the given parameters"""
+        payload = json.dumps([self.version, endpoint, params or {}], sort_keys=True, default=str)
+        return hashlib.sha256(f"{digest}:{payload}".encode()).hexdigest()
+
+    def get(self, key):
+        """(body, mimetype) of a cached response, or None"""
+        if not self.enabled:
+            return None
+        entry = self.memory.get(key) if self.memory is not None else None
+        if entry is not None:
+            self._count("hits", "memory_hits")
+            return entry[0]
+        entry = self._disk_get(key)
+        if entry is not None:
+            self._count("hits", "disk_hits")
+            if self.memory is not None:
+                self.memory.put(key, entry, len(entry[0]))
+            return entry
+        self._count("misses")
+        return None
+
+    def put(self, key, body, mimetype):
+        if not self.enabled:
+            return
+        self._count("stores")
+        if self.memory is not None:
+            self.memory.put(key, (body, mimetype), len(body))
+        if self.directory:
+            try:
+                self._disk_put(key, body, mimetype)
+            except OSError as e:
+                logger.warning("Could not write result cache entry: %s", e)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+        stats["version"] = self.version
+        if self.memory is not None:
+            stats.update(memory_entries=len(self.memory), memory_bytes=self.memory.size,
+                         memory_max_bytes=self.memory.max_bytes, memory_evictions=self.memory.evictions)
+        if self.directory:
+            stats.update(disk_bytes=sum(size for _, size, _ in self._disk_entries()),
+                         disk_max_bytes=self.disk_max_bytes)
+        return stats
+
+    def _count(self, *names):
+        with self._lock:
+            for name in names:
+                self.counters[name] += 1
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def _disk_get(self, key):
+        if not self.directory:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                mimetype = f.readline().decode().rstrip("\n")
+                body = f.read()
+            # Reads refresh the entry for the LRU trim
+            os.utime(path)
+        except OSError:
+            return None
+        return body, mimetype
+
+    def _disk_put(self, key, body, mimetype):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temp file and rename so other workers never see partial entries
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(mimetype.encode() + b"\n")
+                f.write(body)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        if self.counters["stores"] % DISK_TRIM_INTERVAL == 0:
+            self._trim_disk()
+
+    def _version_directories(self):
+        """The v<version> directories under the cache root that this cache created"""
+        try:
+            names = os.listdir(self.root)
+        except OSError:
+            return []
+        return [os.path.join(self.root, name) for name in names
+                if name.startswith("v") and os.path.isfile(os.path.join(self.root, name, DISK_MARKER))]
+
+    def _disk_entries(self):
+        """(path, size, mtime) of the entries of every cache version, current and old"""
+        entries = []
+        for directory in self._version_directories():
+            for root, _, files in os.walk(directory):
+                for name in files:
+                    # Skips temp files being written and the marker
+                    if name.startswith("."):
+                        continue
+                    try:
+                        st = os.stat(os.path.join(root, name))
+                    except OSError:
+                        continue
+                    entries.append((os.path.join(root, name), st.st_size, st.st_mtime))
+        return entries
+
+    def _trim_disk(self):
+        """Remove the least recently used files until the disk tier fits its budget"""
+        entries = sorted(self._disk_entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total <= self.disk_max_bytes:
+                break
+            try:
+                os.unlink(path)
+                self._count("disk_evictions")
+            except OSError:
+                pass
+            total -= size
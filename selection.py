@@ -0,0 +1,83 @@
+import re
+
+# Passes of /api/extract-text and /api/get-checkboxes that callers can select with features=
+TEXT_FEATURES = ("debug", "lines", "spans", "tables")
+CHECKBOX_FEATURES = ("widgets", "visual")
+
+_RANGE_PATTERN = re.compile(r'^(\d*)\s*-\s*(\d*)$')
+
+
+def parse_page_ranges(spec):
+    """Parse "1-3,5,8-" into 1-based (start, end) ranges; end None means the last page"""
+    ranges = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if part.isdigit():
+            start = end = int(part)
+        else:
+            match = _RANGE_PATTERN.match(part)
+            if not match or not (match.group(1) or match.group(2)):
+                raise ValueError(f"Invalid page range: {part!r}")
+            start = int(match.group(1)) if match.group(1) else 1
+            end = int(match.group(2)) if match.group(2) else None
+        if start < 1 or (end is not None and end < 1):
+            raise ValueError("Page numbers must be positive integers")
+        if end is not None and start > end:
+            raise ValueError(f"Page range start cannot be greater than its end: {part!r}")
+        ranges.append((start, end))
+    if not ranges:
+        raise ValueError("No pages selected")
+    return ranges
+
+
+def _page_number(form, name):
+    """A 1-based page number field, None when absent; raises ValueError like extract_pages' checks"""
+    value = form.get(name)
+    if value is None or value == "":
+        return None
+    try:
+        number = int(value)
+    except ValueError:
+        raise ValueError(f"{name} must be a positive integer")
+    if number < 1:
+        raise ValueError(f"{name} must be a positive integer")
+    return number
+
+
+def page_ranges_from_form(form):
+    """Requested page ranges from pages= or page_start/page_end, or None for all pages"""
+    spec = form.get("pages")
+    if spec:
+        return parse_page_ranges(spec)
+    page_start = _page_number(form, "page_start")
+    page_end = _page_number(form, "page_end")
+    if page_start is None and page_end is None:
+        return None
+    return parse_page_ranges(f"{page_start or ''}-{page_end or ''}")
+
+
+def resolve_pages(ranges, page_count):
+    """Sorted, de-duplicated 0-based page numbers; pages past the end are dropped"""
+    if ranges is None:
+        return list(range(page_count))
+    selected = set()
+    for start, end in ranges:
+        end = page_count if end is None else min(end, page_count)
+        selected.update(range(start - 1, end))
+    return sorted(selected)
+
+
+def parse_features(value, available, name="features"):
+    """Selected features from a comma separated list, all of them if value is empty"""
+    if not value:
+        return frozenset(available)
+    features = frozenset(feature.strip() for feature in value.split(",") if feature.strip())
+    unknown = features - set(available)
+    if unknown:
+        raise ValueError(f"Unknown {name}: {', '.join(sorted(unknown))}; "
+                         f"available: {', '.join(available)}")
+    if not features:
+        raise ValueError(f"No {name} selected")
+    return features
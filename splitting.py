@@ -0,0 +1,91 @@
+import tempfile
+import zipfile
+
+from analysis import copy_pages
+from instrumentation import stage
+from selection import parse_page_ranges
+
+# Garbage collection levels accepted by Document.save (0 = none, 4 = also merge duplicate streams)
+GARBAGE_LEVELS = range(0, 5)
+# Parts of a split zip: PDF streams are already compressed, so the archive only stores them
+SPLIT_ZIP_COMPRESSION = zipfile.ZIP_STORED
+
+_TRUE_VALUES = ("1", "true", "yes", "on")
+
+
+def _flag(form, name):
+    return str(form.get(name, "")).strip().lower() in _TRUE_VALUES
+
+
+def save_options_from_form(form):
+    """Document.save keyword arguments from garbage=, deflate=, object_streams= and linear=
+
+    Defaults match a plain save(). MuPDF no longer linearises, so linear=true
+    is rejected instead of being silently ignored.
+    """
+    try:
+        garbage = int(form.get("garbage", 0))
+    except (TypeError, ValueError):
+        raise ValueError("garbage must be an integer between 0 and 4")
+    if garbage not in GARBAGE_LEVELS:
+        raise ValueError("garbage must be an integer between 0 and 4")
+    if _flag(form, "linear"):
+        raise ValueError("linear is not supported by this PyMuPDF version; "
+                         "use object_streams=true for a compact output instead")
+    options = {"garbage": garbage}
+    if _flag(form, "deflate"):
+        options.update(deflate=True, deflate_images=True, deflate_fonts=True)
+    if _flag(form, "object_streams"):
+        options["use_objstms"] = True
+    return options
+
+
+def split_ranges(spec, page_count):
+    """0-based (first, last) page pairs for each range of "1-3,4-10,11-"; ranges past the end are dropped"""
+    pairs = []
+    for start, end in parse_page_ranges(spec):
+        end = page_count if end is None else min(end, page_count)
+        if start <= end:
+            pairs.append((start - 1, end - 1))
+    if not pairs:
+        raise ValueError(f"No pages selected; the document has {page_count} pages")
+    return pairs
+
+
+def part_name(first, last):
+    """Archive member name of one split part, with 1-based page numbers"""
+    if first == last:
+        return f"pages_{first + 1}.pdf"
+    return f"pages_{first + 1}-{last + 1}.pdf"
+
+
+def write_split_zip(doc, pairs, save_options, spool_dir=None):
+    """Zip of one PDF per (first, last) range, written to a temp file
+
+    Each part is copied with a single insert_pdf call and only one part is
+    in memory at a time. Returns the temp file rewound to the start; it is
+    deleted when closed.
+    """
+    spool = tempfile.TemporaryFile(suffix=".zip", dir=spool_dir)
+    try:
+        with zipfile.ZipFile(spool, "w", SPLIT_ZIP_COMPRESSION) as archive:
+            names = set()
+            for first, last in pairs:
+                name = part_name(first, last)
+                if name in names:
+                    # The same range requested twice gets one member per request
+                    name = name[:-4] + f"_{len(names) + 1}.pdf"
+                names.add(name)
+                part = copy_pages(doc, range(first, last + 1))
+                try:
+                    with stage("save"):
+                        data = part.tobytes(**save_options)
+                    archive.writestr(name, data)
+                    del data
+                finally:
+                    part.close()
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool
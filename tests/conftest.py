@@ -0,0 +1,61 @@
+import base64
+import io
+import os
+import sys
+import tempfile
+
+import pytest
+
+# app.py refuses to import without credentials; caches are off and jobs get a private directory
+os.environ.setdefault("API_USERNAME", "test")
+os.environ.setdefault("API_PASSWORD", "test-password")
+os.environ.setdefault("RESULT_CACHE_MAX_BYTES", "0")
+os.environ.setdefault("RESULT_CACHE_DIR", "")
+os.environ.setdefault("JOB_DIR", tempfile.mkdtemp(prefix="pymupdf-test-jobs-"))
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fitz  # noqa: E402  PyMuPDF
+
+AUTH = {"Authorization": "Basic " + base64.b64encode(b"test:test-password").decode()}
+
+
+def build_pdf(pages=1, text="page {number}"):
+    """Bytes of a PDF with one line of text per page ({number} is the 1-based page number)"""
+    doc = fitz.open()
+    for page_num in range(pages):
+        page = doc.new_page()
+        if text:
+            page.insert_text((72, 72), text.format(number=page_num + 1))
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+@pytest.fixture
+def auth():
+    """Basic auth headers of the test user"""
+    return dict(AUTH)
+
+
+@pytest.fixture
+def make_pdf():
+    """Factory of test PDFs: make_pdf(pages, text="page {number}")"""
+    return build_pdf
+
+
+@pytest.fixture
+def client():
+    import app as service
+    return service.app.test_client()
+
+
+@pytest.fixture
+def post_pdf(client):
+    """post_pdf(path, pdf_bytes, headers=AUTH, **form): multipart POST of a PDF as pdf_file"""
+
+    def post(path, pdf_bytes, headers=AUTH, **form):
+        return client.post(path, headers=headers, content_type="multipart/form-data",
+                           data={"pdf_file": (io.BytesIO(pdf_bytes), "test.pdf"), **form})
+
+    return post
@@ -0,0 +1,50 @@
+import fitz  # PyMuPDF
+
+from checkbox_detection import visual_checkboxes
+
+
+class FailingUnionRender:
+    """A page whose first get_pixmap call fails, like a corrupt image in the union raster"""
+
+    def __init__(self, page):
+        self.page = page
+        self.calls = 0
+
+    def __getattr__(self, name):
+        return getattr(self.page, name)
+
+    def get_pixmap(self, **kwargs):
+        self.calls += 1
+        if self.calls == 1:
+            raise RuntimeError("cannot render")
+        return self.page.get_pixmap(**kwargs)
+
+
+def _checkbox_page():
+    doc = fitz.open()
+    page = doc.new_page()
+    for y, marked in ((100, True), (130, False), (160, True)):
+        page.insert_text((100, y), f"Option at {y}", fontsize=11)
+        box = fitz.Rect(84, y - 10, 94, y)
+        page.draw_rect(box, color=(0, 0, 0), width=0.5)
+        if marked:
+            page.draw_line(box.tl, box.br, width=1)
+            page.draw_line(box.bl, box.tr, width=1)
+    return doc, page
+
+
+def _marked_names(page, raster_mode="page"):
+    text_dict = page.get_text("dict")
+    return [box["name"] for box in visual_checkboxes(page, text_dict, {}, raster_mode=raster_mode)]
+
+
+def test_union_render_failure_falls_back_to_clips():
+    doc, page = _checkbox_page()
+    expected = _marked_names(page, raster_mode="clip")
+    assert expected == ["Option at 100", "Option at 160"]
+    assert _marked_names(page) == expected
+    failing = FailingUnionRender(page)
+    assert _marked_names(failing) == expected
+    # One failed union render, then one clip per candidate
+    assert failing.calls == 4
+    doc.close()
@@ -0,0 +1,220 @@
+"""The single-pass classifier must produce exactly what the three-pass one did"""
+import hashlib
+import json
+import re
+
+import fitz  # PyMuPDF
+import pytest
+
+from benchmarks.corpus import field_form, scanned_form, vector_form
+from text_extraction import extract_page_content
+
+
+def legacy_extract_page_content(page, filename):
+    """The three-pass classifier as it was before text_extraction.classify_page"""
+    page_num = page.number
+    content = {}
+    
+    # Extract text as plain text for debugging
+    plain_text = page.get_text("text")
+    debug_id = hashlib.md5(f"debug_page_{page_num}".encode()).hexdigest()
+    content[debug_id] = {
+        "type": "Debug",
+        "text": plain_text,
+        "metadata": {
+            "filetype": "application/pdf",
+            "page_number": page_num + 1,
+            "filename": filename
+        }
+    }
+    
+    # Get text with structure information
+    text_dict = page.get_text("dict")
+    
+    # Track labels to identify field types
+    labels = {}  # Store label text -> position mapping
+    
+    # First pass: identify labels (likely field names)
+    for block_idx, block in enumerate(text_dict["blocks"]):
+        if "lines" in block:
+            for line_idx, line in enumerate(block["lines"]):
+                for span in line["spans"]:
+                    text = span["text"].strip()
+                    if text.endswith(":") or (len(text) < 30 and text.isupper()):
+                        # This is likely a label
+                        label_key = text.rstrip(":")
+                        labels[label_key] = {
+                            "bbox": line["bbox"],
+                            "page": page_num,
+                            "block": block_idx
+                        }
+    
+    # Second pass: extract all text blocks with type classification
+    for block_idx, block in enumerate(text_dict["blocks"]):
+        if "lines" in block:
+            # Look for potential address patterns
+            block_text = " ".join([
+                span["text"] 
+                for line in block["lines"] 
+                for span in line["spans"]
+            ])
+            
+            # Identify address patterns (postal code patterns in European format)
+            address_pattern = r'\b\d{4,5}[\s,]\s*\w+'
+            is_likely_address = bool(re.search(address_pattern, block_text))
+            
+            # Identify date patterns
+            date_pattern = r'\b\d{1,2}[.-]\d{1,2}[.-]\d{2,4}\b'
+            has_date = bool(re.search(date_pattern, block_text))
+            
+            # Process each line
+            for line_idx, line in enumerate(block["lines"]):
+                line_text = " ".join([span["text"] for span in line["spans"]])
+                
+                # Skip empty lines
+                if not line_text.strip():
+                    continue
+                
+                # Create a unique ID for the line
+                line_id = hashlib.md5(f"{page_num}_{block_idx}_{line_idx}_{line_text}".encode()).hexdigest()
+                
+                # Determine if this line is a value for a label
+                label_match = None
+                for label, info in labels.items():
+                    if (info["page"] == page_num and 
+                        info["block"] == block_idx and
+                        abs(line["bbox"][1] - info["bbox"][3]) < 15):
+                        label_match = label
+                        break
+                
+                # Classify text types based on patterns and structure
+                text_type = "UncategorizedText"
+                metadata = {
+                    "filetype": "application/pdf",
+                    "page_number": page_num + 1,
+                    "filename": filename,
+                    "bbox": line["bbox"]  # Adding bounding box information
+                }
+                
+                # Use font properties
+                font_props = line["spans"][0] if line["spans"] else None
+                is_bold = font_props and (font_props.get("flags", 0) & 2 > 0)
+                font_size = font_props["size"] if font_props else 0
+                
+                # Determine text type based on features
+                if is_likely_address and re.search(r'\d', line_text):
+                    text_type = "Address"
+                elif has_date and re.search(date_pattern, line_text):
+                    text_type = "Date"
+                elif re.search(r'GmbH|AG|Co\.|Inc\.|Ltd\.', line_text):
+                    text_type = "Organization"
+                elif is_bold or font_size > 10:
+                    text_type = "Title"
+                elif label_match:
+                    text_type = "FieldValue"
+                    metadata["field_name"] = label_match
+                elif len(line_text.split()) > 10:
+                    text_type = "NarrativeText"
+                
+                # Add to page-specific results
+                content[line_id] = {
+                    "type": text_type,
+                    "text": line_text.strip(),
+                    "metadata": metadata
+                }
+                
+                # Process individual spans
+                for span_idx, span in enumerate(line["spans"]):
+                    span_text = span["text"].strip()
+                    if not span_text or span_text == line_text.strip():
+                        continue
+                    
+                    span_id = hashlib.md5(f"{page_num}_{block_idx}_{line_idx}_{span_idx}_{span_text}".encode()).hexdigest()
+                    
+                    span_type = "UncategorizedText"
+                    if span.get("flags", 0) & 2 > 0 or span.get("size", 0) > 10:
+                        span_type = "Title"
+                    
+                    content[span_id] = {
+                        "type": span_type,
+                        "text": span_text,
+                        "metadata": {
+                            "filetype": "application/pdf",
+                            "page_number": page_num + 1,
+                            "filename": filename,
+                            "parent_line": line_id,
+                            "bbox": span["bbox"]  # Adding span bounding box
+                        }
+                    }
+    
+    # Extract tables (if present)
+    try:
+        for block_idx, block in enumerate(text_dict["blocks"]):
+            if "lines" in block and len(block["lines"]) > 3:
+                line_structures = []
+                for line in block["lines"]:
+                    line_text = " ".join([span["text"] for span in line["spans"]])
+                    pattern = ""
+                    for part in re.findall(r'[\d.]+|\w+|[^\w\s]', line_text):
+                        if re.match(r'^\d+(\.\d+)?$', part):
+                            pattern += "N"
+                        elif re.match(r'^[A-Za-z]+$', part):
+                            pattern += "T"
+                        else:
+                            pattern += "S"
+                    line_structures.append(pattern)
+                
+                if len(set(line_structures)) < len(line_structures) / 2:
+                    table_id = hashlib.md5(f"table_{page_num}_{block_idx}".encode()).hexdigest()
+                    content[table_id] = {
+                        "type": "Table",
+                        "text": "\n".join([
+                            " | ".join([span["text"] for span in line["spans"]]) 
+                            for line in block["lines"]
+                        ]),
+                        "metadata": {
+                            "filetype": "application/pdf",
+                            "page_number": page_num + 1,
+                            "filename": filename,
+                            "bbox": block["bbox"]  # Adding table bounding box
+                        }
+                    }
+    except Exception as table_error:
+        table_error_id = hashlib.md5(f"table_error_{page_num}".encode()).hexdigest()
+        content[table_error_id] = {
+            "type": "Error",
+            "text": f"Table extraction error: {str(table_error)}",
+            "metadata": {
+                "filetype": "application/pdf",
+                "page_number": page_num + 1,
+                "filename": filename
+            }
+        }
+    
+    return {
+        "page_number": page_num + 1,
+        "content": content
+    }
+
+
+CORPORA = {
+    "vector": lambda: vector_form(3),
+    "glyph": lambda: vector_form(2, glyphs=True),
+    "scanned": lambda: scanned_form(1, dpi=72),
+    "fields": lambda: field_form(2),
+    "dense fields": lambda: field_form(1, fields_per_page=200),
+}
+
+
+@pytest.mark.parametrize("corpus", CORPORA)
+def test_engine_matches_legacy_classifier(corpus):
+    doc = fitz.open(stream=CORPORA[corpus](), filetype="pdf")
+    try:
+        for page in doc:
+            expected = legacy_extract_page_content(page, "corpus.pdf")
+            actual = extract_page_content(page, "corpus.pdf")
+            assert json.dumps(actual, sort_keys=True) == json.dumps(expected, sort_keys=True)
+            # Clients see the elements in insertion order, so that must match as well
+            assert list(actual["content"]) == list(expected["content"])
+    finally:
+        doc.close()
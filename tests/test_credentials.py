@@ -0,0 +1,91 @@
+import time
+
+import pytest
+from werkzeug.security import generate_password_hash
+
+import credentials
+from credentials import CredentialVerifier, TokenIssuer
+
+
+@pytest.fixture
+def hash_checks(monkeypatch):
+    """Passwords passed to check_password_hash, in order"""
+    calls = []
+    check = credentials.check_password_hash
+    monkeypatch.setattr(credentials, "check_password_hash",
+                        lambda pwhash, password: calls.append(password) or check(pwhash, password))
+    return calls
+
+
+@pytest.fixture
+def verifier():
+    return CredentialVerifier({"alice": generate_password_hash("secret")}, ttl=60)
+
+
+def test_wrong_password_is_rejected_after_a_cached_success(verifier, hash_checks):
+    assert verifier.verify("alice", "secret")
+    assert verifier.verify("alice", "secret")
+    assert hash_checks == ["secret"]
+    assert not verifier.verify("alice", "wrong")
+    assert not verifier.verify("alice", "")
+    assert not verifier.verify("bob", "secret")
+    # The failures paid the full hash and left the cached success alone
+    assert hash_checks == ["secret", "wrong", ""]
+    assert verifier.verify("alice", "secret")
+
+
+def test_cached_success_expires_after_ttl(verifier, hash_checks, monkeypatch):
+    now = time.monotonic()
+    monkeypatch.setattr(credentials.time, "monotonic", lambda: now)
+    assert verifier.verify("alice", "secret")
+    monkeypatch.setattr(credentials.time, "monotonic", lambda: now + 59)
+    assert verifier.verify("alice", "secret")
+    assert hash_checks == ["secret"]
+    monkeypatch.setattr(credentials.time, "monotonic", lambda: now + 61)
+    assert verifier.verify("alice", "secret")
+    assert hash_checks == ["secret", "secret"]
+
+
+@pytest.fixture
+def tokens(monkeypatch):
+    import app as service
+    issuer = TokenIssuer(secret="test-secret", ttl=60)
+    monkeypatch.setattr(service, "token_issuer", issuer)
+    return issuer
+
+
+def _bearer(token):
+    return {"Authorization": "Bearer " + token}
+
+
+def test_valid_token_is_accepted(client, tokens, auth):
+    response = client.post("/api/token", headers=auth)
+    assert response.status_code == 200
+    token = response.get_json()["token"]
+    assert client.get("/api/cache-stats", headers=_bearer(token)).status_code == 200
+
+
+def test_expired_token_is_rejected(client, tokens, monkeypatch):
+    token = tokens.issue("test")
+    issued = time.time()
+    monkeypatch.setattr(time, "time", lambda: issued + 120)
+    assert tokens.verify(token) is None
+    assert client.get("/api/cache-stats", headers=_bearer(token)).status_code == 401
+
+
+def test_tampered_token_is_rejected(client, tokens):
+    token = tokens.issue("test")
+    tampered = token[:-2] + ("AA" if not token.endswith("AA") else "BB")
+    assert client.get("/api/cache-stats", headers=_bearer(tampered)).status_code == 401
+    forged = TokenIssuer(secret="other-secret").issue("test")
+    assert client.get("/api/cache-stats", headers=_bearer(forged)).status_code == 401
+
+
+def test_token_of_an_unknown_user_is_rejected(client, tokens):
+    assert tokens.verify(tokens.issue("mallory")) == "mallory"
+    assert client.get("/api/cache-stats", headers=_bearer(tokens.issue("mallory"))).status_code == 401
+
+
+def test_token_endpoint_requires_basic_auth(client, tokens):
+    response = client.post("/api/token", headers=_bearer(tokens.issue("test")))
+    assert response.status_code == 401
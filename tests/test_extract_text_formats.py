@@ -0,0 +1,53 @@
+import itertools
+import json
+
+import fitz  # PyMuPDF
+import pytest
+
+from selection import TEXT_FEATURES
+
+FEATURE_SETS = [",".join(combo) for size in range(1, len(TEXT_FEATURES) + 1)
+                for combo in itertools.combinations(TEXT_FEATURES, size)]
+
+
+@pytest.fixture(scope="module")
+def pdf_bytes():
+    """Two pages whose lines hold several spans (a label font and a value font)"""
+    doc = fitz.open()
+    label_font, value_font = fitz.Font("helv"), fitz.Font("cour")
+    for page_num in range(2):
+        page = doc.new_page()
+        writer = fitz.TextWriter(page.rect)
+        for row in range(5):
+            writer.append((72, 72 + row * 20), f"Name{page_num}{row}: ", font=label_font, fontsize=11)
+            writer.append(writer.last_point, "value", font=value_font, fontsize=11)
+        writer.write_text(page)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+@pytest.mark.parametrize("features", FEATURE_SETS)
+@pytest.mark.parametrize("output_format", ["json", "ndjson", "columnar"])
+def test_every_format_and_feature_combination(post_pdf, pdf_bytes, output_format, features):
+    response = post_pdf("/api/extract-text", pdf_bytes, format=output_format, features=features)
+    assert response.status_code == 200, response.get_data(as_text=True)
+    if output_format == "ndjson":
+        records = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        assert [record["page_number"] for record in records] == [1, 2]
+        assert all(record.get("type") != "Error" for record in records)
+    elif output_format == "columnar":
+        for page in response.get_json()["pages"]:
+            size = len(page["type"])
+            assert len(page["text"]) == len(page["bbox"]) == len(page["parent"]) == size
+            assert all(-1 <= parent < size for parent in page["parent"])
+    else:
+        assert set(response.get_json()) == {"page_1", "page_2"}
+
+
+def test_columnar_spans_point_at_their_lines(post_pdf, pdf_bytes):
+    page = post_pdf("/api/extract-text", pdf_bytes, format="columnar", features="lines,spans").get_json()["pages"][0]
+    spans = [i for i, parent in enumerate(page["parent"]) if parent != -1]
+    assert spans
+    for i in spans:
+        assert page["parent"][i] < i
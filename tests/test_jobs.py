@@ -0,0 +1,105 @@
+import io
+import multiprocessing
+import os
+import time
+
+import pytest
+from werkzeug.datastructures import FileStorage
+
+import jobs
+from uploads import PdfUpload
+
+
+@pytest.fixture
+def make_upload(make_pdf):
+    """Factory of three-page PdfUploads, as a route would build them"""
+    return lambda: PdfUpload(FileStorage(io.BytesIO(make_pdf(3)), filename="test.pdf"))
+
+
+def _claim_and_die(directory):
+    # A job process that is killed (or recycled) right after claiming its job
+    jobs.JobStore(directory).claim()
+    os._exit(1)
+
+
+def _claim_in_dying_process(directory):
+    process = multiprocessing.get_context("fork").Process(target=_claim_and_die, args=(directory,))
+    process.start()
+    process.join()
+
+
+@pytest.fixture
+def store(tmp_path):
+    return jobs.JobStore(str(tmp_path))
+
+
+def test_claim_takes_each_queued_job_once(store, make_upload):
+    params = {"filename": "test.pdf", "pages": None, "format": "json", "features": ["lines"]}
+    first = store.create("extract-text", params, make_upload())
+    second = store.create("extract-text", params, make_upload())
+    assert store.claim() == first
+    assert store.claim() == second
+    assert store.claim() is None
+    job = store.get(first)
+    assert job["status"] == jobs.RUNNING
+    assert job["owner_pid"] == os.getpid()
+
+
+def test_job_of_a_dead_process_is_requeued_then_failed(store, monkeypatch, make_upload):
+    monkeypatch.setattr(jobs, "JOB_MAX_ATTEMPTS", 2)
+    params = {"filename": "test.pdf", "pages": None, "format": "json", "features": ["lines"]}
+    job_id = store.create("extract-text", params, make_upload())
+
+    _claim_in_dying_process(store.directory)
+    job = store.get(job_id)
+    assert job["status"] == jobs.QUEUED
+    assert job["attempts"] == 1
+
+    _claim_in_dying_process(store.directory)
+    job = store.get(job_id)
+    assert job["status"] == jobs.FAILED
+    assert "exited" in job["error"]
+
+
+def test_requeued_job_runs_to_completion(store, make_upload):
+    params = {"filename": "test.pdf", "pages": None, "format": "json", "features": ["lines"]}
+    job_id = store.create("extract-text", params, make_upload())
+    _claim_in_dying_process(store.directory)
+    assert jobs.drain_jobs(store.directory) == 1
+    job = store.get(job_id)
+    assert job["status"] == jobs.DONE
+    assert job["pages_done"] == job["pages_total"] == 3
+
+
+class _BrokenPool:
+    def __init__(self):
+        self.shutdowns = []
+
+    def submit(self, *args):
+        raise jobs.BrokenProcessPool("a job process died")
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        self.shutdowns.append((wait, cancel_futures))
+
+
+def test_broken_pool_is_shut_down_before_it_is_replaced(store):
+    runner = jobs.JobRunner(store, workers=1)
+    broken = runner._pool = _BrokenPool()
+    runner.wake()
+    assert broken.shutdowns == [(False, True)]
+    assert runner._pool is None and runner._draining == 0
+
+
+def test_job_api_round_trip(client, auth, post_pdf, make_pdf):
+    response = post_pdf("/api/jobs", make_pdf(3), operation="extract-text")
+    assert response.status_code == 202
+    job_id = response.get_json()["job_id"]
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        status = client.get(f"/api/jobs/{job_id}", headers=auth).get_json()["status"]
+        if status in jobs.FINISHED_STATES:
+            break
+        time.sleep(0.1)
+    assert status == jobs.DONE
+    result = client.get(f"/api/jobs/{job_id}/result", headers=auth).get_json()
+    assert set(result) == {"page_1", "page_2", "page_3"}
@@ -0,0 +1,24 @@
+import app as service
+
+
+def test_ndjson_request_is_recorded_after_the_stream(monkeypatch, post_pdf, make_pdf):
+    recorded = []
+    monkeypatch.setattr(service.metrics, "record_request",
+                        lambda endpoint, status, timings, seconds, bytes_in, bytes_out:
+                        recorded.append((endpoint, status, timings.pages)))
+
+    response = post_pdf("/api/extract-text", make_pdf(3), format="ndjson")
+    assert recorded == []
+    assert len(response.get_data(as_text=True).splitlines()) == 3
+    response.close()
+    assert recorded == [("extract_text", 200, 3)]
+
+
+def test_buffered_request_is_recorded_at_once(monkeypatch, post_pdf, make_pdf):
+    recorded = []
+    monkeypatch.setattr(service.metrics, "record_request",
+                        lambda endpoint, status, timings, seconds, bytes_in, bytes_out:
+                        recorded.append((endpoint, status, timings.pages, bytes_out)))
+
+    response = post_pdf("/api/extract-text", make_pdf(3))
+    assert recorded == [("extract_text", 200, 3, response.content_length)]
@@ -0,0 +1,23 @@
+import glob
+import json
+import logging
+import os
+
+import page_executor
+import uploads
+
+
+def test_ndjson_stream_shards_a_spooled_upload(monkeypatch, tmp_path, caplog, post_pdf, make_pdf):
+    # Spool every upload and shard every document over two pool workers
+    monkeypatch.setattr(uploads, "UPLOAD_SPOOL_THRESHOLD", 0)
+    monkeypatch.setattr(uploads, "UPLOAD_SPOOL_DIR", str(tmp_path))
+    monkeypatch.setattr(page_executor, "PAGE_WORKERS", 2)
+    monkeypatch.setattr(page_executor, "PAGE_SHARD_MIN_PAGES", 2)
+
+    with caplog.at_level(logging.WARNING, logger="page_executor"):
+        response = post_pdf("/api/extract-text", make_pdf(8), format="ndjson")
+        records = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+    assert [record["page_number"] for record in records] == list(range(1, 9))
+    assert "Page pool unavailable" not in caplog.text
+    assert glob.glob(os.path.join(str(tmp_path), "*.retained")) == []
@@ -0,0 +1,48 @@
+import json
+
+import fitz  # PyMuPDF
+
+
+def _open(response):
+    assert response.status_code == 200, response.get_data(as_text=True)
+    return fitz.open(stream=response.get_data(), filetype="pdf")
+
+
+def test_pattern_text_is_removed(post_pdf, make_pdf):
+    response = post_pdf("/api/redact", make_pdf(3),
+                        patterns=json.dumps(["page 2", {"regex": r"page\s3"}]))
+    assert response.headers["X-Redacted-Pages"] == "2"
+    doc = _open(response)
+    assert "page 2" not in doc[1].get_text() and doc[1].search_for("page 2") == []
+    assert "page 3" not in doc[2].get_text() and doc[2].search_for("page 3") == []
+    assert "page 1" in doc[0].get_text()
+
+
+def test_untouched_pages_are_unchanged(post_pdf, make_pdf):
+    pdf = make_pdf(3)
+    original = fitz.open(stream=pdf, filetype="pdf")
+    doc = _open(post_pdf("/api/redact", pdf, patterns=json.dumps(["page 2"])))
+    for page_idx in (0, 2):
+        assert doc[page_idx].read_contents() == original[page_idx].read_contents()
+        assert doc[page_idx].get_text() == original[page_idx].get_text()
+    assert doc[1].read_contents() != original[1].read_contents()
+
+
+def test_incremental_save_is_refused(post_pdf, make_pdf):
+    response = post_pdf("/api/redact", make_pdf(1), patterns=json.dumps(["page 1"]), incremental="true")
+    assert response.status_code == 400
+    assert "incremental" in response.get_json()["error"]
+
+
+def test_redact_annotations_in_the_upload_are_applied(post_pdf, make_pdf):
+    doc = fitz.open(stream=make_pdf(3), filetype="pdf")
+    doc[2].add_redact_annot(doc[2].search_for("page 3")[0])
+    locations = [{"page": 0, "x0": 0, "y0": 0, "x1": 200, "y1": 100}]
+    response = post_pdf("/api/redact", doc.tobytes(), locations=json.dumps(locations))
+    assert response.headers["X-Redacted-Pages"] == "2"
+    assert response.headers["X-Redactions"] == "2"
+    redacted = _open(response)
+    assert "page 1" not in redacted[0].get_text()
+    assert "page 2" in redacted[1].get_text()
+    assert "page 3" not in redacted[2].get_text()
+    assert not any(True for page in redacted for _ in page.annots(types=[fitz.PDF_ANNOT_REDACT]))
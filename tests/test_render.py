@@ -0,0 +1,17 @@
+import pytest
+
+
+@pytest.mark.parametrize("page", ["abc", "0", "-1", "1.5"])
+def test_invalid_page_is_rejected(post_pdf, make_pdf, page):
+    response = post_pdf("/api/render", make_pdf(2), dpi="36", page=page)
+    assert response.status_code == 400
+    assert "page" in response.get_json()["error"]
+
+
+def test_page_defaults_to_the_first(post_pdf, make_pdf):
+    pdf = make_pdf(2)
+    response = post_pdf("/api/render", pdf, dpi="36")
+    assert response.status_code == 200
+    assert response.mimetype == "image/png"
+    assert post_pdf("/api/render", pdf, dpi="36", page="2").status_code == 200
+    assert post_pdf("/api/render", pdf, dpi="36", page="3").status_code == 400
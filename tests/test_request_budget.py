@@ -0,0 +1,37 @@
+import pytest
+
+import app as service
+from result_cache import ResultCache
+
+
+def test_no_budget_by_default(post_pdf, make_pdf):
+    pdf = make_pdf(4)
+    response = post_pdf("/api/extract-text", pdf)
+    assert "X-Truncated" not in response.headers
+    assert set(response.get_json()) == {"page_1", "page_2", "page_3", "page_4"}
+    response = post_pdf("/api/get-checkboxes", pdf)
+    assert all(item.get("type") != "Truncated" for item in response.get_json())
+
+
+def test_caller_budget_truncates(post_pdf, make_pdf):
+    response = post_pdf("/api/extract-text", make_pdf(4), max_pages="2")
+    assert response.headers["X-Truncated"] == "page_budget"
+    body = response.get_json()
+    assert body["truncated"]["next_page"] == 3
+    assert {"page_1", "page_2"} <= set(body) and "page_3" not in body
+
+
+@pytest.mark.parametrize("path", ["/api/extract-text", "/api/get-checkboxes"])
+def test_cached_full_response_is_not_replayed_to_a_budgeted_request(monkeypatch, post_pdf, make_pdf, path):
+    monkeypatch.setattr(service, "result_cache", ResultCache(max_bytes=1024 * 1024, directory=None))
+    pdf = make_pdf(4)
+    assert post_pdf(path, pdf).headers["X-Cache"] == "MISS"
+    assert post_pdf(path, pdf).headers["X-Cache"] == "HIT"
+
+    response = post_pdf(path, pdf, max_pages="2")
+    assert response.headers["X-Truncated"] == "page_budget"
+    assert "X-Cache" not in response.headers
+    # A complete response within the budget is cached under that budget
+    short = make_pdf(2)
+    assert post_pdf(path, short, max_pages="2").headers["X-Cache"] == "MISS"
+    assert post_pdf(path, short, max_pages="2").headers["X-Cache"] == "HIT"
@@ -0,0 +1,29 @@
+import os
+
+import result_cache
+from result_cache import ResultCache
+
+
+def test_disk_trim_ages_out_old_versions_and_leaves_foreign_directories(tmp_path, monkeypatch):
+    monkeypatch.setattr(result_cache, "DISK_TRIM_INTERVAL", 1)
+    foreign = tmp_path / "vendor"
+    foreign.mkdir()
+    (foreign / "keep.bin").write_bytes(b"x" * 100)
+    unmarked = tmp_path / "v0"
+    unmarked.mkdir()
+    (unmarked / "keep.bin").write_bytes(b"x" * 100)
+
+    old = ResultCache(max_bytes=0, directory=str(tmp_path), disk_max_bytes=250, version="old")
+    old.put(old.key("a" * 64, "extract-text"), b"x" * 100, "application/json")
+    old_files = [os.path.join(root, name) for root, _, names in os.walk(old.directory)
+                 for name in names if not name.startswith(".")]
+    os.utime(old_files[0], (0, 0))
+
+    new = ResultCache(max_bytes=0, directory=str(tmp_path), disk_max_bytes=250, version="new")
+    assert os.path.exists(old_files[0])
+    for digest in ("b", "c"):
+        new.put(new.key(digest * 64, "extract-text"), b"x" * 100, "application/json")
+
+    assert not os.path.exists(old_files[0])
+    assert new.get(new.key("c" * 64, "extract-text")) is not None
+    assert (foreign / "keep.bin").exists() and (unmarked / "keep.bin").exists()
@@ -0,0 +1,27 @@
+import pytest
+from werkzeug.datastructures import MultiDict
+
+from selection import page_ranges_from_form
+
+
+@pytest.mark.parametrize("form, expected", [
+    ({}, None),
+    ({"pages": "2-3,5"}, [(2, 3), (5, 5)]),
+    ({"page_start": "2"}, [(2, None)]),
+    ({"page_end": "4"}, [(1, 4)]),
+    ({"page_start": "2", "page_end": "4"}, [(2, 4)]),
+])
+def test_page_ranges_from_form(form, expected):
+    assert page_ranges_from_form(MultiDict(form)) == expected
+
+
+@pytest.mark.parametrize("form", [
+    {"page_start": "0"},
+    {"page_end": "-1"},
+    {"page_start": "abc"},
+    {"page_end": "1.5"},
+    {"page_start": "5", "page_end": "2"},
+])
+def test_bad_page_bounds_are_rejected(form):
+    with pytest.raises(ValueError):
+        page_ranges_from_form(MultiDict(form))
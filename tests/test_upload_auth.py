@@ -0,0 +1,17 @@
+import uploads
+
+
+def test_unauthenticated_upload_is_not_parsed(monkeypatch, post_pdf, make_pdf):
+    streams = []
+    parse = uploads.SpoolingRequest._get_file_stream
+    monkeypatch.setattr(uploads.SpoolingRequest, "_get_file_stream",
+                        lambda self, *args, **kwargs: streams.append(args) or parse(self, *args, **kwargs))
+
+    response = post_pdf("/api/extract-text", make_pdf(1), headers={})
+    assert response.status_code == 401
+    assert streams == []
+
+    response = post_pdf("/api/extract-text", make_pdf(1))
+    assert response.status_code == 200
+    assert "upload;dur=" in response.headers["Server-Timing"]
+    assert len(streams) == 1
@@ -0,0 +1,289 @@
+import hashlib
+import math
+import re  # Add this import for regular expressions
+from collections import defaultdict
+
+import fitz  # PyMuPDF
+
+from instrumentation import stage
+
+# Bump whenever a change alters the classifier output, so cached results are invalidated
+CLASSIFIER_VERSION = "1"
+
+# Every entry type the classifier emits; the position is the type code of the columnar format
+CONTENT_TYPES = (
+    "Debug", "UncategorizedText", "Address", "Date", "Organization", "Title",
+    "FieldValue", "NarrativeText", "Table", "Error",
+)
+
+# Patterns are compiled once instead of inside the block/line loops
+# Identify address patterns (postal code patterns in European format)
+ADDRESS_PATTERN = re.compile(r'\b\d{4,5}[\s,]\s*\w+')
+# Identify date patterns
+DATE_PATTERN = re.compile(r'\b\d{1,2}[.-]\d{1,2}[.-]\d{2,4}\b')
+DIGIT_PATTERN = re.compile(r'\d')
+ORGANIZATION_PATTERN = re.compile(r'GmbH|AG|Co\.|Inc\.|Ltd\.')
+TABLE_TOKEN_PATTERN = re.compile(r'[\d.]+|\w+|[^\w\s]')
+NUMBER_TOKEN_PATTERN = re.compile(r'^\d+(\.\d+)?$')
+WORD_TOKEN_PATTERN = re.compile(r'^[A-Za-z]+$')
+
+# Passes of the classifier; callers may select a subset
+ALL_FEATURES = frozenset(("debug", "lines", "spans", "tables"))
+
+# A line is a label's value when its top is within this distance of the label's bottom
+FIELD_VALUE_MAX_GAP = 15
+
+
+class LabelIndex:
+    """Labels of one page, keyed by block and y-band for near constant time value matching
+
+    Reproduces the label dict the classifier used to scan linearly: a label
+    text seen twice keeps its first position in the scan order but the
+    position of its last occurrence, and the first label (in scan order) whose
+    bottom edge is close to a line's top wins.
+    """
+
+    band = FIELD_VALUE_MAX_GAP
+
+    def __init__(self, blocks):
+        labels = {}  # Store label text -> (scan order, bottom edge, block)
+        for block_idx, block in enumerate(blocks):
+            if "lines" not in block:
+                continue
+            for line in block["lines"]:
+                for span in line["spans"]:
+                    text = span["text"].strip()
+                    if text.endswith(":") or (len(text) < 30 and text.isupper()):
+                        # This is likely a label
+                        label_key = text.rstrip(":")
+                        order = labels[label_key][0] if label_key in labels else len(labels)
+                        labels[label_key] = (order, line["bbox"][3], block_idx)
+
+        self.bands = defaultdict(list)
+        for label_key, (order, bottom, block_idx) in labels.items():
+            self.bands[(block_idx, math.floor(bottom / self.band))].append((order, label_key, bottom))
+
+    def match(self, block_idx, top):
+        """Label whose value starts at top in block block_idx, or None"""
+        band = math.floor(top / self.band)
+        best = None
+        # |top - bottom| < band puts the label in the same or an adjacent band
+        for key in ((block_idx, band - 1), (block_idx, band), (block_idx, band + 1)):
+            for order, label_key, bottom in self.bands.get(key, ()):
+                if abs(top - bottom) < FIELD_VALUE_MAX_GAP and (best is None or order < best[0]):
+                    best = (order, label_key)
+        return best[1] if best else None
+
+
+def _table_text(block):
+    """Block text as table rows if its lines repeat a token structure, else None"""
+    line_structures = []
+    for line in block["lines"]:
+        line_text = " ".join([span["text"] for span in line["spans"]])
+        pattern = ""
+        for part in TABLE_TOKEN_PATTERN.findall(line_text):
+            if NUMBER_TOKEN_PATTERN.match(part):
+                pattern += "N"
+            elif WORD_TOKEN_PATTERN.match(part):
+                pattern += "T"
+            else:
+                pattern += "S"
+        line_structures.append(pattern)
+
+    if len(set(line_structures)) < len(line_structures) / 2:
+        return "\n".join([
+            " | ".join([span["text"] for span in line["spans"]])
+            for line in block["lines"]
+        ])
+    return None
+
+
+def _add_line(content, line, line_id, line_text, label_match, is_likely_address, has_date,
+              page_num, filename):
+    """Classify one line and add its entry"""
+    # Classify text types based on patterns and structure
+    text_type = "UncategorizedText"
+    metadata = {
+        "filetype": "application/pdf",
+        "page_number": page_num + 1,
+        "filename": filename,
+        "bbox": line["bbox"]  # Adding bounding box information
+    }
+
+    # Use font properties
+    font_props = line["spans"][0] if line["spans"] else None
+    is_bold = font_props and (font_props.get("flags", 0) & 2 > 0)
+    font_size = font_props["size"] if font_props else 0
+
+    # Determine text type based on features
+    if is_likely_address and DIGIT_PATTERN.search(line_text):
+        text_type = "Address"
+    elif has_date and DATE_PATTERN.search(line_text):
+        text_type = "Date"
+    elif ORGANIZATION_PATTERN.search(line_text):
+        text_type = "Organization"
+    elif is_bold or font_size > 10:
+        text_type = "Title"
+    elif label_match:
+        text_type = "FieldValue"
+        metadata["field_name"] = label_match
+    elif len(line_text.split()) > 10:
+        text_type = "NarrativeText"
+
+    content[line_id] = {
+        "type": text_type,
+        "text": line_text.strip(),
+        "metadata": metadata
+    }
+
+
+def classify_page(text_dict, page_num, filename, plain_text, features=ALL_FEATURES):
+    """Classify the text of one page from a single get_text("dict") result
+
+    Labels are indexed up front, then one walk over the blocks emits lines,
+    spans and tables. Entries are inserted in the same order as the
+    classifier's former three separate passes. Passes missing from features
+    are skipped; text_dict and plain_text may be None if no pass needs them.
+    """
+    content = {}
+
+    # Plain text for debugging
+    if "debug" in features:
+        debug_id = hashlib.md5(f"debug_page_{page_num}".encode()).hexdigest()
+        content[debug_id] = {
+            "type": "Debug",
+            "text": plain_text,
+            "metadata": {
+                "filetype": "application/pdf",
+                "page_number": page_num + 1,
+                "filename": filename
+            }
+        }
+
+    emit_lines = "lines" in features
+    emit_spans = "spans" in features
+    find_tables = "tables" in features
+    if not (emit_lines or emit_spans or find_tables):
+        return content
+
+    blocks = text_dict["blocks"]
+    labels = LabelIndex(blocks) if emit_lines else None
+    tables = []
+    table_error = None
+
+    for block_idx, block in enumerate(blocks):
+        if "lines" not in block:
+            continue
+
+        # Extract tables (if present); the first failure stops table detection for the page
+        if find_tables and table_error is None and len(block["lines"]) > 3:
+            try:
+                table_text = _table_text(block)
+            except Exception as e:
+                table_error = e
+            else:
+                if table_text is not None:
+                    tables.append((block_idx, block, table_text))
+
+        if not (emit_lines or emit_spans):
+            continue
+
+        block_text = " ".join([
+            span["text"]
+            for line in block["lines"]
+            for span in line["spans"]
+        ])
+        is_likely_address = bool(ADDRESS_PATTERN.search(block_text))
+        has_date = bool(DATE_PATTERN.search(block_text))
+
+        # Process each line
+        for line_idx, line in enumerate(block["lines"]):
+            line_text = " ".join([span["text"] for span in line["spans"]])
+
+            # Skip empty lines
+            if not line_text.strip():
+                continue
+
+            # Create a unique ID for the line
+            line_id = hashlib.md5(f"{page_num}_{block_idx}_{line_idx}_{line_text}".encode()).hexdigest()
+
+            if emit_lines:
+                _add_line(content, line, line_id, line_text, labels.match(block_idx, line["bbox"][1]),
+                          is_likely_address, has_date, page_num, filename)
+
+            # Process individual spans
+            if not emit_spans:
+                continue
+            for span_idx, span in enumerate(line["spans"]):
+                span_text = span["text"].strip()
+                if not span_text or span_text == line_text.strip():
+                    continue
+
+                span_id = hashlib.md5(f"{page_num}_{block_idx}_{line_idx}_{span_idx}_{span_text}".encode()).hexdigest()
+
+                span_type = "UncategorizedText"
+                if span.get("flags", 0) & 2 > 0 or span.get("size", 0) > 10:
+                    span_type = "Title"
+
+                content[span_id] = {
+                    "type": span_type,
+                    "text": span_text,
+                    "metadata": {
+                        "filetype": "application/pdf",
+                        "page_number": page_num + 1,
+                        "filename": filename,
+                        "parent_line": line_id,
+                        "bbox": span["bbox"]  # Adding span bounding box
+                    }
+                }
+
+    # Tables follow the line entries, as they did when they had their own pass
+    for block_idx, block, table_text in tables:
+        table_id = hashlib.md5(f"table_{page_num}_{block_idx}".encode()).hexdigest()
+        content[table_id] = {
+            "type": "Table",
+            "text": table_text,
+            "metadata": {
+                "filetype": "application/pdf",
+                "page_number": page_num + 1,
+                "filename": filename,
+                "bbox": block["bbox"]  # Adding table bounding box
+            }
+        }
+    if table_error is not None:
+        table_error_id = hashlib.md5(f"table_error_{page_num}".encode()).hexdigest()
+        content[table_error_id] = {
+            "type": "Error",
+            "text": f"Table extraction error: {str(table_error)}",
+            "metadata": {
+                "filetype": "application/pdf",
+                "page_number": page_num + 1,
+                "filename": filename
+            }
+        }
+
+    return content
+
+
+def page_text(page, plain=True, structured=True):
+    """Plain text and text dict of a page from one text extraction (None where not requested)"""
+    if not (plain or structured):
+        return None, None
+    # One textpage serves both outputs; get_text would build a new one per call
+    with stage("get_text"):
+        textpage = page.get_textpage(flags=fitz.TEXTFLAGS_DICT)
+        plain_text = page.get_text("text", textpage=textpage) if plain else None
+        text_dict = page.get_text("dict", textpage=textpage) if structured else None
+    return plain_text, text_dict
+
+
+def extract_page_content(page, filename, features=ALL_FEATURES):
+    """Extract classified text entries of one page"""
+    plain_text, text_dict = page_text(page, plain="debug" in features,
+                                      structured=not features.isdisjoint(("lines", "spans", "tables")))
+    with stage("classify"):
+        content = classify_page(text_dict, page.number, filename, plain_text, features)
+    return {
+        "page_number": page.number + 1,
+        "content": content
+    }
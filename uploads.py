@@ -0,0 +1,140 @@
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+
+import fitz  # PyMuPDF
+from flask import Request
+
+from instrumentation import stage
+
+# Request bodies above this size are spooled to a named temp file and opened by filename
+UPLOAD_SPOOL_THRESHOLD = int(os.environ.get("UPLOAD_SPOOL_THRESHOLD", 1024 * 1024))
+# Where spooled uploads go (default: the system temp dir)
+UPLOAD_SPOOL_DIR = os.environ.get("UPLOAD_SPOOL_DIR") or None
+# Largest accepted request body in bytes (0 = unlimited); enforced before the body is parsed
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", 0))
+# Largest accepted page count (0 = unlimited); checked right after opening, before any page is parsed
+MAX_UPLOAD_PAGES = int(os.environ.get("MAX_UPLOAD_PAGES", 0))
+
+_DIGEST_CHUNK = 1024 * 1024
+
+
+class UploadRejected(Exception):
+    """An upload that violates a configured limit"""
+
+    def __init__(self, message, status=413, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+class SpoolingRequest(Request):
+    """Request that writes large file parts straight to a named temp file
+
+    Werkzeug's default spools to an anonymous file (or memory), which can only
+    be handed to fitz as bytes. A named file lets MuPDF read the document
+    from disk instead of from a Python copy in worker RAM.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if total_content_length is None or total_content_length > UPLOAD_SPOOL_THRESHOLD:
+            # Deleted when werkzeug closes the request's files
+            return tempfile.NamedTemporaryFile("w+b", suffix=".pdf", prefix="upload-", dir=UPLOAD_SPOOL_DIR)
+        return io.BytesIO()
+
+
+class PdfUpload:
+    """An uploaded PDF, either spooled to disk or held in memory"""
+
+    def __init__(self, file_storage):
+        stream = file_storage.stream
+        name = getattr(stream, "name", None)
+        self.filename = file_storage.filename
+        if isinstance(name, str) and os.path.isfile(name):
+            stream.flush()
+            self.path = name
+            self.data = None
+            self.size = os.path.getsize(name)
+        else:
+            self.path = None
+            self.data = stream.read()
+            self.size = len(self.data)
+        self._digest = None
+        self._retained = False
+
+    @property
+    def source(self):
+        """Path of the spooled file, or the bytes; what page pool workers open"""
+        return self.path if self.path is not None else self.data
+
+    def digest(self):
+        """SHA-256 of the uploaded bytes, read in chunks from disk for spooled uploads"""
+        if self._digest is None:
+            if self.path is None:
+                self._digest = hashlib.sha256(self.data).hexdigest()
+            else:
+                sha = hashlib.sha256()
+                with open(self.path, "rb") as f:
+                    for chunk in iter(lambda: f.read(_DIGEST_CHUNK), b""):
+                        sha.update(chunk)
+                self._digest = sha.hexdigest()
+        return self._digest
+
+    def read(self):
+        """The uploaded bytes (reads spooled uploads into memory)"""
+        if self.path is None:
+            return self.data
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def save(self, path):
+        """Copy the upload to path, e.g. to outlive the request"""
+        if self.path is None:
+            with open(path, "wb") as f:
+                f.write(self.data)
+        else:
+            shutil.copyfile(self.path, path)
+
+    def retain(self):
+        """Keep a spooled upload on disk after the request's files are closed
+
+        Werkzeug deletes the spooled temp file when the request ends, before a
+        streamed response has run; page pool workers open the file by name, so it
+        is hard-linked to a private path that release() removes.
+        """
+        if self.path is not None and not self._retained:
+            retained = f"{self.path}.retained"
+            try:
+                os.link(self.path, retained)
+            except OSError:
+                shutil.copyfile(self.path, retained)
+            self.path = retained
+            self._retained = True
+
+    def release(self):
+        """Remove the copy made by retain()"""
+        if self._retained:
+            self._retained = False
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+
+    def open(self):
+        """Open the document, enforcing the page limit before any page is parsed"""
+        with stage("open"):
+            doc = open_pdf(self.source)
+        if MAX_UPLOAD_PAGES and doc.page_count > MAX_UPLOAD_PAGES:
+            page_count = doc.page_count
+            doc.close()
+            raise UploadRejected(f"PDF has {page_count} pages, the limit is {MAX_UPLOAD_PAGES}")
+        return doc
+
+
+def open_pdf(source):
+    """Open a PDF from a file path or from bytes"""
+    if isinstance(source, str):
+        return fitz.open(source, filetype="pdf")
+    return fitz.open(stream=source, filetype="pdf")